@@ -0,0 +1,174 @@
+'''
+Load test of the full login flows against a real gunicorn server: WebAuthn registration and
+login with a software authenticator (real ES256 attestations and assertions), password
+login and interaction logging. Reports throughput and p50/p95/p99 latency per endpoint and
+compares them with a baseline saved in `benchmarks/baselines/`.
+
+    python -m benchmarks.ceremonies [--concurrency 8] [--duration 20] [--workers 2]
+    python -m benchmarks.ceremonies --save-baseline       # after an intended change
+    python -m benchmarks.ceremonies --max-regression 25   # exit 1 if a p95 got >25% slower
+
+By default the server uses a throwaway SQLite database; pass --use-env-database to run
+against the database described by the DB_* variables (e.g. a local MariaDB).
+'''
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+from .load import Client, Results, Server, run_load
+from tests.soft_authenticator import SoftAuthenticator
+from .worker_models import INTERACTIONS, PASSWORD, email_for, register_users
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+RP_ID = 'localhost'
+ORIGIN = 'https://localhost'
+
+_registrations = itertools.count()
+
+
+def webauthn_email_for(index):
+    return f'fido{index}@example.com'
+
+
+def register_with_authenticator(client, email, authenticator):
+    client.get('/register', label='GET /register')
+    status, body = client.post_form(
+        '/webauthn/registration/start', {'email': email}, label='POST /webauthn/registration/start', expect=200)
+    if status != 200:
+        return False
+    status, _ = client.post_text(
+        '/webauthn/registration/verify-credentials', authenticator.create(json.loads(body)),
+        label='POST /webauthn/registration/verify-credentials', expect=200)
+    client.post_form('/logout', {'csrf_token': client.csrf_token}, label='POST /logout')
+    return status == 200
+
+
+def login_with_authenticator(client, email, authenticator):
+    client.get('/login', label='GET /login')
+    status, body = client.post_form(
+        '/webauthn/login/start', {'email': email}, label='POST /webauthn/login/start', expect=200)
+    if status == 200:
+        client.post_text('/webauthn/login/verify-assertion', authenticator.get(json.loads(body)),
+                         label='POST /webauthn/login/verify-assertion', expect=200)
+    client.post_form('/logout', {'csrf_token': client.csrf_token}, label='POST /logout')
+
+
+def setup_authenticators(base_url, count):
+    '''Registers one WebAuthn user per client thread and returns their authenticators'''
+    authenticators = []
+    for index in range(count):
+        authenticator = SoftAuthenticator(RP_ID, ORIGIN)
+        if not register_with_authenticator(Client(base_url, Results()), webauthn_email_for(index), authenticator):
+            raise RuntimeError('WebAuthn registration failed; check RP_ID and ORIGIN match the server')
+        authenticators.append(authenticator)
+    return authenticators
+
+
+def make_scenario(authenticators):
+    def scenario(client, index):
+        # A new participant registers an authenticator...
+        register_with_authenticator(
+            client, f'new{next(_registrations)}@example.com', SoftAuthenticator(RP_ID, ORIGIN))
+
+        # ...a returning one logs in with theirs while the page logs interactions...
+        client.get('/login', label='GET /login')
+        client.post_json('/interactions/submit', INTERACTIONS, label='POST /interactions/submit', expect=200)
+        login_with_authenticator(client, webauthn_email_for(index), authenticators[index])
+
+        # ...and another logs in with a password
+        client.get('/login', label='GET /login')
+        client.post_form('/login', {'email': email_for(index), 'password': PASSWORD, 'csrf_token': client.csrf_token},
+                         label='POST /login', expect=302)
+        client.post_form('/logout', {'csrf_token': client.csrf_token}, label='POST /logout')
+
+    return scenario
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f'{name}.json')
+
+
+def compare(summary, baseline):
+    '''Prints each endpoint's change from the baseline; returns the worst p95 change in percent'''
+    worst = 0.0
+    print(f'\n{"endpoint":<48} {"req/s":>16} {"p50 ms":>16} {"p95 ms":>16} {"p99 ms":>16}')
+    for label, row in summary.items():
+        before = baseline['endpoints'].get(label)
+        if before is None:
+            print(f'{label:<48} (not in baseline)')
+            continue
+
+        cells = []
+        for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            change = (row[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            cells.append(f'{row[key]:7.1f} {change:+6.0f}%')
+            if key == 'p95_ms':
+                worst = max(worst, change)
+        print(f'{label:<48} ' + ' '.join(f'{cell:>16}' for cell in cells))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--hash-method', default='pbkdf2:sha256:260000', help='PASSWORD_HASH_METHOD for the server')
+    parser.add_argument('--use-env-database', action='store_true', help='use the DB_* settings instead of SQLite')
+    parser.add_argument('--baseline', help='baseline name (default: sqlite, or the DB_PROTOCOL with --use-env-database)')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--max-regression', type=float, help='exit 1 if any p95 is this many percent above the baseline')
+    args = parser.parse_args()
+
+    env = {
+        'GUNICORN_WORKER_CLASS': args.worker_class,
+        'GUNICORN_WORKERS': str(args.workers),
+        'PASSWORD_HASH_METHOD': args.hash_method,
+        'RP_ID': RP_ID,
+        'ORIGIN': ORIGIN,
+    }
+    with Server(env, args.use_env_database) as server:
+        register_users(server.url, args.concurrency)
+        authenticators = setup_authenticators(server.url, args.concurrency)
+        results = run_load(server.url, make_scenario(authenticators), args.concurrency, args.duration)
+
+    summary = results.summary()
+    total = sum(row['requests'] for row in summary.values())
+    print(f'{args.workers} {args.worker_class} workers, {args.concurrency} clients, {total / results.elapsed:.1f} req/s overall')
+    results.print_summary()
+
+    name = args.baseline or (os.environ.get('DB_PROTOCOL', 'sqlite') if args.use_env_database else 'sqlite')
+    path = baseline_path(name)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'settings': {key: getattr(args, key) for key in ('workers', 'worker_class', 'concurrency', 'duration', 'hash_method')},
+                'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+                'endpoints': {label: {key: round(value, 2) for key, value in row.items()} for label, row in summary.items()},
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'\nSaved the baseline to {os.path.relpath(path)}')
+        return
+
+    if not os.path.exists(path):
+        print(f'\nNo baseline at {os.path.relpath(path)} (run with --save-baseline to create one)')
+        return
+
+    with open(path) as f:
+        baseline = json.load(f)
+    # Run length only changes the sample size, so it needn't match
+    settings = {key: value for key, value in baseline['settings'].items() if key != 'duration'}
+    if settings != {key: getattr(args, key) for key in settings}:
+        print(f'\nNote: the baseline was recorded with different settings: {baseline["settings"]}')
+    worst = compare(summary, baseline)
+    if args.max_regression is not None and worst > args.max_regression:
+        print(f'\np95 regressed by {worst:.0f}% (more than {args.max_regression:.0f}%)')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
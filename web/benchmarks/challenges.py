@@ -0,0 +1,82 @@
+'''
+Measures issue and consume throughput of the WebAuthn challenge stores (the per-process
+memory store and the database store on a throwaway SQLite file), and what expiring costs
+the memory store's time wheel compared with scanning every live challenge.
+
+    python -m benchmarks.challenges [--challenges 20000] [--threads 4]
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import time
+from .common import app, setup_database
+from fido_app.challenges import DatabaseChallengeStore, MemoryChallengeStore
+
+DATA = {'challenge': 'x' * 86, 'email': 'participant@example.com'}
+
+
+def run(store, count, threads):
+    '''Issues then consumes `count` challenges from `threads` threads; returns both rates'''
+    def in_app_context(func):
+        def wrapped(item):
+            with app.app_context():
+                return func(item)
+        return wrapped
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        handles = list(pool.map(in_app_context(lambda _: store.issue(DATA)), range(count)))
+        issued = time.perf_counter()
+        consumed = list(pool.map(in_app_context(store.consume), handles))
+        finished = time.perf_counter()
+
+    assert all(data == DATA for data in consumed)
+    return count / (issued - start), count / (finished - issued)
+
+
+def expiry_costs(live):
+    '''Time for the wheel to drop `live` expired challenges, and for one scan over them'''
+    now = [0.0]
+    store = MemoryChallengeStore(ttl=60, clock=lambda: now[0])
+    for _ in range(live):
+        store.issue(DATA)
+    start = time.perf_counter()
+    store.issue(DATA)
+    unexpired = time.perf_counter() - start
+
+    now[0] = 61.0
+    start = time.perf_counter()
+    store.issue(DATA)
+    wheel = time.perf_counter() - start
+    assert len(store) == 1
+
+    # What expiring by scanning would cost on every issue, even with nothing to expire
+    challenges = {str(i): (120.0, DATA) for i in range(live)}
+    start = time.perf_counter()
+    {handle: challenge for handle, challenge in challenges.items() if challenge[0] > now[0]}
+    scan = time.perf_counter() - start
+    return unexpired, wheel, scan
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--challenges', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    setup_database()
+    stores = (('memory', MemoryChallengeStore(ttl=300)), ('database (sqlite)', DatabaseChallengeStore(ttl=300)))
+    print(f'{"store":<20} {"issued/s":>12} {"consumed/s":>12}')
+    for name, store in stores:
+        count = args.challenges if name == 'memory' else args.challenges // 10
+        issue_rate, consume_rate = run(store, count, args.threads)
+        print(f'{name:<20} {issue_rate:12,.0f} {consume_rate:12,.0f}')
+
+    print('\nmemory store holding n live challenges:')
+    for live in (1000, 100000):
+        unexpired, wheel, scan = expiry_costs(live)
+        print(f'  n={live:<7} issue with nothing expired {unexpired * 1e6:8.1f} µs, '
+              f'issue dropping all n {wheel * 1000:7.2f} ms, one scan of all n {scan * 1000:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+''' Shared setup for the benchmark scripts (run them from `web/` with `python -m benchmarks.<name>`) '''
+import os
+import tempfile
+import time
+
+# The app refuses to import without these; benchmarks default them so they can run
+# without a `.env` file
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+os.environ.setdefault('RP_ID', 'localhost')
+os.environ.setdefault('RP_NAME', 'benchmark')
+os.environ.setdefault('ORIGIN', 'https://localhost')
+os.environ.setdefault('DB_PROTOCOL', 'sqlite')
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.gettempdir(), 'fido-benchmark.db'))
+
+from fido_app import app, db  # noqa: E402
+
+
+def setup_database(uri=None):
+    '''
+    Points the app at a fresh database (a throwaway SQLite file by default) and creates
+    every table. Returns the database URI in use.
+    '''
+    if uri is None:
+        uri = f'sqlite:///{tempfile.mkdtemp()}/benchmark.db'
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, SQLALCHEMY_DATABASE_URI=uri)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    return uri
+
+
+def timeit(func, repeat=5):
+    '''Runs `func` `repeat` times and returns the best wall-clock time in seconds'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def percentile(samples, pct):
+    '''Returns the `pct`th percentile (0-100) of a list of samples'''
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
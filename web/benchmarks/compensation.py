@@ -0,0 +1,72 @@
+'''
+Compares building the compensation report with NumPy over batches of login bitmaps
+against a per-user Python loop (`get_credit` plus a bit-by-bit streak scan).
+
+    python -m benchmarks.compensation [--users 100000] [--days 60]
+'''
+import argparse
+from datetime import date, timedelta
+import os
+import random
+import tempfile
+import time
+from .common import app, db, setup_database, timeit
+from fido_app.compensation import bitmap_stats, compensation_report, unpack_bitmaps
+from fido_app.models import User
+from fido_app.utils import get_credit, get_login_days_tracked, is_login_day
+
+
+def random_bitmap(days):
+    # The last byte holds the last complete login, so it is never zero
+    length = random.randint(1, (days + 7) // 8)
+    return random.randbytes(length - 1) + bytes([random.randint(1, 255)])
+
+
+def add_users(count, days):
+    random.seed(0)
+    today = date.today()
+    for first in range(0, count, 10000):
+        db.session.execute(User.__table__.insert(), [{
+            'email': f'user{i}@example.com',
+            'login_bitmap': random_bitmap(days),
+            'last_complete_login': today - timedelta(days=random.randint(0, 3)),
+        } for i in range(first, min(first + 10000, count))])
+    db.session.commit()
+
+
+def per_user_stats(bitmap):
+    '''One user at a time, the way the profile page computes credit'''
+    longest = streak = 0
+    for day in range(get_login_days_tracked(bitmap)):
+        streak = streak + 1 if is_login_day(bitmap, day) else 0
+        longest = max(longest, streak)
+    return get_credit(bitmap), longest, streak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=60, help='Longest login history')
+    args = parser.parse_args()
+
+    setup_database()
+    with app.app_context():
+        add_users(args.users, args.days)
+        bitmaps = [bitmap for (bitmap,) in db.session.query(User.login_bitmap)]
+
+        per_user = timeit(lambda: [per_user_stats(bitmap) for bitmap in bitmaps], repeat=3)
+        vectorized = timeit(lambda: bitmap_stats(unpack_bitmaps(bitmaps)))
+        print(f'credit and streaks for {args.users} users (already loaded):')
+        print(f'  per user:   {per_user * 1000:8.1f} ms')
+        print(f'  vectorized: {vectorized * 1000:8.1f} ms')
+
+        db.session.remove()
+        output = os.path.join(tempfile.mkdtemp(), 'compensation.csv')
+        start = time.perf_counter()
+        summary = compensation_report(output)
+        elapsed = time.perf_counter() - start
+        print(f'full report (query, stats and CSV) for {summary.users} users: {elapsed * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''
+Compares looking up a user by base64url credential id on the old wide user row against
+looking up a `Credential` by the SHA-256 of its raw id.
+
+    python -m benchmarks.credential_lookup [--users N] [--lookups N]
+'''
+import argparse
+import os
+import random
+import time
+import sqlalchemy as sa
+from webauthn.helpers import bytes_to_base64url
+from .common import app, db, setup_database
+from fido_app.models import Credential, User
+from fido_app.utils import hash_credential_id
+
+# The user table as it looked before credentials got their own table
+legacy_user = sa.Table(
+    'legacy_user', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('email', sa.String(80), unique=True),
+    sa.Column('display_name', sa.String(80)),
+    sa.Column('password_hash', sa.String(128)),
+    sa.Column('credential_id', sa.String(400), unique=True),
+    sa.Column('ukey', sa.String(32), unique=True),
+    sa.Column('public_key', sa.String(400), unique=True),
+    sa.Column('sign_count', sa.Integer),
+    sa.Column('authenticator_id', sa.String(40)),
+)
+
+
+def populate(count):
+    raw_ids = [os.urandom(64) for _ in range(count)]
+    legacy_rows, users, credentials = [], [], []
+    for i, raw_id in enumerate(raw_ids, start=1):
+        public_key = os.urandom(77)
+        legacy_rows.append({
+            'id': i, 'email': f'user{i}@example.com', 'display_name': f'user{i}', 'password_hash': 'x' * 100,
+            'credential_id': bytes_to_base64url(raw_id), 'ukey': f'ukey{i}',
+            'public_key': bytes_to_base64url(public_key), 'sign_count': 0, 'authenticator_id': 'x' * 36,
+        })
+        users.append({'id': i, 'email': f'user{i}@example.com', 'display_name': f'user{i}', 'ukey': f'ukey{i}'})
+        credentials.append({
+            'user_id': i, 'credential_id': raw_id, 'public_key': public_key,
+            'credential_id_hash': hash_credential_id(raw_id), 'sign_count': 0, 'authenticator_id': 'x' * 36,
+        })
+
+    db.session.execute(legacy_user.insert(), legacy_rows)
+    db.session.execute(User.__table__.insert(), users)
+    db.session.execute(Credential.__table__.insert(), credentials)
+    db.session.commit()
+    return raw_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_database()
+    with app.app_context():
+        legacy_user.create(db.engine)
+        raw_ids = random.sample(populate(args.users), min(args.lookups, args.users))
+
+        start = time.perf_counter()
+        for raw_id in raw_ids:
+            db.session.execute(
+                sa.select(legacy_user).where(legacy_user.c.credential_id == bytes_to_base64url(raw_id))
+            ).first()
+        before = time.perf_counter() - start
+
+        credential = Credential.__table__
+        start = time.perf_counter()
+        for raw_id in raw_ids:
+            db.session.execute(
+                sa.select(credential).where(credential.c.credential_id_hash == hash_credential_id(raw_id))
+            ).first()
+        after = time.perf_counter() - start
+
+    print(f'{len(raw_ids)} lookups over {args.users} users')
+    print(f'before (base64url on user row): {before / len(raw_ids) * 1e6:8.1f} us/lookup')
+    print(f'after (credential id hash):     {after / len(raw_ids) * 1e6:8.1f} us/lookup')
+
+
+if __name__ == '__main__':
+    main()
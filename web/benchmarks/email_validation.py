@@ -0,0 +1,40 @@
+'''
+Times email validation on near-miss inputs: the old nested-quantifier pattern doubles its
+running time with every extra character, while the current pattern grows linearly (and
+`validate_email` rejects anything past the length cap before matching at all).
+
+    python -m benchmarks.email_validation
+'''
+import re
+import timeit
+from . import common  # noqa: F401 (sets the environment the app needs)
+from fido_app.utils import EMAIL_PATTERN, validate_email
+
+OLD_PATTERN = re.compile(r'^([a-z0-9]+[\._]?)*[a-z0-9]+@\w+\.\w+$')
+
+
+def best_of(func, number=1):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    print('old pattern on "a" * n + "!":')
+    for length in (16, 18, 20, 22, 24):
+        email = 'a' * length + '!'
+        print(f'  n={length:<6} {best_of(lambda: OLD_PATTERN.search(email)) * 1000:10.2f} ms')
+
+    print('current pattern (uncapped) on adversarial inputs:')
+    for length in (1000, 10000, 100000):
+        for name, email in (
+            ('"a" * n + "!"', 'a' * length + '!'),
+            ('"a." * n/2 + "!"', 'a.' * (length // 2) + '!'),
+            ('"a" * n/2 + "@" + "b" * n/2', 'a' * (length // 2) + '@' + 'b' * (length // 2)),
+        ):
+            print(f'  n={length:<6} {name:<28} {best_of(lambda: EMAIL_PATTERN.fullmatch(email), 20) * 1000:8.3f} ms')
+
+    email = 'a' * 10000 + '!'
+    print(f'validate_email on a 10k-char input: {best_of(lambda: validate_email(email), 1000) * 1e6:.2f} µs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Runs `flask export interaction` (CSV and Parquet) against a synthetic interaction table and
+reports rows/sec and the export process's peak RSS. The table is exported at a tenth of its
+final size and again at full size: streaming keeps peak RSS roughly the same for both.
+
+    python -m benchmarks.export [--rows 10000000] [--chunk-size 10000]
+'''
+import argparse
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from .common import setup_database
+
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EVENTS = ('focus', 'click', 'submit', 'load')
+LOGIN_METHODS = ('did not attempt', 'fido', 'password')
+PAGES = ('/register', '/login', '/add-password')
+
+
+def add_rows(path, start, count):
+    '''Appends `count` synthetic interactions straight through sqlite3 (much faster than the ORM)'''
+    base = datetime(2022, 1, 1)
+    rows = (
+        (f'token{i % 5000}', 'email', EVENTS[i % 4], LOGIN_METHODS[i % 3], PAGES[i % 3],
+         (base + timedelta(seconds=i)).isoformat(sep=' '), f'group{i // 20}')
+        for i in range(start, start + count)
+    )
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            'INSERT INTO interaction (session_token, element, event, login_method, page, timestamp, group_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def run_export(db_path, output, format, chunk_size):
+    '''Runs the export in a child process and returns (seconds, peak RSS in MB, output MB)'''
+    env = dict(os.environ, FLASK_APP='wsgi.py', DB_PROTOCOL='sqlite', DB_NAME=db_path)
+    command = [sys.executable, '-m', 'flask', 'export', 'interaction', '--format', format,
+               '-o', output, '--chunk-size', str(chunk_size)]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=WEB_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    # wait4 reports this child's own resource usage (ru_maxrss is in KB on Linux)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)  # (so Popen knows it was reaped)
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode())
+
+    peak_rss = usage.ru_maxrss / 1024
+    return elapsed, peak_rss, os.path.getsize(output) / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    formats = ['csv']
+    try:
+        import pyarrow  # noqa: F401
+        formats.append('parquet')
+    except ImportError:
+        print('pyarrow is not installed; skipping Parquet')
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'export.db')
+    setup_database(f'sqlite:///{db_path}')
+
+    written = 0
+    for size in (args.rows // 10, args.rows):
+        add_rows(db_path, written, size - written)
+        written = size
+
+        for format in formats:
+            output = os.path.join(directory, 'interaction.csv.gz' if format == 'csv' else 'interaction.parquet')
+            elapsed, peak_rss, output_size = run_export(db_path, output, format, args.chunk_size)
+            print(f'{format:<8} {size:>10} rows: {size / elapsed:>10.0f} rows/s  '
+                  f'peak RSS {peak_rss:>6.1f} MB  output {output_size:>7.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Compares the old per-row ORM insert loop for `/interactions/submit` against the validated
+batch path (one multi-row INSERT).
+
+    python -m benchmarks.interaction_insert
+'''
+from datetime import datetime, timezone
+from uuid import uuid4
+from .common import app, db, setup_database, timeit
+from fido_app.models import Interaction, Session
+from fido_app.interactions import parse_interaction_batch, insert_interaction_rows
+
+BATCH_SIZES = (10, 100, 1000)
+
+
+def make_payload(size):
+    return [
+        {
+            'element': 'email',
+            'event': 'focus',
+            'login_method': 'did not attempt',
+            'page': '/login',
+            'timestampMs': 1647000000000 + i,
+        }
+        for i in range(size)
+    ]
+
+
+def orm_loop(payload, token):
+    '''The original implementation: one ORM object and `session.add` per interaction'''
+    group_id = str(uuid4())
+    for log in payload:
+        db.session.add(Interaction(
+            session_token=token,
+            element=log['element'],
+            event=log['event'],
+            login_method=log['login_method'],
+            page=log['page'],
+            timestamp=datetime.fromtimestamp(log['timestampMs'] / 1000, timezone.utc),
+            group_id=group_id,
+        ))
+    db.session.commit()
+
+
+def batch_insert(payload, token):
+    rows = parse_interaction_batch(payload, token, str(uuid4()))
+    insert_interaction_rows(db.session, rows)
+    db.session.commit()
+
+
+def main():
+    setup_database()
+
+    with app.app_context():
+        token = str(uuid4())
+        db.session.add(Session(token=token))
+        db.session.commit()
+
+        print(f'{"events":>8} {"orm loop (ms)":>15} {"batch (ms)":>12} {"speedup":>9}')
+        for size in BATCH_SIZES:
+            payload = make_payload(size)
+            orm = timeit(lambda: orm_loop(payload, token))
+            batch = timeit(lambda: batch_insert(payload, token))
+            print(f'{size:>8} {orm * 1000:>15.2f} {batch * 1000:>12.2f} {orm / batch:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
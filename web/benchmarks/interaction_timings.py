@@ -0,0 +1,83 @@
+'''
+Compares computing the median FIDO login time from raw interactions (grouping every event of
+every visit) with reading it from the interaction_timing rollup, and measures the backfill.
+
+    python -m benchmarks.interaction_timings [--visits 50000]
+'''
+import argparse
+from datetime import datetime, timedelta
+import statistics
+import time
+import sqlalchemy
+from sqlalchemy import case, func
+from .common import app, db, setup_database, timeit
+from fido_app.interaction_timings import backfill_interaction_timings, median_load_to_submit_ms
+from fido_app.models import Interaction, Session
+
+START = datetime(2022, 1, 1)
+
+
+def add_visits(count):
+    db.session.execute(Session.__table__.insert(), [{'token': f'token{i}'} for i in range(count // 10 + 1)])
+    for first in range(0, count, 5000):
+        rows = []
+        for i in range(first, min(first + 5000, count)):
+            method = ('fido', 'password')[i % 2]
+            start = START + timedelta(minutes=i)
+            events = [(0, 'document', 'load', 'did not attempt'), (800, 'email', 'focus', 'did not attempt'),
+                      (2500, 'password', 'focus', 'did not attempt'), (4000 + i % 7000, 'login-form', 'submit', method)]
+            rows += [{
+                'session_token': f'token{i // 10}', 'group_id': f'group{i}', 'element': element, 'event': event,
+                'login_method': login_method, 'page': '/login', 'timestamp': start + timedelta(milliseconds=offset),
+            } for offset, element, event, login_method in events]
+        db.session.execute(Interaction.__table__.insert(), rows)
+    db.session.commit()
+
+
+def median_from_raw_interactions(page, login_method):
+    '''What every analysis had to do before the rollup: reassemble each visit from its events'''
+    interaction = Interaction.__table__
+    visits = db.session.execute(
+        sqlalchemy.select(
+            func.min(case((interaction.c.event == 'load', interaction.c.timestamp))).label('loaded'),
+            func.min(case((interaction.c.event == 'submit', interaction.c.timestamp))).label('submitted'),
+            func.max(case((interaction.c.event == 'submit', interaction.c.login_method))).label('login_method'),
+        )
+        .where(interaction.c.page == page)
+        .group_by(interaction.c.session_token, interaction.c.group_id)
+    ).all()
+
+    durations = [
+        (datetime.fromisoformat(str(visit.submitted)) - datetime.fromisoformat(str(visit.loaded))).total_seconds() * 1000
+        for visit in visits if visit.login_method == login_method and visit.loaded and visit.submitted
+    ]
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--visits', type=int, default=50000)
+    args = parser.parse_args()
+
+    setup_database()
+    with app.app_context():
+        add_visits(args.visits)
+
+        start = time.perf_counter()
+        written = backfill_interaction_timings()
+        elapsed = time.perf_counter() - start
+        print(f'backfill: {written} visits in {elapsed:.2f}s ({written / elapsed:.0f} visits/s)')
+
+        raw = median_from_raw_interactions('/login', 'fido')
+        rollup = median_load_to_submit_ms('/login', 'fido')
+        assert abs(raw - rollup) < 1, (raw, rollup)
+
+        raw_seconds = timeit(lambda: median_from_raw_interactions('/login', 'fido'), repeat=3)
+        rollup_seconds = timeit(lambda: median_load_to_submit_ms('/login', 'fido'))
+        print(f'median FIDO login time ({rollup:.0f} ms) over {args.visits} visits:')
+        print(f'  from raw interactions: {raw_seconds * 1000:8.1f} ms')
+        print(f'  from the rollup:       {rollup_seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+'''
+Load-test harness: runs the app under a real gunicorn server and drives it with concurrent
+HTTP clients, recording latency per endpoint.
+'''
+import http.cookiejar
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from .common import percentile, setup_database
+
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    '''
+    Runs gunicorn (with gunicorn.conf.py plus `env` overrides) against a fresh SQLite database,
+    or against the database described by the current DB_* variables if `use_env_database` is set
+    '''
+
+    def __init__(self, env=None, use_env_database=False):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        # Every simulated client shares one address, so rate limits are off unless `env` enables them
+        self.env = {**os.environ, 'RATE_LIMIT_ENABLED': 'false', 'GUNICORN_BIND': f'127.0.0.1:{self.port}', **(env or {})}
+        self.use_env_database = use_env_database
+        self.process = None
+
+    def __enter__(self):
+        if not self.use_env_database:
+            path = os.path.join(tempfile.mkdtemp(), 'load.db')
+            setup_database(f'sqlite:///{path}')
+            self.env.update(DB_PROTOCOL='sqlite', DB_NAME=path)
+
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+            cwd=WEB_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    return self
+            except OSError:
+                if self.process.poll() is not None:
+                    raise RuntimeError('gunicorn exited during startup')
+                time.sleep(0.1)
+        raise RuntimeError('gunicorn did not start listening in time')
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=60)
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    '''
+    A browser-like client (cookies, CSRF token, no redirect following) that records the
+    latency of every request into `results` under its endpoint label
+    '''
+
+    def __init__(self, base_url, results):
+        self.base_url = base_url
+        self.results = results
+        self.csrf_token = None
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirects())
+
+    def request(self, method, path, body=None, content_type=None, label=None, expect=None):
+        '''
+        Sends a request and returns (status, body bytes). With `expect`, any other status is
+        counted as an error.
+        '''
+        headers = {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        if self.csrf_token:
+            headers['X-CSRFToken'] = self.csrf_token
+
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                status, data = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, data = e.code, e.read()
+        except OSError:
+            status, data = None, b''
+        failed = expect is not None and status != expect
+        self.results.record(label or f'{method} {path}', time.perf_counter() - start, status, failed)
+        return status, data
+
+    def get(self, path, **kwargs):
+        status, data = self.request('GET', path, **kwargs)
+        match = CSRF_TOKEN_PATTERN.search(data.decode(errors='ignore'))
+        if match:
+            self.csrf_token = match.group(1)
+        return status, data
+
+    def post_form(self, path, fields, **kwargs):
+        body = urllib.parse.urlencode(fields).encode()
+        return self.request('POST', path, body, 'application/x-www-form-urlencoded', **kwargs)
+
+    def post_json(self, path, obj, **kwargs):
+        return self.request('POST', path, json.dumps(obj).encode(), 'application/json', **kwargs)
+
+    def post_text(self, path, text, **kwargs):
+        return self.request('POST', path, text.encode(), 'text/plain', **kwargs)
+
+
+class Results:
+    '''Thread-safe latency samples and error counts per endpoint'''
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds, status, failed=False):
+        with self._lock:
+            self.samples.setdefault(label, []).append(seconds)
+            if failed or status is None or status >= 500:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def summary(self):
+        '''Returns {endpoint: {requests, rps, p50_ms, p95_ms, p99_ms, errors}}'''
+        return {
+            label: {
+                'requests': len(samples),
+                'rps': len(samples) / self.elapsed if self.elapsed else 0.0,
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+                'errors': self.errors.get(label, 0),
+            }
+            for label, samples in sorted(self.samples.items())
+        }
+
+    def print_summary(self):
+        print(f'{"endpoint":<48} {"requests":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>6}')
+        for label, row in self.summary().items():
+            print(f'{label:<48} {row["requests"]:>8} {row["rps"]:>8.1f} {row["p50_ms"]:>8.1f} '
+                  f'{row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f} {row["errors"]:>6}')
+
+
+def run_load(base_url, scenario, concurrency, duration):
+    '''
+    Runs `scenario(client, worker_index)` in a loop on `concurrency` threads for `duration`
+    seconds, each thread with its own `Client`. Returns the `Results`.
+    '''
+    results = Results()
+    deadline = time.time() + duration
+
+    def worker(index):
+        client = Client(base_url, results)
+        while time.time() < deadline:
+            scenario(client, index)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.elapsed = time.perf_counter() - start
+    return results
@@ -0,0 +1,56 @@
+'''
+Times recording a login and counting login days on the `login_bitmap` bytes, against the
+integer bitfield it replaced, for 30, 365 and 3650 days of history. (The old column only
+stored 32 days, so the integer rows past that are for comparison only.)
+
+    python -m benchmarks.login_bitmap
+'''
+import random
+import timeit
+from . import common  # noqa: F401 (sets the environment the app needs)
+from fido_app.utils import append_to_login_bitmap, count_login_days, get_credit
+
+HISTORIES = (30, 365, 3650)
+
+# How get_credit counted the days of the old integer bitfield
+COUNT_INTEGER_BITFIELD = "bin(bitfield).count('1')"
+
+
+def append_to_integer_bitfield(bitfield, days_since_last_login):
+    '''The previous representation, for comparison'''
+    if days_since_last_login <= 0:
+        return bitfield
+    return bitfield + (1 << (bitfield.bit_length() + days_since_last_login - 1))
+
+
+def history(days):
+    '''A bitmap and equivalent integer with about two thirds of `days` logged in'''
+    random.seed(days)
+    bitfield = random.getrandbits(days - 1) | 1 << (days - 1)
+    return bitfield.to_bytes((days + 7) // 8, 'little'), bitfield
+
+
+def per_call(statement, namespace, number=100000):
+    return min(timeit.repeat(statement, globals=namespace, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    print(f'{"days":>6} {"bytes":>6} {"append (ns)":>12} {"int append":>11} {"count (ns)":>11} '
+          f'{"int count":>10} {"last 30 days (ns)":>18}')
+    for days in HISTORIES:
+        bitmap, bitfield = history(days)
+        namespace = {
+            'bitmap': bitmap, 'bitfield': bitfield, 'days': days, 'append_to_login_bitmap': append_to_login_bitmap,
+            'append_to_integer_bitfield': append_to_integer_bitfield, 'get_credit': get_credit,
+            'count_login_days': count_login_days,
+        }
+        print(f'{days:6d} {len(bitmap):6d} '
+              f'{per_call("append_to_login_bitmap(bitmap, 1)", namespace):12.0f} '
+              f'{per_call("append_to_integer_bitfield(bitfield, 1)", namespace):11.0f} '
+              f'{per_call("get_credit(bitmap)", namespace):11.0f} '
+              f'{per_call(COUNT_INTEGER_BITFIELD, namespace):10.0f} '
+              f'{per_call("count_login_days(bitmap, days - 30, days)", namespace):18.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Reports password hashes/sec and login latency at 1, 4 and 16 concurrent clients, with
+hashing run inline and in the process pool.
+
+    python -m benchmarks.password_hashing [--workers N] [--logins-per-client N]
+'''
+import argparse
+import os
+import threading
+import time
+from .common import app, db, setup_database, percentile
+from fido_app.models import User
+from fido_app.passwords import password_hasher
+
+CONCURRENCY = (1, 4, 16)
+EMAIL = 'benchmark@example.com'
+PASSWORD = 'benchmark password'
+
+
+def hashes_per_second(count=20):
+    start = time.perf_counter()
+    for _ in range(count):
+        password_hasher.hash(PASSWORD)
+    return count / (time.perf_counter() - start)
+
+
+def login_latencies(clients, logins_per_client):
+    latencies = []
+    lock = threading.Lock()
+
+    def run_client():
+        client = app.test_client()
+        for _ in range(logins_per_client):
+            start = time.perf_counter()
+            client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+            elapsed = time.perf_counter() - start
+            client.post('/logout')
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=run_client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='process pool size')
+    parser.add_argument('--logins-per-client', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_database()
+    # Queued hashes shouldn't time out while measuring raw throughput
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = 60
+
+    with app.app_context():
+        user = User(email=EMAIL)
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+
+    print(f'method: {password_hasher.method}')
+    for workers in (0, args.workers):
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        mode = 'inline' if workers == 0 else f'pool of {workers}'
+        print(f'\n{mode}: {hashes_per_second():.1f} hashes/sec (single caller)')
+        print(f'{"clients":>8} {"logins/sec":>11} {"p50 (ms)":>9} {"p99 (ms)":>9}')
+
+        for clients in CONCURRENCY:
+            latencies, elapsed = login_latencies(clients, args.logins_per_client)
+            print(f'{clients:>8} {len(latencies) / elapsed:>11.1f} '
+                  f'{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 99) * 1000:>9.1f}')
+
+        password_hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+Per-assertion verification cost for ES256 and RS256 credentials, with the parsed public key
+cache cold (parsed on every call) and warm.
+
+    python -m benchmarks.public_key_verify [--iterations N]
+'''
+import argparse
+import json
+import os
+import time
+from webauthn import generate_authentication_options
+from webauthn.helpers import options_to_json
+from webauthn.helpers.structs import AuthenticationCredential
+from .common import app
+from tests.soft_authenticator import ALGORITHMS, SoftAuthenticator
+from fido_app.public_keys import public_key_cache, verify_assertion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    rp_id, origin = os.environ['RP_ID'], os.environ['ORIGIN']
+
+    print(f'{"algorithm":>9} {"cold (us)":>10} {"warm (us)":>10} {"saved":>7}')
+    for algorithm in ALGORITHMS:
+        authenticator = SoftAuthenticator(rp_id, origin, algorithm)
+        options = generate_authentication_options(rp_id=rp_id)
+        credential = AuthenticationCredential.parse_raw(authenticator.get(json.loads(options_to_json(options))))
+        public_key = authenticator.cose_public_key
+
+        def verify():
+            verify_assertion(
+                credential=credential,
+                credential_id=authenticator.credential_id,
+                credential_public_key=public_key,
+                expected_challenge=options.challenge,
+                expected_rp_id=rp_id,
+                expected_origin=origin,
+                credential_current_sign_count=0,
+                require_user_verification=True,
+            )
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            public_key_cache.clear()
+            verify()
+        cold = (time.perf_counter() - start) / args.iterations
+
+        verify()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            verify()
+        warm = (time.perf_counter() - start) / args.iterations
+
+        print(f'{algorithm:>9} {cold * 1e6:>10.1f} {warm * 1e6:>10.1f} {(1 - warm / cold) * 100:>6.0f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Measures what the rate limits add to a request and what a rejected attempt costs: a bucket
+check on its own (in one process and with several processes sharing the store), then POST
+/login with a wrong password (a password hash and a LoginAttempts commit) through the test
+client with the limits off, allowed by them and rejected by them.
+
+    python -m benchmarks.rate_limits [--requests 50] [--processes 4]
+'''
+import argparse
+from multiprocessing import Pool
+import os
+import tempfile
+import time
+from .common import app, db, setup_database
+from fido_app.models import LoginAttempts, User
+from fido_app.rate_limits import TokenBucketStore
+
+EMAIL = 'participant@example.com'
+PASSWORD = 'correct horse battery'
+UNLIMITED = (10 ** 9, 1.0)
+EXHAUSTED = (1, 10 ** 9)
+
+
+def per_check(store, limit, number):
+    start = time.perf_counter()
+    for i in range(number):
+        store.take(f'key{i % 100}', limit)
+    return (time.perf_counter() - start) / number
+
+
+def hammer(args):
+    '''Bucket checks per second in one of several processes sharing the store'''
+    path, number = args
+    return 1 / per_check(TokenBucketStore(path), UNLIMITED, number)
+
+
+def time_logins(client, data, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        client.post('/login', data=data)
+    return (time.perf_counter() - start) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'rate-limits.db')
+    store = TokenBucketStore(path)
+    print(f'bucket check, allowed:  {per_check(store, UNLIMITED, 20000) * 1e6:8.1f} µs')
+    store.take('rejected', EXHAUSTED)
+    print(f'bucket check, rejected: {per_check(store, EXHAUSTED, 20000) * 1e6:8.1f} µs')
+    with Pool(args.processes) as pool:
+        rates = pool.map(hammer, [(path, 20000)] * args.processes)
+    print(f'{args.processes} processes sharing the store: {sum(rates):,.0f} checks/s')
+
+    setup_database()
+    app.config.update(RATE_LIMIT_STORE=path)
+    with app.app_context():
+        user = User(email=EMAIL)
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+
+        client = app.test_client()
+        wrong = {'email': EMAIL, 'password': 'wrong password'}
+        print(f'\nPOST /login ({args.requests} requests each):')
+        app.config.update(RATE_LIMIT_ENABLED=False)
+        print(f'  wrong password, limits off:     {time_logins(client, wrong, args.requests) * 1000:8.3f} ms')
+
+        app.config.update(RATE_LIMIT_ENABLED=True, RATE_LIMITS={'login': {'ip': UNLIMITED, 'email': UNLIMITED}})
+        print(f'  wrong password, allowed:        {time_logins(client, wrong, args.requests) * 1000:8.3f} ms')
+
+        app.config.update(RATE_LIMITS={'login': {'ip': UNLIMITED, 'email': EXHAUSTED}})
+        print(f'  wrong password, rejected (429): {time_logins(client, wrong, args.requests) * 1000:8.3f} ms')
+        attempts = LoginAttempts.query.filter_by(email=EMAIL).one().password_failures
+        print(f'  ({attempts} failures recorded for {3 * args.requests} attempts)')
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Compares gunicorn worker models (sync, gthread, gevent) by running password logins and
+interaction submissions against each one.
+
+    python -m benchmarks.worker_models [--workers N] [--concurrency N] [--duration SECONDS]
+'''
+import argparse
+import importlib.util
+from .load import Client, Results, Server, run_load
+
+PASSWORD = 'load test password'
+INTERACTIONS = [
+    {'element': 'email', 'event': 'focus', 'login_method': 'did not attempt', 'page': '/login', 'timestampMs': 1647000000000 + i}
+    for i in range(20)
+]
+
+
+def email_for(index):
+    return f'load{index}@example.com'
+
+
+def register_users(base_url, count):
+    for index in range(count):
+        client = Client(base_url, Results())
+        client.get('/register')
+        client.post_form('/register', {
+            'email': email_for(index), 'password': PASSWORD, 'confirm-password': PASSWORD,
+            'csrf_token': client.csrf_token,
+        })
+
+
+def login_and_log_interactions(client, index):
+    client.get('/login', label='GET /login')
+    client.post_json('/interactions/submit', INTERACTIONS, label='POST /interactions/submit')
+    client.post_form('/login', {'email': email_for(index), 'password': PASSWORD, 'csrf_token': client.csrf_token},
+                     label='POST /login')
+    client.post_form('/logout', {'csrf_token': client.csrf_token}, label='POST /logout')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--hash-method', default='pbkdf2:sha256:260000', help='PASSWORD_HASH_METHOD for the server')
+    parser.add_argument('--use-env-database', action='store_true', help='use the DB_* settings instead of SQLite')
+    args = parser.parse_args()
+
+    models = ['sync', 'gthread']
+    if importlib.util.find_spec('gevent'):
+        models.append('gevent')
+
+    for model in models:
+        env = {
+            'GUNICORN_WORKER_CLASS': model,
+            'GUNICORN_WORKERS': str(args.workers),
+            'GUNICORN_THREADS': str(args.threads),
+            'PASSWORD_HASH_METHOD': args.hash_method,
+        }
+        with Server(env, args.use_env_database) as server:
+            register_users(server.url, args.concurrency)
+            results = run_load(server.url, login_and_log_interactions, args.concurrency, args.duration)
+
+        total = sum(row['requests'] for row in results.summary().values())
+        print(f'\n== {model}: {args.workers} workers, {args.concurrency} clients, '
+              f'{total / results.elapsed:.1f} req/s overall')
+        results.print_summary()
+
+
+if __name__ == '__main__':
+    main()
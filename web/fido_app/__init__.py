@@ -4,33 +4,28 @@ from datetime import date
 from flask import Flask
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask.sessions import SecureCookieSessionInterface
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .config import Config
-from .utils import get_credit, get_random_session_token
+from .routing_session import RoutingSQLAlchemy
+from .utils import get_credit
 
 # Create instance of Flask application
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Create own implementation of SessionInterface and set for app
-class SecureCookieSessionInterfaceWithToken(SecureCookieSessionInterface):
-    def open_session(self, app, request):
-        session = super().open_session(app, request)
-        if 'token' not in session:
-            session['token'] = get_random_session_token()
-        return session
+# Behind a reverse proxy, take the client's address from X-Forwarded-For (rate limits use it)
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
 
-    def save_session(self, app, session, response):
-        super().save_session(app, session, response)
-
-app.session_interface = SecureCookieSessionInterfaceWithToken()
-
-# Setup the database
-db = SQLAlchemy(app)
+# Setup the database (reads inside `read_replica()` go to the replica, if configured)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 
+# Use our own SessionInterface (server-side by default; see sessions.py)
+from .sessions import create_session_interface
+app.session_interface = create_session_interface(app)
+
 # Create instance of and initialize LoginManager
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -46,5 +41,5 @@ app.jinja_env.globals.update(
     date=date)
 
 # import declared routes & models
-from . import routes, webauthn_routes, models
+from . import routes, webauthn_routes, models, metrics, instrumentation, exports, interaction_timings, partitions, compensation, rate_limits, assets
 
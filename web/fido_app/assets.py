@@ -0,0 +1,216 @@
+'''
+Static asset pipeline. `flask build-assets` bundles and minifies each page's scripts and
+styles (BUNDLES), names every static file after a hash of its content, and writes gzip and
+brotli copies of the text files next to them, all under static/dist along with a manifest
+of what it built. The caddy image serves static/ itself, caching static/dist forever
+(see the Caddyfile), so static files never reach gunicorn.
+
+Once the manifest exists, `url_for('static', filename=...)` returns the fingerprinted copy
+of a file and `asset_urls` a page's bundle. Without a build (e.g. in development) both fall
+back to the source files, and the third-party libraries to their CDNs.
+'''
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import urllib.request
+import click
+from flask import url_for
+from . import app
+
+DIST_DIR = 'dist'
+MANIFEST_FILE = 'manifest.json'
+
+# Text files that also get precompressed .gz and .br copies
+COMPRESSED_EXTENSIONS = ('.js', '.css', '.svg', '.json')
+
+# Third-party libraries with their CDN URLs, pinned by their Subresource Integrity hashes.
+# The build downloads them into the bundles (after checking the hash)
+VENDOR = {
+    'bootstrap.css': (
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.4.1/css/bootstrap.min.css',
+        'sha384-Vkoo8x4CGsO3+Hhxv8T/Q5PaXtkKtu6ug5TOeNV6gBiFeWPGFN9MuhOf23Q9Ifjh',
+    ),
+    'jquery.js': (
+        'https://code.jquery.com/jquery-3.4.1.slim.min.js',
+        'sha384-J6qa4849blE2+poT4WnyKhv5vZF5SrPo0iEjwBvKU7imGFAV0wwj1yYfoRSJoZ+n',
+    ),
+    'popper.js': (
+        'https://cdn.jsdelivr.net/npm/popper.js@1.16.0/dist/umd/popper.min.js',
+        'sha384-Q6E9RHvbIyZFJoft+2mJbHaEWldlvI9IOYy5n3zV9zzTtmI3UksdQRVvoxMfooAo',
+    ),
+    'bootstrap.js': (
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.4.1/js/bootstrap.min.js',
+        'sha384-wfSDF2E50Y2D1uUdj0O3uMBJnjuUD4Ih7YwaYd1iqfktj0Uod8GCExl3Og8ifwB6',
+    ),
+}
+
+# The files in each page's bundles, in load order: paths under static/, or `vendor:<name>`
+BUNDLES = {
+    'base.css': ['vendor:bootstrap.css', 'styles/main.css'],
+    'base.js': ['vendor:jquery.js', 'vendor:popper.js', 'vendor:bootstrap.js'],
+    'login.js': [
+        'scripts/lib/utils.js', 'scripts/auth-method-toggler.js', 'scripts/login.js', 'scripts/interaction-logging.js',
+    ],
+    'register.js': [
+        'scripts/lib/utils.js', 'scripts/auth-method-toggler.js', 'scripts/register.js', 'scripts/interaction-logging.js',
+    ],
+    'profile.js': ['scripts/lib/utils.js', 'scripts/register.js'],
+}
+
+
+class AssetManifest:
+    '''
+    What the last build wrote: `files` maps each static file to its fingerprinted copy, and
+    `bundles` each bundle to its parts (a built file, and any `vendor:` library left out)
+    '''
+
+    def __init__(self):
+        self.files = {}
+        self.bundles = {}
+
+    def load(self, path=None):
+        '''Reads the manifest (static/dist/manifest.json by default), if there is one'''
+        path = path or os.path.join(app.static_folder, DIST_DIR, MANIFEST_FILE)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        self.files = manifest.get('files', {})
+        self.bundles = manifest.get('bundles', {})
+
+
+manifest = AssetManifest()
+manifest.load()
+
+
+@app.url_defaults
+def _fingerprint_static_files(endpoint, values):
+    '''Makes `url_for('static', filename=...)` point at the built copy of the file'''
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = manifest.files.get(values['filename'], values['filename'])
+
+
+def asset_urls(bundle):
+    '''The (url, integrity) of each file to load for `bundle` (integrity is None for our own)'''
+    urls = []
+    for part in manifest.bundles.get(bundle, BUNDLES[bundle]):
+        if part.startswith('vendor:'):
+            urls.append(VENDOR[part[len('vendor:'):]])
+        else:
+            urls.append((url_for('static', filename=part), None))
+    return urls
+
+
+app.jinja_env.globals.update(asset_urls=asset_urls)
+
+
+def fingerprinted(path, content):
+    '''`path` with the first 12 hex digits of the content's SHA-256 before its extension'''
+    stem, extension = os.path.splitext(path)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+
+def fetch_vendor_file(name):
+    '''Downloads a third-party library and checks it against its pinned integrity hash'''
+    url, integrity = VENDOR[name]
+    with urllib.request.urlopen(url, timeout=30) as response:
+        content = response.read()
+
+    algorithm, expected = integrity.split('-', 1)
+    if base64.b64encode(hashlib.new(algorithm, content).digest()).decode() != expected:
+        raise click.ClickException(f'{url} does not match its integrity hash {integrity}')
+    return content
+
+
+def build_assets(static_folder, vendor=True):
+    '''
+    Writes the fingerprinted files, bundles and their compressed copies to `static_folder`/dist
+    (replacing any earlier build) and returns the manifest. With `vendor=False` the
+    third-party libraries are left out of the bundles and still load from their CDNs.
+    '''
+    try:
+        import brotli
+        import rcssmin
+        import rjsmin
+    except ImportError:
+        raise click.UsageError('Building assets needs brotli, rcssmin and rjsmin (pip install -r requirements.txt)')
+
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    def write(path, content):
+        full_path = os.path.join(dist, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            f.write(content)
+        if not path.endswith(COMPRESSED_EXTENSIONS):
+            return
+
+        # A fixed mtime so rebuilding unchanged files gives identical archives
+        for suffix, compressed in (
+            ('.gz', gzip.compress(content, 9, mtime=0)),
+            ('.br', brotli.compress(content, quality=11)),
+        ):
+            with open(full_path + suffix, 'wb') as f:
+                f.write(compressed)
+
+    files = {}
+    for directory, subdirectories, names in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            subdirectories[:] = [name for name in subdirectories if name != DIST_DIR]
+        for name in sorted(names):
+            source = os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, '/')
+            with open(os.path.join(directory, name), 'rb') as f:
+                content = f.read()
+            files[source] = f'{DIST_DIR}/{fingerprinted(source, content)}'
+            write(fingerprinted(source, content), content)
+
+    bundles = {}
+    for bundle, parts in BUNDLES.items():
+        minify = rjsmin.jsmin if bundle.endswith('.js') else rcssmin.cssmin
+        # Scripts are joined with a semicolon in case one doesn't end with one
+        separator = '\n;\n' if bundle.endswith('.js') else '\n'
+        contents = []
+        bundles[bundle] = []
+        for part in parts:
+            if part.startswith('vendor:'):
+                if not vendor:
+                    bundles[bundle].append(part)
+                    continue
+                # Already minified (and keeps its license comment)
+                contents.append(fetch_vendor_file(part[len('vendor:'):]).decode())
+            else:
+                with open(os.path.join(static_folder, part), encoding='utf-8') as f:
+                    contents.append(minify(f.read(), keep_bang_comments=True))
+
+        if contents:
+            content = separator.join(contents).encode()
+            path = fingerprinted(f'bundles/{bundle}', content)
+            write(path, content)
+            bundles[bundle].append(f'{DIST_DIR}/{path}')
+
+    result = {'files': files, 'bundles': bundles}
+    with open(os.path.join(dist, MANIFEST_FILE), 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return result
+
+
+@app.cli.command('build-assets')
+@click.option('--no-vendor', is_flag=True, help='Keep loading Bootstrap and jQuery from their CDNs')
+def build_assets_command(no_vendor):
+    '''Bundle, minify, fingerprint and precompress the static files into static/dist'''
+    result = build_assets(app.static_folder, vendor=not no_vendor)
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    for bundle, parts in sorted(result['bundles'].items()):
+        for part in parts:
+            if part.startswith('vendor:'):
+                continue
+            path = os.path.join(dist, part[len(DIST_DIR) + 1:])
+            sizes = [os.path.getsize(path + suffix) for suffix in ('', '.gz', '.br')]
+            click.echo(f'{bundle:<12} {part:<40} {sizes[0]:>8} bytes, {sizes[1]:>7} gzip, {sizes[2]:>7} brotli')
+    click.echo(f'Wrote {len(result["files"])} files and {len(result["bundles"])} bundles to {os.path.relpath(dist)}')
@@ -0,0 +1,216 @@
+'''
+Single-use challenges for the WebAuthn ceremonies. Starting a ceremony stores its challenge
+(and whatever else verifying the response needs) under a random, opaque handle, and only the
+handle goes into the browser's session. Verifying consumes the handle, so each challenge can
+be answered at most once, and only within CHALLENGE_TTL_SECONDS.
+
+'database' (the default) keeps challenges in the `webauthn_challenge` table, so any worker can
+finish a ceremony another one started; 'memory' keeps them in a per-process map for tests and
+single-worker development servers.
+
+Challenges handed to anonymous visitors (the one embedded in the login page) are signed
+instead of stored, so rendering a page never writes anything: `issue_signed` returns the
+challenge data signed with the app's secret key, and `consume_signed` checks the signature
+and age, then records the token as spent in the store so it can still only be used once.
+'''
+from datetime import datetime, timedelta
+import hashlib
+import json
+import math
+import secrets
+import threading
+import time
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+import sqlalchemy
+from . import app, db
+
+# Random bytes in each handle (encoded as 22 URL-safe characters)
+HANDLE_BYTES = 16
+
+# Delete expired challenges from the database once every this many issued (or spent) per process
+PRUNE_EVERY = 100
+
+
+def new_handle():
+    return secrets.token_urlsafe(HANDLE_BYTES)
+
+
+def spent_handle(token):
+    '''The handle a spent signed challenge is recorded under (fits the 40-character column)'''
+    return hashlib.sha256(token.encode()).hexdigest()[:40]
+
+
+class MemoryChallengeStore:
+    '''
+    Per-process challenges that expire on a time wheel: each challenge is also filed in the
+    slot for the tick it expires in, and as the clock moves past a tick its whole slot is
+    dropped. Expiring costs time proportional to the number of expired challenges, never a
+    scan of the live ones.
+    '''
+
+    def __init__(self, ttl, tick=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.tick = tick
+        self.clock = clock
+        # A challenge expires at most this many ticks ahead, so its slot is never reused early
+        self._slots = [set() for _ in range(math.ceil(ttl / tick) + 1)]
+        self._challenges = {}
+        self._lock = threading.Lock()
+        self._position = int(clock() // tick)
+
+    def __len__(self):
+        return len(self._challenges)
+
+    def _slot(self, expires):
+        return self._slots[int(expires // self.tick) % len(self._slots)]
+
+    def _advance(self, now):
+        '''Drops the slots of every tick that has passed since the last call'''
+        current = int(now // self.tick)
+        for position in range(max(self._position, current - len(self._slots)), current):
+            slot = self._slots[position % len(self._slots)]
+            for handle in slot:
+                del self._challenges[handle]
+            slot.clear()
+        self._position = max(self._position, current)
+
+    def issue(self, data):
+        '''Stores `data` and returns the handle to consume it with'''
+        handle = new_handle()
+        now = self.clock()
+        expires = now + self.ttl
+        with self._lock:
+            self._advance(now)
+            self._challenges[handle] = (expires, data)
+            self._slot(expires).add(handle)
+        return handle
+
+    def consume(self, handle):
+        '''Returns the data stored under `handle` and forgets it, or None if it's unknown or expired'''
+        now = self.clock()
+        with self._lock:
+            self._advance(now)
+            challenge = self._challenges.pop(handle, None)
+            if challenge is None:
+                return None
+            expires, data = challenge
+            self._slot(expires).discard(handle)
+        return data if expires > now else None
+
+    def spend(self, handle):
+        '''Records `handle` as used for the next `ttl` seconds; returns False if it already was'''
+        now = self.clock()
+        expires = now + self.ttl
+        with self._lock:
+            self._advance(now)
+            if handle in self._challenges:
+                return False
+            self._challenges[handle] = (expires, None)
+            self._slot(expires).add(handle)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._challenges.clear()
+            for slot in self._slots:
+                slot.clear()
+
+
+class DatabaseChallengeStore:
+    '''
+    Challenges in the `webauthn_challenge` table, shared by every worker. Uses its own
+    connection (like the database session store) so it never commits the request's ORM
+    transaction. Consuming deletes the row, and only the caller whose DELETE removed it gets
+    the data, so two workers racing on the same handle can't both use it.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._issued = 0
+
+    @property
+    def table(self):
+        return db.metadata.tables['webauthn_challenge']
+
+    def issue(self, data):
+        handle = new_handle()
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            connection.execute(self.table.insert().values(
+                handle=handle, data=json.dumps(data), expires_at=now + timedelta(seconds=self.ttl)))
+
+        self._issued += 1
+        if self._issued % PRUNE_EVERY == 0:
+            self.prune(now)
+        return handle
+
+    def consume(self, handle):
+        with db.engine.begin() as connection:
+            row = connection.execute(
+                sqlalchemy.select(self.table.c.data, self.table.c.expires_at).where(self.table.c.handle == handle)
+            ).first()
+            if row is None:
+                return None
+            if not connection.execute(self.table.delete().where(self.table.c.handle == handle)).rowcount:
+                return None
+        return json.loads(row.data) if row.expires_at > datetime.utcnow() else None
+
+    def spend(self, handle):
+        '''Records `handle` as used for the next `ttl` seconds; returns False if it already was'''
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(self.table.insert().values(
+                    handle=handle, data='null', expires_at=datetime.utcnow() + timedelta(seconds=self.ttl)))
+        except sqlalchemy.exc.IntegrityError:
+            return False
+
+        self._issued += 1
+        if self._issued % PRUNE_EVERY == 0:
+            self.prune()
+        return True
+
+    def prune(self, now=None):
+        '''Deletes expired challenges (a range scan of the `expires_at` index)'''
+        with db.engine.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.expires_at <= (now or datetime.utcnow())))
+
+    def clear(self):
+        with db.engine.begin() as connection:
+            connection.execute(self.table.delete())
+
+
+def create_challenge_store(app):
+    '''Builds the challenge store selected by the CHALLENGE_BACKEND config value'''
+    backend = app.config['CHALLENGE_BACKEND']
+    ttl = app.config['CHALLENGE_TTL_SECONDS']
+
+    if backend == 'database':
+        return DatabaseChallengeStore(ttl)
+    if backend == 'memory':
+        return MemoryChallengeStore(ttl)
+
+    raise ValueError(f'Unknown CHALLENGE_BACKEND: {backend}')
+
+
+challenge_store = create_challenge_store(app)
+
+
+def _serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt='webauthn-challenge')
+
+
+def issue_signed(data):
+    '''Returns `data` signed with the app's secret key, to be consumed with `consume_signed`'''
+    return _serializer().dumps(data)
+
+
+def consume_signed(token):
+    '''
+    Returns the data in a token from `issue_signed` the first time it's consumed within
+    CHALLENGE_TTL_SECONDS of being issued, or None if it's forged, expired or already spent
+    '''
+    try:
+        data = _serializer().loads(token, max_age=challenge_store.ttl)
+    except BadSignature:
+        return None
+    return data if challenge_store.spend(spent_handle(token)) else None
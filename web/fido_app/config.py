@@ -1,7 +1,8 @@
 '''Flask app configuration'''
 import os
+import tempfile
 from dotenv import load_dotenv
-from .utils import get_database_uri_from
+from .utils import get_database_uri_from, get_engine_options_from, get_rate_limits_from
 
 load_dotenv()
 
@@ -12,6 +13,78 @@ class Config(object):
     # Database setup
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = get_database_uri_from(os.environ)
+    # Connection pool: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    # DB_POOL_PRE_PING and DB_CONNECT_TIMEOUT (see `get_engine_options_from`)
+    SQLALCHEMY_ENGINE_OPTIONS = get_engine_options_from(os.environ)
+
+    # Optional read replica (see `get_database_uri_from`). Only code wrapped in `read_replica()`
+    # reads from it, and a browser's reads stay on the primary for
+    # REPLICA_READ_YOUR_WRITES_SECONDS after it writes (longer than the replication lag)
+    _replica_uri = get_database_uri_from(os.environ, replica=True)
+    SQLALCHEMY_BINDS = {'replica': _replica_uri} if _replica_uri else {}
+    REPLICA_READ_YOUR_WRITES_SECONDS = float(os.getenv('REPLICA_READ_YOUR_WRITES_SECONDS', 10))
+
+    # Sessions: 'database' keeps session data in the session table and only an opaque id in the
+    # cookie, 'memory' keeps it in a per-process LRU (tests/development), and 'cookie' keeps
+    # everything in the signed cookie
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'database')
+    SESSION_MEMORY_MAX_ENTRIES = int(os.getenv('SESSION_MEMORY_MAX_ENTRIES', 10000))
+
+    # WebAuthn challenges: 'database' keeps them in the webauthn_challenge table so any worker
+    # can finish a ceremony, 'memory' in a per-process map (tests/development). A challenge
+    # can be answered once, within CHALLENGE_TTL_SECONDS
+    CHALLENGE_BACKEND = os.getenv('CHALLENGE_BACKEND', 'database')
+    CHALLENGE_TTL_SECONDS = float(os.getenv('CHALLENGE_TTL_SECONDS', 300))
+
+    # Per-worker cache of users loaded for authenticated requests (0 entries disables it).
+    # Other workers may serve a changed user's old row for up to USER_CACHE_TTL seconds
+    USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 1000))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 30))
+
+    # Number of parsed credential public keys each worker keeps for verifying logins
+    PUBLIC_KEY_CACHE_MAX_ENTRIES = int(os.getenv('PUBLIC_KEY_CACHE_MAX_ENTRIES', 5000))
+
+    # Interaction logging: when enabled, `/interactions/submit` buffers batches in memory and a
+    # background thread writes them out once FLUSH_ROWS are queued or every FLUSH_SECONDS
+    INTERACTION_WRITE_BEHIND = os.getenv('INTERACTION_WRITE_BEHIND', 'false').lower() == 'true'
+    INTERACTION_QUEUE_MAX_ROWS = int(os.getenv('INTERACTION_QUEUE_MAX_ROWS', 20000))
+    INTERACTION_QUEUE_FLUSH_ROWS = int(os.getenv('INTERACTION_QUEUE_FLUSH_ROWS', 500))
+    INTERACTION_QUEUE_FLUSH_SECONDS = float(os.getenv('INTERACTION_QUEUE_FLUSH_SECONDS', 2.0))
+
+    # Interaction retention: `flask interaction-partitions archive` moves monthly partitions
+    # older than INTERACTION_RETENTION_MONTHS (0 keeps everything) into gzip CSV files in
+    # INTERACTION_ARCHIVE_DIR and drops them
+    INTERACTION_RETENTION_MONTHS = int(os.getenv('INTERACTION_RETENTION_MONTHS', 0))
+    INTERACTION_ARCHIVE_DIR = os.getenv('INTERACTION_ARCHIVE_DIR', 'archive')
+
+    # Prometheus metrics (served on the loopback-only `/metrics`). Each process writes its counts
+    # to a file in METRICS_DIR at most every METRICS_FLUSH_SECONDS so any worker can report
+    # the totals; without METRICS_DIR each worker only reports its own
+    METRICS_DIR = os.getenv('METRICS_DIR', '')
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 1.0))
+
+    # Token-bucket rate limits on login and registration attempts, per client IP address and per
+    # email address (RATE_LIMIT_<ENDPOINT>_IP / _EMAIL; see `get_rate_limits_from`). Every
+    # worker on the host shares the buckets in the SQLite file RATE_LIMIT_STORE
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', os.path.join(tempfile.gettempdir(), 'fido-rate-limits.db'))
+    RATE_LIMITS = get_rate_limits_from(os.environ)
+
+    # Number of reverse proxies (e.g. Caddy) in front of the app whose X-Forwarded-For header
+    # gives the client's address. Leave at 0 unless the app is only reachable through them
+    TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 0))
+
+    # Password hashing: any method accepted by werkzeug's `generate_password_hash`, including
+    # the cost (existing hashes are upgraded on the next successful login when this changes).
+    # Hashes run in a pool of PASSWORD_HASH_WORKERS processes per app process (0 hashes inline),
+    # so a gunicorn deployment runs GUNICORN_WORKERS * PASSWORD_HASH_WORKERS of them. At most
+    # PASSWORD_HASH_CONCURRENCY hashes per app process may be queued or running (by default half
+    # of its GUNICORN_THREADS request threads); others give up with a "server busy" error if
+    # they can't start within PASSWORD_HASH_QUEUE_TIMEOUT seconds
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 1))
+    PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', max(1, int(os.getenv('GUNICORN_THREADS') or 4) // 2)))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 2.0))
 
     # Webauthn setup
     RP_ID = os.environ['RP_ID']
@@ -0,0 +1,95 @@
+''' Database connection pool that records how long requests wait for a connection '''
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    '''Checkout wait times and connection churn for this process's pools'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_wait_seconds = 0.0
+            self.max_checkout_wait_seconds = 0.0
+            self.checkout_timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_seconds += wait
+            self.max_checkout_wait_seconds = max(self.max_checkout_wait_seconds, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.checkout_timeouts += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkout_wait_seconds': self.checkout_wait_seconds,
+                'max_checkout_wait_seconds': self.max_checkout_wait_seconds,
+                'checkout_timeouts': self.checkout_timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    '''
+    `QueuePool` that times every checkout into `pool_stats`. The time includes waiting for a
+    free connection and, with `pool_pre_ping`, pinging it (and reconnecting if it was dead).
+    '''
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _count_connect(dbapi_connection, connection_record):
+    pool_stats.record_connect()
+
+
+@event.listens_for(InstrumentedQueuePool, 'invalidate')
+def _count_invalidation(dbapi_connection, connection_record, exception):
+    pool_stats.record_invalidation()
+
+
+def pool_metrics(engine):
+    '''Current size and usage of `engine`'s pool, alongside `pool_stats`'''
+    pool = engine.pool
+    metrics = {'pool': type(pool).__name__, **pool_stats.metrics()}
+    if isinstance(pool, QueuePool):
+        metrics.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return metrics
@@ -0,0 +1,229 @@
+'''
+`flask export`: streams research data out of the database as gzip CSV or Parquet, a chunk
+of rows at a time, so memory use stays flat no matter how large the table is
+'''
+import csv
+from datetime import datetime, time, timedelta
+import gzip
+import json
+import os
+import click
+import sqlalchemy
+from . import app, db
+from .models import Interaction, LoginAttempts, Session
+from .routing_session import read_replica
+
+FORMATS = ('csv', 'parquet')
+
+# Exported columns per table (the session table's `data` holds live Flask session payloads,
+# which are neither research data nor safe to hand out)
+EXPORTS = {
+    'interaction': Interaction.__table__.c,
+    'session': [Session.__table__.c.token, Session.__table__.c.user_id],
+    'login_attempts': LoginAttempts.__table__.c,
+}
+
+
+class CsvWriter:
+    def __init__(self, path, columns):
+        self.file = gzip.open(path, 'wt', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([column.name for column in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    '''Writes each chunk as its own row group'''
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise click.UsageError('Parquet output needs pyarrow (pip install pyarrow)')
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(column.name, self._arrow_type(column.type)) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def _arrow_type(self, column_type):
+        pa = self.pyarrow
+        if isinstance(column_type, sqlalchemy.Integer):
+            return pa.int64()
+        if isinstance(column_type, sqlalchemy.DateTime):
+            return pa.timestamp('us')
+        if isinstance(column_type, sqlalchemy.Date):
+            return pa.date32()
+        return pa.string()
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+def build_export_query(table_name, since=None, until=None, page=None, login_method=None, after_id=None, max_id=None,
+                       retry_ids=()):
+    '''
+    SELECT for the rows of `table_name` matching the filters (dates are inclusive; page and
+    login method only apply to interactions, ids to interactions and login attempts). Rows
+    with ids in `retry_ids` are included even if they fall outside `after_id`..`max_id`.
+    '''
+    columns = EXPORTS[table_name]
+    table = columns[0].table
+    query = sqlalchemy.select(*columns)
+
+    if since or until:
+        if table_name == 'interaction':
+            if since:
+                query = query.where(table.c.timestamp >= datetime.combine(since, time.min))
+            if until:
+                query = query.where(table.c.timestamp < datetime.combine(until + timedelta(days=1), time.min))
+        elif table_name == 'login_attempts':
+            if since:
+                query = query.where(table.c.date >= since)
+            if until:
+                query = query.where(table.c.date <= until)
+        else:
+            raise click.UsageError(f'The {table_name} table has no dates to filter on')
+
+    if page or login_method:
+        if table_name != 'interaction':
+            raise click.UsageError('--page and --login-method only apply to interactions')
+        if page:
+            query = query.where(table.c.page == page)
+        if login_method:
+            query = query.where(table.c.login_method == login_method)
+
+    if 'id' in table.c:
+        in_range = []
+        if after_id is not None:
+            in_range.append(table.c.id > after_id)
+        if max_id is not None:
+            in_range.append(table.c.id <= max_id)
+        if retry_ids:
+            query = query.where(sqlalchemy.or_(sqlalchemy.and_(True, *in_range), table.c.id.in_(retry_ids)))
+        elif in_range:
+            query = query.where(*in_range)
+        query = query.order_by(table.c.id)
+
+    return query
+
+
+def export_table(table_name, path, format='csv', chunk_size=10000, **filters):
+    '''
+    Streams the rows of `table_name` matching `filters` (see `build_export_query`) into
+    `path`. Returns the number of rows written and the largest id written (or None).
+    '''
+    columns = EXPORTS[table_name]
+    query = build_export_query(table_name, **filters)
+    writer = (ParquetWriter if format == 'parquet' else CsvWriter)(path, columns)
+    rows_written, last_id = 0, None
+    id_index = next((i for i, column in enumerate(columns) if column.name == 'id'), None)
+
+    try:
+        with read_replica():
+            # A server-side cursor on MariaDB, so rows arrive as they are read
+            result = db.session.connection().execute(query.execution_options(stream_results=True, max_row_buffer=chunk_size))
+            for chunk in result.partitions(chunk_size):
+                writer.write(chunk)
+                rows_written += len(chunk)
+                if id_index is not None:
+                    last_id = chunk[-1][id_index]
+            result.close()
+    finally:
+        writer.close()
+        db.session.remove()
+
+    return rows_written, last_id
+
+
+def find_missing_ids(connection, after_id, max_id):
+    '''
+    Yields the ids in `after_id`..`max_id` (exclusive, inclusive) that have no interaction:
+    ones rolled back or deleted, but also ones whose rows aren't committed (or replicated) yet.
+    With `after_id` 0, ids before the first row are left out, as archiving removes those.
+    '''
+    table = Interaction.__table__
+    ids = connection.execute(
+        sqlalchemy.select(table.c.id).where(table.c.id > after_id, table.c.id <= max_id).order_by(table.c.id)
+        .execution_options(stream_results=True)
+    ).scalars()
+    previous = after_id or None
+    for id in ids:
+        if previous is not None:
+            yield from range(previous + 1, id)
+        previous = id
+
+
+def _date(ctx, param, value):
+    return value.date() if value else None
+
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(list(EXPORTS)))
+@click.option('--format', 'format', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Defaults to <table>.csv.gz / <table>.parquet')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), callback=_date, help='First day to include')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), callback=_date, help='Last day to include')
+@click.option('--page', type=click.Choice(Interaction.page.type.enums))
+@click.option('--login-method', type=click.Choice(Interaction.login_method.type.enums))
+@click.option('--state-file', type=click.Path(dir_okay=False),
+              help='Only export interactions newer than the high-water mark saved in this file, then advance it')
+@click.option('--late-row-seconds', type=int, default=3600, show_default=True,
+              help='With --state-file, how long to keep looking for rows that commit after rows with higher ids')
+@click.option('--chunk-size', type=int, default=10000, show_default=True)
+def export_command(table, format, output, since, until, page, login_method, state_file, late_row_seconds, chunk_size):
+    '''Export TABLE (interaction, session or login_attempts) for analysis'''
+    if state_file and table != 'interaction':
+        raise click.UsageError('--state-file only applies to interactions')
+
+    output = output or f'{table}.{"csv.gz" if format == "csv" else "parquet"}'
+    filters = {'since': since, 'until': until, 'page': page, 'login_method': login_method}
+
+    if state_file:
+        state = {}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+        # Ids are handed out when rows are inserted, not when they are committed (and write-behind
+        # workers and the replica add delays), so a row can show up after rows with higher ids
+        # were exported. Remember the ids missing below the mark and export them once they appear.
+        # These queries and the export share a transaction, so they all see the same rows
+        checked_at = datetime.utcnow()
+        missing = dict(state.get('missing_ids', []))
+        after_id = state.get('interaction_id', 0)
+        with read_replica():
+            connection = db.session.connection()
+            # Stop at the newest id present when the export starts, so rows inserted meanwhile are
+            # left for the next run rather than racing the saved mark
+            max_id = max(connection.execute(sqlalchemy.select(sqlalchemy.func.max(Interaction.id))).scalar() or 0, after_id)
+            arrived = set(connection.execute(
+                sqlalchemy.select(Interaction.id).where(Interaction.id.in_(missing))).scalars()) if missing else set()
+            new_missing = list(find_missing_ids(connection, after_id, max_id))
+        filters.update(after_id=after_id, max_id=max_id, retry_ids=sorted(arrived))
+
+    rows, last_id = export_table(table, output, format, chunk_size, **filters)
+
+    if state_file:
+        still_missing = [
+            [id, seen] for id, seen in missing.items()
+            if id not in arrived and (checked_at - datetime.fromisoformat(seen)).total_seconds() < late_row_seconds
+        ]
+        with open(state_file, 'w') as f:
+            json.dump({
+                'interaction_id': max_id,
+                'missing_ids': still_missing + [[id, checked_at.isoformat()] for id in new_missing],
+            }, f)
+
+    click.echo(f'Exported {rows} rows to {output}' + (f' (up to id {last_id})' if last_id is not None else ''))
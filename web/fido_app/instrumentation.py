@@ -0,0 +1,112 @@
+'''
+Counts the database round trips and commits made while handling each request, and records
+request latency and SQL timings in the Prometheus metrics (see metrics.py)
+'''
+from contextlib import contextmanager
+import time
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession
+from . import app
+from .metrics import db_queries_total, db_query_duration, db_query_seconds_total, request_duration, requests_total
+
+
+class DatabaseCallStats:
+    '''Number of SQL statements executed and transactions committed'''
+
+    def __init__(self):
+        self.queries = 0
+        self.commits = 0
+        self.query_seconds = 0.0
+
+    def __repr__(self):
+        return f'<DatabaseCallStats queries={self.queries} commits={self.commits}>'
+
+
+# Counters opened by `track_database_calls`, in addition to the per-request one in `g`
+_trackers = []
+
+
+@contextmanager
+def track_database_calls():
+    '''
+    Counts every query and commit made inside the `with` block (across any number of
+    requests), e.g. so tests can assert on the number of round trips a route makes:
+
+        with track_database_calls() as stats:
+            client.post('/login', data=...)
+        assert stats.commits == 1
+    '''
+    stats = DatabaseCallStats()
+    _trackers.append(stats)
+    try:
+        yield stats
+    finally:
+        _trackers.remove(stats)
+
+
+def get_request_database_calls():
+    '''Returns the counters for the request currently being handled (if any)'''
+    if has_app_context():
+        return g.get('database_calls')
+    return None
+
+
+def _active_stats():
+    stats = list(_trackers)
+    request_stats = get_request_database_calls()
+    if request_stats is not None:
+        stats.append(request_stats)
+    return stats
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    for stats in _active_stats():
+        stats.queries += 1
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    db_query_duration.observe(elapsed)
+    for stats in _active_stats():
+        stats.query_seconds += elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def _forget_failed_query(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _count_commit(session):
+    for stats in _active_stats():
+        stats.commits += 1
+
+
+@app.before_request
+def _start_counting_database_calls():
+    g.request_started = time.perf_counter()
+    g.database_calls = DatabaseCallStats()
+
+
+@app.after_request
+def _log_database_calls(response):
+    stats = get_request_database_calls()
+    if stats is not None:
+        app.logger.debug(f'{stats.queries} queries and {stats.commits} commits for this request')
+
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        request_duration.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if stats is not None:
+            db_queries_total.inc(stats.queries, endpoint=endpoint)
+            db_query_seconds_total.inc(stats.query_seconds, endpoint=endpoint)
+    return response
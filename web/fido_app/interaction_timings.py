@@ -0,0 +1,145 @@
+''' Per-visit interaction timing rollups (see `InteractionTiming`) '''
+import json
+import click
+import sqlalchemy
+from sqlalchemy import and_, or_
+from . import app, db
+from .models import Interaction, InteractionTiming
+
+
+def _milliseconds(delta):
+    return int(delta.total_seconds() * 1000)
+
+
+def summarize_interactions(rows):
+    '''
+    Groups interaction `rows` (dicts or row objects with the interaction table's columns) by
+    visit and returns one `interaction_timing` row per visit. Rows without a session token
+    or group id can't be attributed to a visit and are skipped.
+    '''
+    visits = {}
+    for row in rows:
+        row = row if isinstance(row, dict) else row._mapping
+        if row['session_token'] and row['group_id']:
+            visits.setdefault((row['session_token'], row['group_id']), []).append(row)
+
+    timings = []
+    for (session_token, group_id), events in visits.items():
+        events.sort(key=lambda event: event['timestamp'])
+        load = next((event for event in events if event['event'] == 'load'), None)
+        submit = next((event for event in events if event['event'] == 'submit'), None)
+
+        # An element is "dwelled on" from when it gains focus until the next interaction
+        dwell = {}
+        for event, next_event in zip(events, events[1:]):
+            if event['event'] == 'focus':
+                elapsed = _milliseconds(next_event['timestamp'] - event['timestamp'])
+                dwell[event['element']] = dwell.get(event['element'], 0) + elapsed
+
+        timings.append({
+            'session_token': session_token,
+            'group_id': group_id,
+            'page': events[0]['page'],
+            'login_method': submit['login_method'] if submit else 'did not attempt',
+            'started_at': events[0]['timestamp'],
+            'load_to_submit_ms': (
+                _milliseconds(submit['timestamp'] - load['timestamp'])
+                if load and submit and submit['timestamp'] >= load['timestamp'] else None
+            ),
+            'event_count': len(events),
+            'element_dwell_ms': json.dumps(dwell, sort_keys=True),
+        })
+
+    return timings
+
+
+def insert_interaction_timings(db_session, rows):
+    '''Writes the rollups for the interaction `rows` being inserted. Does not commit.'''
+    timings = summarize_interactions(rows)
+    if timings:
+        db_session.execute(InteractionTiming.__table__.insert(), timings)
+
+
+def median_load_to_submit_ms(page, login_method):
+    '''
+    Median load-to-submit time of visits to `page` submitted with `login_method`, or None if
+    there are none. Both queries are range scans of the rollup's (page, login_method,
+    duration) index.
+    '''
+    duration = InteractionTiming.load_to_submit_ms
+    visits = db.session.query(duration).filter(
+        InteractionTiming.page == page,
+        InteractionTiming.login_method == login_method,
+        duration.isnot(None),
+    )
+
+    count = visits.with_entities(sqlalchemy.func.count(duration)).scalar()
+    if not count:
+        return None
+
+    # The middle value, or the two middle values for an even count
+    middle = visits.order_by(duration).offset((count - 1) // 2).limit(2 - count % 2).all()
+    return sum(value for (value,) in middle) / len(middle)
+
+
+def backfill_interaction_timings(batch_size=500):
+    '''
+    Builds the rollups for every visit that has interactions but no rollup yet, `batch_size`
+    visits at a time (walking the interaction table's session token / group id index).
+    Returns the number of rollups written.
+    '''
+    interaction = Interaction.__table__
+    written = 0
+    last_token, last_group = '', ''
+
+    while True:
+        visits = db.session.execute(
+            sqlalchemy.select(interaction.c.session_token, interaction.c.group_id)
+            .distinct()
+            .where(
+                or_(
+                    interaction.c.session_token > last_token,
+                    and_(interaction.c.session_token == last_token, interaction.c.group_id > last_group),
+                ),
+                # Interactions logged before group ids existed all share the empty id
+                interaction.c.group_id != '',
+            )
+            .order_by(interaction.c.session_token, interaction.c.group_id)
+            .limit(batch_size)
+        ).all()
+        if not visits:
+            return written
+
+        tokens = {token for token, _ in visits}
+        groups = {group for _, group in visits}
+        done = set(db.session.execute(
+            sqlalchemy.select(InteractionTiming.session_token, InteractionTiming.group_id)
+            .where(InteractionTiming.session_token.in_(tokens), InteractionTiming.group_id.in_(groups))
+        ).all())
+        todo = {tuple(visit) for visit in visits} - done
+
+        if todo:
+            rows = db.session.execute(
+                sqlalchemy.select(interaction)
+                .where(interaction.c.session_token.in_({token for token, _ in todo}),
+                       interaction.c.group_id.in_({group for _, group in todo}))
+            ).all()
+            rows = [row for row in rows if (row.session_token, row.group_id) in todo]
+            try:
+                insert_interaction_timings(db.session, rows)
+                db.session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # A visit was rolled up by ingestion meanwhile; redo this batch without it
+                db.session.rollback()
+                continue
+            written += len(todo)
+
+        last_token, last_group = visits[-1]
+
+
+@app.cli.command('backfill-interaction-timings')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Visits per transaction')
+def backfill_command(batch_size):
+    '''Build interaction timing rollups for historical interactions'''
+    written = backfill_interaction_timings(batch_size)
+    click.echo(f'Rolled up {written} visits')
@@ -0,0 +1,268 @@
+''' Batch parsing and insertion of client-side interaction logs '''
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+import sqlalchemy
+from . import app, db
+from .models import Interaction, Session
+from .interaction_timings import insert_interaction_timings
+
+logger = logging.getLogger(__name__)
+
+# Enum values accepted by the interaction table, taken straight from the model so that
+# batches can be validated without a round trip to the database
+INTERACTION_EVENTS = frozenset(Interaction.__table__.c.event.type.enums)
+INTERACTION_LOGIN_METHODS = frozenset(Interaction.__table__.c.login_method.type.enums)
+INTERACTION_PAGES = frozenset(Interaction.__table__.c.page.type.enums)
+MAX_ELEMENT_LENGTH = Interaction.__table__.c.element.type.length
+
+
+class InvalidInteractionBatch(ValueError):
+    '''Raised when any interaction in a submitted batch is malformed'''
+
+
+def parse_interaction_batch(data, session_token, group_id):
+    '''
+    Validates every interaction in the JSON payload `data` and converts them into a list of
+    rows ready for a single multi-row insert into the interaction table. The whole batch is
+    rejected (by raising `InvalidInteractionBatch`) if any one interaction is invalid, so
+    nothing is written for a partially bad payload.
+    '''
+    if not isinstance(data, list):
+        raise InvalidInteractionBatch('Interactions must be submitted as a JSON list')
+
+    rows = []
+    for log in data:
+        if not isinstance(log, dict):
+            raise InvalidInteractionBatch('Each interaction must be a JSON object')
+
+        try:
+            element = log['element']
+            event = log['event']
+            login_method = log['login_method']
+            page = log['page']
+            timestamp_ms = log['timestampMs']
+        except KeyError as e:
+            raise InvalidInteractionBatch(f'An interaction is missing a required key: {e.args[0]}')
+
+        if not isinstance(element, str) or len(element) > MAX_ELEMENT_LENGTH:
+            raise InvalidInteractionBatch(f'An interaction had an invalid element: {element}')
+        if event not in INTERACTION_EVENTS:
+            raise InvalidInteractionBatch(f'An interaction had an invalid event: {event}')
+        if login_method not in INTERACTION_LOGIN_METHODS:
+            raise InvalidInteractionBatch(f'An interaction had an invalid login method: {login_method}')
+        if page not in INTERACTION_PAGES:
+            raise InvalidInteractionBatch(f'An interaction had an invalid page: {page}')
+
+        try:
+            timestamp = datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc)
+        except (TypeError, ValueError, OSError, OverflowError):
+            raise InvalidInteractionBatch(f'An interaction had an invalid UTC timestamp: {timestamp_ms}')
+
+        rows.append({
+            'session_token': session_token,
+            'element': element,
+            'event': event,
+            'login_method': login_method,
+            'page': page,
+            'timestamp': timestamp,
+            'group_id': group_id,
+        })
+
+    return rows
+
+
+def insert_interaction_rows(db_session, rows):
+    '''
+    Writes the parsed interaction `rows` with one multi-row (executemany) INSERT rather than
+    one ORM object per interaction, along with the timing rollup of each visit they cover.
+    Does not commit.
+    '''
+    if not rows:
+        return
+
+    # Core inserts skip the ORM's autoflush, so make sure any pending Session row exists
+    # before the interactions that reference it
+    db_session.flush()
+    db_session.execute(Interaction.__table__.insert(), rows)
+    insert_interaction_timings(db_session, rows)
+
+
+class InteractionQueueFull(Exception):
+    '''Raised when the write-behind queue has no room left for a batch'''
+
+
+class InteractionWriteBehindQueue:
+    '''
+    Bounded in-memory buffer of parsed interaction rows. Batches are accepted immediately and
+    written to the interaction table by a background thread whenever enough rows are queued
+    or the flush interval elapses. Each gunicorn worker has its own queue, so `close` must be
+    called on worker shutdown (see `gunicorn.conf.py`) to avoid losing buffered rows.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self._rows = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        atexit.register(self.close)
+
+        # Counters exposed through `metrics`
+        self.enqueued_rows = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.rejected_batches = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def max_rows(self):
+        return self.app.config['INTERACTION_QUEUE_MAX_ROWS']
+
+    @property
+    def flush_rows(self):
+        return self.app.config['INTERACTION_QUEUE_FLUSH_ROWS']
+
+    @property
+    def flush_seconds(self):
+        return self.app.config['INTERACTION_QUEUE_FLUSH_SECONDS']
+
+    def __len__(self):
+        return len(self._rows)
+
+    def submit(self, rows):
+        '''Queues a batch of parsed rows, raising `InteractionQueueFull` if it won't fit'''
+        with self._condition:
+            if len(self._rows) + len(rows) > self.max_rows:
+                self.rejected_batches += 1
+                raise InteractionQueueFull()
+
+            self._rows.extend(rows)
+            self.enqueued_rows += len(rows)
+            self._ensure_worker()
+
+            if len(self._rows) >= self.flush_rows:
+                self._condition.notify()
+
+    def flush(self):
+        '''Synchronously writes everything currently queued'''
+        with self._condition:
+            rows = self._drain()
+        self._write(rows)
+
+    def close(self):
+        '''Stops the background thread and writes any remaining rows'''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=max(self.flush_seconds, 1.0) * 5)
+
+        self.flush()
+
+    def metrics(self):
+        '''Returns a snapshot of queue depth and flush statistics'''
+        return {
+            'depth': len(self._rows),
+            'max_rows': self.max_rows,
+            'enqueued_rows': self.enqueued_rows,
+            'flushed_rows': self.flushed_rows,
+            'failed_rows': self.failed_rows,
+            'rejected_batches': self.rejected_batches,
+            'flushes': self.flushes,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'total_flush_seconds': self.total_flush_seconds,
+        }
+
+    def _ensure_worker(self):
+        # Threads don't survive a fork, so a queue created before gunicorn forks its workers
+        # has to start a fresh thread in each worker process
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        self._closed = False
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='interaction-write-behind', daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        rows = list(self._rows)
+        self._rows.clear()
+        return rows
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._rows) >= self.flush_rows,
+                    timeout=self.flush_seconds,
+                )
+                rows = self._drain()
+                closed = self._closed
+
+            self._write(rows)
+
+            if closed:
+                return
+
+    def _write(self, rows):
+        if not rows:
+            return
+
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                written = self._insert(rows)
+            finally:
+                db.session.remove()
+        elapsed = time.perf_counter() - start
+
+        with self._condition:
+            if written:
+                self.flushed_rows += len(rows)
+            else:
+                self.failed_rows += len(rows)
+            self.flushes += 1
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.total_flush_seconds += elapsed
+
+    def _insert(self, rows, retry=True):
+        '''Writes `rows` in one transaction, returning whether they were committed'''
+        try:
+            # Make sure every session referenced by the batch exists before its interactions
+            tokens = {row['session_token'] for row in rows}
+            existing = {token for (token,) in db.session.query(Session.token).filter(Session.token.in_(tokens))}
+            missing = tokens - existing
+            if missing:
+                db.session.execute(Session.__table__.insert(), [{'token': token} for token in missing])
+
+            insert_interaction_rows(db.session, rows)
+            db.session.commit()
+            return True
+        except sqlalchemy.exc.IntegrityError:
+            # Another worker may have created one of the same sessions concurrently;
+            # a retry will see it and only insert the interactions
+            db.session.rollback()
+            if retry:
+                return self._insert(rows, retry=False)
+            logger.exception(f'Dropped {len(rows)} interactions that could not be written')
+            return False
+        except sqlalchemy.exc.SQLAlchemyError:
+            db.session.rollback()
+            logger.exception(f'Dropped {len(rows)} interactions that could not be written')
+            return False
+
+
+interaction_queue = InteractionWriteBehindQueue(app)
@@ -0,0 +1,259 @@
+'''
+Prometheus metrics for request latency, SQL queries and the expensive steps of logging in
+(WebAuthn verification and password hashing).
+
+Each process counts in memory. When METRICS_DIR is set (gunicorn.conf.py sets it), a
+background thread in each process also writes its counts to its own file there every
+METRICS_FLUSH_SECONDS (if they changed), and again when the worker exits. Whichever
+worker serves `/metrics` then reports the totals of every file. Files left by exited workers are folded into one, so counters never go
+backwards when workers are recycled.
+'''
+from bisect import bisect_left
+from contextlib import contextmanager
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from . import app
+
+# Latency buckets in seconds (from a fast cached lookup to a slow password hash)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+EXITED_FILE = 'metrics-exited.json'
+
+
+class Metric:
+    def __init__(self, registry, name, kind, help, labels, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+
+    def _key(self, labels):
+        return json.dumps([str(labels[label]) for label in self.labels])
+
+
+class Counter(Metric):
+    def __init__(self, registry, name, help, labels=()):
+        super().__init__(registry, name, 'counter', help, labels)
+
+    def inc(self, amount=1, **labels):
+        self.registry._add(self.name, self._key(labels), [amount])
+
+
+class Histogram(Metric):
+    '''Stores a count per bucket (not cumulative), then the sum and the count of observations'''
+
+    def __init__(self, registry, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, 'histogram', help, labels, buckets)
+
+    def observe(self, value, **labels):
+        values = [0] * (len(self.buckets) + 3)
+        values[bisect_left(self.buckets, value)] = 1
+        values[-2] = value
+        values[-1] = 1
+        self.registry._add(self.name, self._key(labels), values)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+def _merge(total, values):
+    '''Adds the {metric: {labels: [values]}} `values` into `total`'''
+    for name, series in values.items():
+        merged = total.setdefault(name, {})
+        for key, numbers in series.items():
+            if key in merged:
+                merged[key] = [a + b for a, b in zip(merged[key], numbers)]
+            else:
+                merged[key] = list(numbers)
+    return total
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _pid_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self, app):
+        self.app = app
+        self.metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._changed = False
+        self._thread = None
+        self._pid = None
+
+    def counter(self, name, help, labels=()):
+        return self.metrics.setdefault(name, Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, help, labels, buckets))
+
+    def _add(self, name, key, values):
+        with self._lock:
+            _merge(self._values, {name: {key: values}})
+            self._changed = True
+        if self._pid != os.getpid() and self.directory:
+            self._start_flushing()
+
+    def reset(self):
+        '''Forgets this process's counts (for tests and freshly forked workers)'''
+        with self._lock:
+            self._values = {}
+            self._changed = False
+
+    def _start_flushing(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['METRICS_FLUSH_SECONDS'])
+            if self._changed:
+                try:
+                    self.flush()
+                except OSError as e:
+                    self.app.logger.warning(f'Could not write metrics: {e}')
+
+    @property
+    def directory(self):
+        return self.app.config['METRICS_DIR']
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {key: list(values) for key, values in series.items()} for name, series in self._values.items()}
+
+    def flush(self):
+        '''Writes this process's counts to its file in METRICS_DIR (if set)'''
+        if not self.directory:
+            return
+
+        with self._flush_lock:
+            with self._lock:
+                self._changed = False
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+
+    def collect(self):
+        '''Returns the counts of every process sharing METRICS_DIR (or just this one)'''
+        if not self.directory:
+            return self.snapshot()
+
+        self.flush()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'metrics.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited_path = os.path.join(self.directory, EXITED_FILE)
+            exited = self._read(exited_path)
+            live = {}
+            folded = []
+
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*[0-9].json')):
+                pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+                values = self._read(path)
+                if _pid_is_running(pid):
+                    _merge(live, values)
+                else:
+                    _merge(exited, values)
+                    folded.append(path)
+
+            if folded:
+                with open(exited_path + '.tmp', 'w') as f:
+                    json.dump(exited, f)
+                os.replace(exited_path + '.tmp', exited_path)
+                for path in folded:
+                    os.remove(path)
+
+        return _merge(live, exited)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def render(self):
+        '''The totals in the Prometheus text exposition format'''
+        values = self.collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key, numbers in sorted(values.get(metric.name, {}).items()):
+                label_values = json.loads(key)
+                labels = _format_labels(metric.labels, label_values)
+                if metric.kind == 'counter':
+                    lines.append(f'{metric.name}{labels} {_format_number(numbers[0])}')
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), numbers):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    bucket_labels = _format_labels(metric.labels + ('le',), label_values + [le])
+                    lines.append(f'{metric.name}_bucket{bucket_labels} {_format_number(cumulative)}')
+                lines.append(f'{metric.name}_sum{labels} {_format_number(numbers[-2])}')
+                lines.append(f'{metric.name}_count{labels} {_format_number(numbers[-1])}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry(app)
+
+request_duration = metrics.histogram(
+    'fido_request_duration_seconds', 'Time to handle a request', ('endpoint', 'method'))
+requests_total = metrics.counter(
+    'fido_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+db_queries_total = metrics.counter(
+    'fido_db_queries_total', 'SQL statements executed while handling requests', ('endpoint',))
+db_query_seconds_total = metrics.counter(
+    'fido_db_query_seconds_total', 'Time spent executing SQL statements while handling requests', ('endpoint',))
+db_query_duration = metrics.histogram(
+    'fido_db_query_duration_seconds', 'Time to execute a SQL statement')
+operation_duration = metrics.histogram(
+    'fido_operation_duration_seconds', 'Time spent in WebAuthn verification and password hashing', ('operation',))
+
+
+def timed(operation):
+    '''Records the time spent in the `with` block as `operation` (see `operation_duration`)'''
+    return operation_duration.time(operation=operation)
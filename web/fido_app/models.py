@@ -1,10 +1,13 @@
 ''' Contains all database models for SQLAlchemy '''
-from .utils import get_random_session_token
+from .utils import get_random_session_token, hash_credential_id
+from .passwords import password_hasher
 from . import db
 import logging
+from datetime import date
+import sqlalchemy
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from flask_login import UserMixin
 from webauthn.helpers.structs import AttestationFormat
-from werkzeug.security import generate_password_hash, check_password_hash
 
 logger = logging.getLogger(__name__)
 class Session(db.Model):
@@ -15,9 +18,12 @@ class Session(db.Model):
 
     token = db.Column(db.String(40), primary_key=True)
 
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     user = db.relationship('User', back_populates='sessions')
 
+    # Serialized Flask session data (see sessions.DatabaseSessionStore)
+    data = db.Column(db.Text)
+
     interactions = db.relationship('Interaction')
 
     def __repr__(self):
@@ -34,31 +40,22 @@ class User(db.Model, UserMixin):
 
     # Saves the last date the user logged in with both a password and FIDO2
     last_complete_login = db.Column(db.Date)
-    # Each bit, starting with the least significant bit,
+    # Each bit, starting with the least significant bit of the first byte,
     # represents a new day since account registration.
     # A 1 represents a day in which the user logged in;
     # a 0 represents a skipped day.
     # E.g., if a user registers on Mar. 1st and then
-    # logs in on the 3rd, 4th, and 6th, `login_bitfield`
-    # should store 22 (10110 in binary).
-    # Overflow occurs after 32 days. Change to db.BigInteger if necessary.
-    login_bitfield = db.Column(db.Integer, default=0)
+    # logs in on the 3rd, 4th, and 6th, `login_bitmap`
+    # should store b'\x16' (10110 in binary).
+    # The bitmap grows by a byte every 8 days (see `append_to_login_bitmap`).
+    login_bitmap = db.Column(db.LargeBinary, default=b'')
 
     # Password info
     password_hash = db.Column(db.String(128))
 
-    # Webauthn info
-    # TODO: move into separate table
-    credential_id = db.Column(db.String(400), unique=True)
+    # Webauthn info (the user handle shared by all of the user's authenticators)
     ukey = db.Column(db.String(32), unique=True)
-    public_key = db.Column(db.String(400), unique=True)
-    sign_count = db.Column(db.Integer, default=0)
-    authenticator_id = db.Column(db.String(40))
-    user_verified = db.Column(db.Boolean(), default=False)
-
-    # Values_callable is needed to allow alembic to generate a correct
-    # migration script
-    attestation_format = db.Column(db.Enum(AttestationFormat, validate_strings=True, values_callable=lambda x: [e.value for e in x]))
+    credentials = db.relationship('Credential', back_populates='user', cascade='all, delete-orphan')
 
     # Page interaction info
     sessions = db.relationship('Session', back_populates='user')
@@ -68,48 +65,36 @@ class User(db.Model, UserMixin):
 
     def set_password(self, password):
         '''Generates a salted & hashed password field for the user given a plaintext password'''
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         '''Checks if the given plaintext password matches the salt and hash for the given user'''
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        '''Whether the stored hash uses a different method or cost than currently configured'''
+        return password_hasher.needs_rehash(self.password_hash)
 
     def has_password(self):
         return self.password_hash is not None
 
-    def add_session(self, flask_session, commit=False):
-        '''Associates the session with the given id to this particular user'''
-        session = Session.query.filter_by(token=flask_session["token"]).first()
-
-        if session and session.user_id == self.id:
-            logger.info(f"Session already being tracked for {session.user}.")
-            return
-
-        if session and session.user_id != self.id:
-            logger.warn(f"This session token is attached to {session.user}, but is also being used by {self}!"
-                + "Creating a fresh session token for {self}.")
-            
-            # Create a fresh session token for the current user (that isn't stored in the DB currently)
-            # TODO: figure out how to prevent the most recent batch of interactions from being 
-            # misattributed to the old user that this session token was attached to.
-            # Alternatively, we could just make the session tokens less persistent
-            flask_session["token"] = get_random_session_token()
-            session = None
-
-        if session:
-            logger.info(f"Attaching existing session to {self}")
-            session.user_id = self.id
-        else:
-            logger.info(f"Attaching new session to {self}")
-            session = Session(
-                token=flask_session["token"],
-                user_id=self.id,
-            )
-
-        db.session.add(session)
-
-        if commit:
-            db.session.commit()
+    def add_session(self, flask_session):
+        '''
+        Gives the logged-in session a fresh token and associates it with this particular user.
+        The change is only added to the current transaction; callers commit it along with the
+        rest of their work.
+        '''
+        # A brand new user needs an id before a session can point at it
+        if self.id is None:
+            db.session.add(self)
+            db.session.flush()
+
+        # A new token on every login, so a session id from before logging in (e.g. one planted
+        # in the browser by someone else) never becomes an authenticated one. It also keeps
+        # interactions from before the login, or from another account, off this user's session
+        flask_session["token"] = get_random_session_token()
+        logger.info(f"Attaching new session to {self}")
+        db.session.add(Session(token=flask_session["token"], user_id=self.id))
 
     def delete_identifiable_info(self):
         '''
@@ -124,25 +109,72 @@ class User(db.Model, UserMixin):
 
         # Compensation info
         self.last_complete_login = None
-        self.login_bitfield = 0
+        self.login_bitmap = b''
 
         # Password info
         self.password_hash = None
 
         # Webauthn info
-        self.credential_id = None
         self.ukey = None
-        self.public_key = None
-        self.sign_count = 0
-        self.authenticator_id = None
-        self.user_verified = False
-        self.attestation_format = None
-    
+        self.credentials = []
+
+    def has_credential(self):
+        return len(self.credentials) > 0
+
+
+class Credential(db.Model):
+    '''A WebAuthn authenticator registered to a user; users may register several'''
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    user = db.relationship('User', back_populates='credentials')
+
+    # Raw credential id and COSE public key bytes as returned by the authenticator
+    credential_id = db.Column(db.LargeBinary, nullable=False)
+    public_key = db.Column(db.LargeBinary, nullable=False)
+
+    # SHA-256 of `credential_id`: a compact, fixed-width key for the lookup index
+    # (credential ids can be up to 1023 bytes long)
+    credential_id_hash = db.Column(db.BINARY(32), nullable=False, unique=True)
+
+    sign_count = db.Column(db.Integer, default=0)
+    authenticator_id = db.Column(db.String(40))
+    user_verified = db.Column(db.Boolean(), default=False)
+
+    # Values_callable is needed to allow alembic to generate a correct
+    # migration script
+    attestation_format = db.Column(db.Enum(AttestationFormat, validate_strings=True, values_callable=lambda x: [e.value for e in x]))
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.credential_id is not None and self.credential_id_hash is None:
+            self.credential_id_hash = hash_credential_id(self.credential_id)
+
+    def __repr__(self):
+        return f'<Credential {self.id} of user {self.user_id}>'
+
+    @classmethod
+    def find(cls, credential_id):
+        '''Returns the credential with the given raw id, or None'''
+        credential = cls.query.filter_by(credential_id_hash=hash_credential_id(credential_id)).first()
+        if credential and credential.credential_id == credential_id:
+            return credential
+        return None
+
+
 class Interaction(db.Model):
     '''
     Model associating persistent cookie token with individual page interactions;
-    'session' property is implicitly created by relationship in Session class
+    'session' property is implicitly created by relationship in Session class.
+    On MariaDB the table is partitioned by month (see partitions.py), so there it has no
+    foreign key to session and its primary key is (id, timestamp); migrations/env.py keeps
+    autogenerate from undoing that.
     '''
+    __table_args__ = (
+        # Serves lookups of a session's interactions as well as grouping them by submission
+        db.Index('ix_interaction_session_token_group_id', 'session_token', 'group_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     
@@ -157,11 +189,44 @@ class Interaction(db.Model):
     def __repr__(self):
         return f'<Session token {self.session_token} triggered event {self.event} at {self.timestamp}> on page {self.page}'
 
+class InteractionTiming(db.Model):
+    '''
+    Rollup of one page visit (the interactions submitted together under one group id): how
+    long the visit took from page load to form submission, and how long each element kept
+    focus. Written alongside the visit's interactions (see interaction_timings.py).
+    '''
+    __tablename__ = 'interaction_timing'
+    __table_args__ = (
+        # Serves "median load-to-submit time for a page and login method" as a range scan
+        db.Index('ix_interaction_timing_page_method_duration', 'page', 'login_method', 'load_to_submit_ms'),
+    )
+
+    session_token = db.Column(db.String(40), db.ForeignKey('session.token'), primary_key=True)
+    group_id = db.Column(db.String(40), primary_key=True)
+    page = db.Column(db.Enum('/register', '/login', '/add-password', validate_strings=True), nullable=False)
+    # The method the form was submitted with ('did not attempt' if it never was)
+    login_method = db.Column(db.Enum('did not attempt', 'fido', 'password', validate_strings=True), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+
+    # Milliseconds from the page's load event to its submit event (null if either is missing)
+    load_to_submit_ms = db.Column(db.Integer)
+    event_count = db.Column(db.Integer, nullable=False)
+    # JSON object of element id -> milliseconds from focusing it until the next interaction
+    element_dwell_ms = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f'<Visit {self.group_id} to {self.page} took {self.load_to_submit_ms}ms with {self.login_method}>'
+
 class LoginAttempts(db.Model):
     '''
     Model associating email and date with login attempt counts,
     both successful and not.
     '''
+    __table_args__ = (
+        db.UniqueConstraint('email', 'date', name='uq_login_attempts_email_date'),
+    )
+
+    COUNTERS = ('password_successes', 'password_failures', 'fido_successes', 'fido_failures')
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -174,3 +239,59 @@ class LoginAttempts(db.Model):
     password_failures = db.Column(db.Integer, default=0)
     fido_successes = db.Column(db.Integer, default=0)
     fido_failures = db.Column(db.Integer, default=0)
+
+    @classmethod
+    def increment(cls, email, counter, day=None):
+        '''
+        Atomically adds one to `counter` (one of `COUNTERS`) for the given email on `day`
+        (today by default), creating the row if it doesn't exist yet. This is a single
+        INSERT ... ON DUPLICATE KEY UPDATE / ON CONFLICT statement, so concurrent attempts
+        for the same email never lose an increment. Does not commit.
+        '''
+        if counter not in cls.COUNTERS:
+            raise ValueError(f'Unknown login attempt counter: {counter}')
+
+        table = cls.__table__
+        values = {name: 0 for name in cls.COUNTERS}
+        values.update(email=email, date=day or date.today())
+        values[counter] = 1
+        incremented = {counter: sqlalchemy.func.coalesce(table.c[counter], 0) + 1}
+
+        dialect = db.engine.dialect.name
+        if dialect in ('mysql', 'mariadb'):
+            statement = mysql.insert(table).values(**values).on_duplicate_key_update(**incremented)
+        elif dialect == 'sqlite':
+            statement = sqlite.insert(table).values(**values).on_conflict_do_update(
+                index_elements=['email', 'date'], set_=incremented)
+        elif dialect == 'postgresql':
+            statement = postgresql.insert(table).values(**values).on_conflict_do_update(
+                index_elements=['email', 'date'], set_=incremented)
+        else:
+            # No native upsert available, so fall back to an UPDATE followed by an INSERT
+            updated = db.session.execute(
+                table.update()
+                .where(table.c.email == email, table.c.date == values['date'])
+                .values(**incremented)
+            )
+            if updated.rowcount:
+                return
+            statement = table.insert().values(**values)
+
+        db.session.execute(statement)
+
+class WebAuthnChallenge(db.Model):
+    '''
+    A challenge issued for a WebAuthn ceremony, waiting to be consumed by the response to it
+    (see challenges.DatabaseChallengeStore)
+    '''
+    __tablename__ = 'webauthn_challenge'
+
+    # The opaque handle kept in the browser's session
+    handle = db.Column(db.String(40), primary_key=True)
+    # JSON object with the challenge and whatever else the ceremony needs to finish
+    data = db.Column(db.Text, nullable=False)
+    # Expired challenges are deleted in batches by this index
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<WebAuthnChallenge {self.handle} expires at {self.expires_at}>'
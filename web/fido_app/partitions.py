@@ -0,0 +1,393 @@
+'''
+Monthly partitions of the interaction table, and archiving of old ones.
+
+On MariaDB, `interaction` is natively RANGE COLUMNS partitioned on `timestamp` (by the
+d3f8a1c6e947 migration), with one partition per month (`p202203` holds rows before
+2022-04-01 and on or after the previous partition's bound) and a catch-all `pmax`.
+Partitioned InnoDB tables can't have foreign keys, so interaction.session_token isn't
+enforced there.
+
+Other databases keep a plain interaction table. SQLite can opt in to a stand-in with
+`flask interaction-partitions create`, e.g. to try the commands on a development database:
+each partition becomes its own table (`interaction_p202203`, ..., `interaction_pmax`) and
+`interaction` a view over all of them. INSTEAD OF triggers route inserts to the right table
+and draw ids from `interaction_sequence`. Reads, updates and deletes through the
+`Interaction` model and Core inserts work unchanged, but SQLite can't report the id of a row
+inserted through a view, so new rows must be inserted with Core (as `insert_interaction_rows`
+does) rather than by adding `Interaction` objects.
+'''
+from collections import namedtuple
+from datetime import date, datetime, time
+import os
+import click
+import sqlalchemy
+from . import app, db
+from .exports import CsvWriter
+from .models import Interaction
+
+MAX_PARTITION = 'pmax'
+
+# A partition holds rows with `lower <= timestamp < upper`; None means unbounded
+Partition = namedtuple('Partition', ['name', 'lower', 'upper'])
+
+
+def add_months(month, count):
+    '''First day of the month `count` months after the month of `month`'''
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first, last):
+    '''First days of every month from `first`'s month through `last`'s'''
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(month):
+    return f'p{month:%Y%m}'
+
+
+def _partitions_from_names(names):
+    '''Partitions (in order) for the given partition names, deriving bounds from the months they are named after'''
+    months = sorted(datetime.strptime(name[1:], '%Y%m').date() for name in names if name != MAX_PARTITION)
+    partitions, lower = [], None
+    for month in months:
+        upper = add_months(month, 1)
+        partitions.append(Partition(partition_name(month), lower, upper))
+        lower = upper
+    partitions.append(Partition(MAX_PARTITION, lower, None))
+    return partitions
+
+
+def _in_range(timestamp, partition):
+    conditions = []
+    if partition.lower is not None:
+        conditions.append(timestamp >= datetime.combine(partition.lower, time.min))
+    if partition.upper is not None:
+        conditions.append(timestamp < datetime.combine(partition.upper, time.min))
+    return sqlalchemy.and_(True, *conditions)
+
+
+def _added_partitions(existing, months):
+    '''
+    Returns the partitions for `months` that aren't among the `existing` ones, and the full
+    list once they are added. New partitions are split off `pmax`, so they can't precede it.
+    '''
+    names = {partition.name for partition in existing}
+    new = {partition_name(month) for month in months} - names
+    if not new:
+        return [], existing
+
+    partitions = _partitions_from_names(names | new)
+    added = [partition for partition in partitions if partition.name in new]
+    if existing and existing[-1].lower is not None and added[0].upper <= existing[-1].lower:
+        raise click.ClickException('New partitions can only be added after the existing ones')
+    return added, partitions
+
+
+class MariaDBInteractionPartitions:
+    '''Native RANGE COLUMNS partitions of the interaction table'''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def is_partitioned(self):
+        return bool(self.list())
+
+    def list(self):
+        names = self.connection.exec_driver_sql(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'interaction' AND PARTITION_NAME IS NOT NULL"
+        ).scalars().all()
+        return _partitions_from_names(names) if names else []
+
+    def rows(self, partition):
+        '''SELECT of every row in `partition` (pruned to that partition by its bounds)'''
+        table = Interaction.__table__
+        return sqlalchemy.select(table).where(_in_range(table.c.timestamp, partition)).order_by(table.c.id)
+
+    @staticmethod
+    def _definitions(partitions):
+        return ', '.join(
+            f"PARTITION {partition.name} VALUES LESS THAN ('{partition.upper}')" if partition.upper
+            else f'PARTITION {partition.name} VALUES LESS THAN (MAXVALUE)'
+            for partition in partitions
+        )
+
+    def partition(self, months):
+        '''Partitions the (unpartitioned) table into `months` plus `pmax`. Rebuilds the whole table.'''
+        for foreign_key in sqlalchemy.inspect(self.connection).get_foreign_keys('interaction'):
+            self.connection.exec_driver_sql(f'ALTER TABLE interaction DROP FOREIGN KEY {foreign_key["name"]}')
+
+        # Every unique key of a partitioned table must include the partitioning column
+        self.connection.exec_driver_sql('ALTER TABLE interaction DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)')
+        partitions = _partitions_from_names([partition_name(month) for month in months])
+        self.connection.exec_driver_sql(
+            f'ALTER TABLE interaction PARTITION BY RANGE COLUMNS(timestamp) ({self._definitions(partitions)})')
+
+    def unpartition(self):
+        self.connection.exec_driver_sql('ALTER TABLE interaction REMOVE PARTITIONING')
+        self.connection.exec_driver_sql('ALTER TABLE interaction DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
+        self.connection.exec_driver_sql(
+            'ALTER TABLE interaction ADD FOREIGN KEY (session_token) REFERENCES session (token)')
+
+    def add(self, months):
+        '''Splits partitions for `months` off `pmax` (which normally holds no rows, so this is quick)'''
+        added, _ = _added_partitions(self.list(), months)
+        if added:
+            self.connection.exec_driver_sql(
+                f'ALTER TABLE interaction REORGANIZE PARTITION {MAX_PARTITION} INTO '
+                f'({self._definitions(added + [Partition(MAX_PARTITION, None, None)])})')
+        return [partition.name for partition in added]
+
+    def drop(self, partition):
+        self.connection.exec_driver_sql(f'ALTER TABLE interaction DROP PARTITION {partition.name}')
+
+
+class SQLiteInteractionPartitions:
+    '''Table-per-month stand-in for partitions, behind an `interaction` view'''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def is_partitioned(self):
+        return self.connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'interaction'").first() is not None
+
+    def list(self):
+        if not self.is_partitioned():
+            return []
+        names = self.connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'interaction_p%'").scalars().all()
+        return _partitions_from_names([name[len('interaction_'):] for name in names])
+
+    def table(self, partition):
+        metadata = sqlalchemy.MetaData()
+        name = f'interaction_{partition.name}'
+        return sqlalchemy.Table(
+            name, metadata,
+            *(sqlalchemy.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+              for column in Interaction.__table__.columns),
+            sqlalchemy.Index(f'ix_{name}_session_token_group_id', 'session_token', 'group_id'),
+        )
+
+    def rows(self, partition):
+        table = self.table(partition)
+        return sqlalchemy.select(table).order_by(table.c.id)
+
+    def partition(self, months):
+        '''Moves the interaction table's rows into one table per month in `months` (plus `pmax`)'''
+        partitions = _partitions_from_names([partition_name(month) for month in months])
+        self.connection.exec_driver_sql('CREATE TABLE interaction_sequence (id INTEGER NOT NULL)')
+        self.connection.exec_driver_sql('INSERT INTO interaction_sequence SELECT coalesce(max(id), 0) FROM interaction')
+
+        source = Interaction.__table__
+        for partition in partitions:
+            table = self.table(partition)
+            table.create(self.connection)
+            self.connection.execute(table.insert().from_select(
+                [column.name for column in source.columns],
+                sqlalchemy.select(source).where(_in_range(source.c.timestamp, partition)),
+            ))
+
+        self.connection.exec_driver_sql('DROP TABLE interaction')
+        self._create_view(partitions)
+
+    def unpartition(self):
+        partitions = self.list()
+        self._drop_view()
+        Interaction.__table__.create(self.connection)
+        for partition in partitions:
+            table = self.table(partition)
+            self.connection.execute(Interaction.__table__.insert().from_select(
+                [column.name for column in table.columns], sqlalchemy.select(table)))
+            table.drop(self.connection)
+        self.connection.exec_driver_sql('DROP TABLE interaction_sequence')
+
+    def add(self, months):
+        '''Creates tables for `months`, moving any of their rows out of `pmax`'''
+        existing = self.list()
+        added, partitions = _added_partitions(existing, months)
+
+        overflow = self.table(existing[-1])
+        for partition in added:
+            table = self.table(partition)
+            table.create(self.connection)
+            in_range = _in_range(overflow.c.timestamp, partition)
+            self.connection.execute(table.insert().from_select(
+                [column.name for column in overflow.columns], sqlalchemy.select(overflow).where(in_range)))
+            self.connection.execute(overflow.delete().where(in_range))
+
+        if added:
+            self._create_view(partitions)
+        return [partition.name for partition in added]
+
+    def drop(self, partition):
+        self.table(partition).drop(self.connection)
+        self._create_view(self.list())
+
+    def _drop_view(self):
+        for trigger in ('interaction_insert', 'interaction_update', 'interaction_delete'):
+            self.connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger}')
+        self.connection.exec_driver_sql('DROP VIEW IF EXISTS interaction')
+
+    def _create_view(self, partitions):
+        self._drop_view()
+        columns = [column.name for column in Interaction.__table__.columns]
+        names = ', '.join(columns)
+        self.connection.exec_driver_sql('CREATE VIEW interaction AS ' + ' UNION ALL '.join(
+            f'SELECT {names} FROM interaction_{partition.name}' for partition in partitions))
+
+        new_values = ', '.join(['coalesce(NEW.id, (SELECT id FROM interaction_sequence))'] + [f'NEW.{name}' for name in columns[1:]])
+        inserts = []
+        for partition in partitions:
+            conditions = ['1']
+            if partition.lower is not None:
+                conditions.append(f"NEW.timestamp >= '{partition.lower}'")
+            if partition.upper is not None:
+                conditions.append(f"NEW.timestamp < '{partition.upper}'")
+            inserts.append(
+                f'INSERT INTO interaction_{partition.name} ({names}) SELECT {new_values} WHERE {" AND ".join(conditions)};')
+
+        self.connection.exec_driver_sql(
+            'CREATE TRIGGER interaction_insert INSTEAD OF INSERT ON interaction BEGIN '
+            'UPDATE interaction_sequence SET id = max(id + 1, coalesce(NEW.id, 0)); '
+            + ' '.join(inserts) + ' END')
+
+        # (An update never moves a row to another month's table)
+        assignments = ', '.join(f'{name} = NEW.{name}' for name in columns)
+        self.connection.exec_driver_sql(
+            'CREATE TRIGGER interaction_update INSTEAD OF UPDATE ON interaction BEGIN '
+            + ' '.join(f'UPDATE interaction_{partition.name} SET {assignments} WHERE id = OLD.id;' for partition in partitions)
+            + ' END')
+        self.connection.exec_driver_sql(
+            'CREATE TRIGGER interaction_delete INSTEAD OF DELETE ON interaction BEGIN '
+            + ' '.join(f'DELETE FROM interaction_{partition.name} WHERE id = OLD.id;' for partition in partitions)
+            + ' END')
+
+
+def interaction_partitions(connection):
+    '''The partition manager for `connection`'s database'''
+    if connection.dialect.name in ('mysql', 'mariadb'):
+        return MariaDBInteractionPartitions(connection)
+    if connection.dialect.name == 'sqlite':
+        return SQLiteInteractionPartitions(connection)
+    raise click.ClickException(f'Interaction partitioning is not supported on {connection.dialect.name}')
+
+
+def partition_months(connection, today=None, months_ahead=3):
+    '''Months to partition an existing interaction table into: its oldest row's month through `months_ahead` from now'''
+    today = today or date.today()
+    oldest = connection.execute(sqlalchemy.select(sqlalchemy.func.min(Interaction.__table__.c.timestamp))).scalar()
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    first = min(oldest.date(), today) if oldest else today
+    return list(months_between(first, add_months(today, months_ahead)))
+
+
+def archive_partition(connection, partitions, partition, directory):
+    '''
+    Writes every row of `partition` to `<directory>/interaction-<name>.csv.gz` and then drops
+    the partition, unless the file doesn't hold exactly as many rows as the partition does.
+    Returns the number of rows archived.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'interaction-{partition.name}.csv.gz')
+    temporary = path + '.tmp'
+    rows = partitions.rows(partition)
+
+    writer = CsvWriter(temporary, list(rows.selected_columns))
+    archived = 0
+    try:
+        result = connection.execution_options(stream_results=True).execute(rows)
+        for chunk in result.partitions(10000):
+            writer.write(chunk)
+            archived += len(chunk)
+    finally:
+        writer.close()
+
+    expected = connection.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(rows.subquery())).scalar()
+    if archived != expected:
+        os.remove(temporary)
+        raise click.ClickException(f'Archived {archived} of {expected} rows from {partition.name}; not dropping it')
+
+    os.replace(temporary, path)
+    partitions.drop(partition)
+    return archived
+
+
+@app.cli.group('interaction-partitions')
+def partitions_cli():
+    '''Manage the monthly partitions of the interaction table'''
+
+
+def _partitions(connection):
+    partitions = interaction_partitions(connection)
+    if not partitions.is_partitioned():
+        raise click.ClickException(
+            'The interaction table is not partitioned; run `flask db upgrade` (MariaDB) or '
+            '`flask interaction-partitions create` first')
+    return partitions
+
+
+@partitions_cli.command('create')
+def create_command():
+    '''Partition the interaction table by month (the migration already does this on MariaDB)'''
+    with db.engine.begin() as connection:
+        partitions = interaction_partitions(connection)
+        if partitions.is_partitioned():
+            raise click.ClickException('The interaction table is already partitioned')
+        months = partition_months(connection)
+        partitions.partition(months)
+    click.echo(f'Partitioned interactions into {len(months)} months plus {MAX_PARTITION}')
+
+
+@partitions_cli.command('list')
+def list_command():
+    '''List partitions with their date ranges and row counts'''
+    with db.engine.connect() as connection:
+        partitions = _partitions(connection)
+        for partition in partitions.list():
+            rows = partitions.rows(partition)
+            count = connection.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(rows.subquery())).scalar()
+            click.echo(f'{partition.name:<8} {str(partition.lower or ""):>10} .. {str(partition.upper or ""):<10} {count:>10} rows')
+
+
+@partitions_cli.command('ensure')
+@click.option('--months-ahead', type=int, default=3, show_default=True)
+def ensure_command(months_ahead):
+    '''Create partitions for the coming months (run this at least monthly, e.g. from cron)'''
+    today = date.today()
+    with db.engine.begin() as connection:
+        added = _partitions(connection).add(months_between(today, add_months(today, months_ahead)))
+    click.echo(f'Added partitions {", ".join(added)}' if added else 'All partitions already exist')
+
+
+@partitions_cli.command('archive')
+@click.option('--keep-months', type=int, help='Months of interactions to keep (default INTERACTION_RETENTION_MONTHS)')
+@click.option('--archive-dir', type=click.Path(file_okay=False), help='Default INTERACTION_ARCHIVE_DIR')
+@click.option('--dry-run', is_flag=True, help='Only list the partitions that would be archived')
+def archive_command(keep_months, archive_dir, dry_run):
+    '''Archive partitions older than the retention period to gzip CSV files and drop them'''
+    keep_months = keep_months if keep_months is not None else app.config['INTERACTION_RETENTION_MONTHS']
+    if not keep_months:
+        raise click.UsageError('No retention period: pass --keep-months or set INTERACTION_RETENTION_MONTHS')
+    archive_dir = archive_dir or app.config['INTERACTION_ARCHIVE_DIR']
+
+    # Keep the current month plus the `keep_months - 1` before it
+    cutoff = add_months(date.today(), 1 - keep_months)
+    with db.engine.connect() as connection:
+        partitions = _partitions(connection)
+        expired = [p for p in partitions.list() if p.upper is not None and p.upper <= cutoff]
+        for partition in expired:
+            if dry_run:
+                click.echo(f'Would archive {partition.name}')
+                continue
+            with connection.begin():
+                archived = archive_partition(connection, partitions, partition, archive_dir)
+            click.echo(f'Archived {archived} rows from {partition.name} to {archive_dir}')
+
+    if not expired:
+        click.echo('No partitions are past the retention period')
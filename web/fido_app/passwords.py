@@ -0,0 +1,94 @@
+''' Password hashing, run in a bounded process pool so it doesn't pin request workers '''
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from . import app
+from .metrics import timed
+
+
+def hash_parameters(method):
+    '''
+    What a werkzeug hash method determines about its hashes, with werkzeug's default iteration
+    count filled in, so e.g. 'pbkdf2:sha256' and 'pbkdf2:sha256:260000' compare equal
+    '''
+    if not method.startswith('pbkdf2:'):
+        return (method,)
+    hash_name, _, iterations = method[len('pbkdf2:'):].partition(':')
+    return ('pbkdf2', hash_name, int(iterations) if iterations else DEFAULT_PBKDF2_ITERATIONS)
+
+
+class PasswordHashingBusy(Exception):
+    '''Raised when a hash couldn't be started within PASSWORD_HASH_QUEUE_TIMEOUT seconds'''
+
+
+class PasswordHasher:
+    '''
+    Runs werkzeug's password hashing in a pool of PASSWORD_HASH_WORKERS processes. At most
+    PASSWORD_HASH_CONCURRENCY hashes may be queued or running at once, so some request threads
+    are always left for other requests; callers that can't get a slot within
+    PASSWORD_HASH_QUEUE_TIMEOUT seconds get a `PasswordHashingBusy` error instead of waiting
+    indefinitely. With PASSWORD_HASH_WORKERS set to 0, hashing runs inline.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def method(self):
+        return self.app.config['PASSWORD_HASH_METHOD']
+
+    def hash(self, password):
+        '''Returns a salted hash of `password` using the configured method'''
+        with timed('password_hash'):
+            return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        '''Checks `password` against a hash produced by any supported method'''
+        with timed('password_verify'):
+            return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        '''Whether `password_hash` was made with a different method or cost than configured'''
+        return hash_parameters(password_hash.split('$', 1)[0]) != hash_parameters(self.method)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # Wait for the pool to stop: on Python 3.8 a pool that is garbage collected while its
+        # management thread is still running keeps the interpreter from exiting
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+    def _run(self, func, *args):
+        workers = self.app.config['PASSWORD_HASH_WORKERS']
+        if workers <= 0:
+            return func(*args)
+
+        executor, slots = self._get_executor(workers)
+        if not slots.acquire(timeout=self.app.config['PASSWORD_HASH_QUEUE_TIMEOUT']):
+            raise PasswordHashingBusy()
+
+        try:
+            return executor.submit(func, *args).result()
+        finally:
+            slots.release()
+
+    def _get_executor(self, workers):
+        # Pools don't survive a fork, so each gunicorn worker lazily builds its own. Its processes
+        # are spawned rather than forked, since forking a process that runs request threads can
+        # copy locks some other thread holds
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+                self._slots = threading.BoundedSemaphore(self.app.config['PASSWORD_HASH_CONCURRENCY'])
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+
+password_hasher = PasswordHasher(app)
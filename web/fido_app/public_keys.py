@@ -0,0 +1,158 @@
+''' Cache of parsed credential public keys, and the assertion verification that uses it '''
+from collections import OrderedDict
+import hashlib
+import threading
+from cryptography.exceptions import InvalidSignature
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+from webauthn.authentication.verify_authentication_response import VerifiedAuthentication
+from webauthn.helpers import (
+    bytes_to_base64url,
+    decode_credential_public_key,
+    decoded_public_key_to_cryptography,
+    parse_authenticator_data,
+    parse_client_data_json,
+    verify_signature,
+)
+from webauthn.helpers.exceptions import InvalidAuthenticationResponse
+from webauthn.helpers.structs import ClientDataType, PublicKeyCredentialType, TokenBindingStatus
+from . import app
+from .models import Credential
+
+
+class ParsedPublicKey:
+    '''A credential's COSE public key alongside its decoded and `cryptography` forms'''
+
+    def __init__(self, public_key):
+        self.public_key = public_key
+        self.decoded = decode_credential_public_key(public_key)
+        self.crypto_key = decoded_public_key_to_cryptography(self.decoded)
+
+
+class PublicKeyCache:
+    '''
+    LRU of `ParsedPublicKey`s keyed by credential id and a hash of the public key bytes, so a
+    credential whose key changes can never be verified against the old parsed key
+    '''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, credential_id, public_key):
+        key = (credential_id, hashlib.sha256(public_key).digest())
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        parsed = ParsedPublicKey(public_key)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = parsed
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return parsed
+
+    def invalidate(self, credential_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == credential_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+public_key_cache = PublicKeyCache(app.config['PUBLIC_KEY_CACHE_MAX_ENTRIES'])
+
+
+
+def verify_assertion(
+    credential,
+    credential_id,
+    credential_public_key,
+    expected_challenge,
+    expected_rp_id,
+    expected_origin,
+    credential_current_sign_count,
+    require_user_verification=False,
+):
+    '''
+    Verifies an assertion like py_webauthn's `verify_authentication_response` (the same checks,
+    built from its helpers), but checks the signature with the parsed public key for
+    `credential_id` from `public_key_cache`, since py_webauthn only accepts the raw COSE bytes
+    and parses them on every call. Raises `InvalidAuthenticationResponse` if it doesn't verify.
+    '''
+    if bytes_to_base64url(credential.raw_id) != credential.id:
+        raise InvalidAuthenticationResponse('id and raw_id were not equivalent')
+    if credential.type != PublicKeyCredentialType.PUBLIC_KEY:
+        raise InvalidAuthenticationResponse(f'Unexpected credential type "{credential.type}", expected "public-key"')
+
+    response = credential.response
+    client_data = parse_client_data_json(response.client_data_json)
+    if client_data.type != ClientDataType.WEBAUTHN_GET:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected client data type "{client_data.type}", expected "{ClientDataType.WEBAUTHN_GET}"')
+    if client_data.challenge != expected_challenge:
+        raise InvalidAuthenticationResponse('Client data challenge was not expected challenge')
+
+    expected_origins = [expected_origin] if isinstance(expected_origin, str) else expected_origin
+    if client_data.origin not in expected_origins:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected client data origin "{client_data.origin}", expected one of {expected_origins}')
+    if client_data.token_binding and client_data.token_binding.status not in (
+            TokenBindingStatus.SUPPORTED, TokenBindingStatus.PRESENT):
+        raise InvalidAuthenticationResponse(f'Unexpected token_binding status of "{client_data.token_binding.status}"')
+
+    auth_data = parse_authenticator_data(response.authenticator_data)
+    if auth_data.rp_id_hash != hashlib.sha256(expected_rp_id.encode('utf-8')).digest():
+        raise InvalidAuthenticationResponse('Unexpected RP ID hash')
+    if not auth_data.flags.up:
+        raise InvalidAuthenticationResponse('User was not present during authentication')
+    if require_user_verification and not auth_data.flags.uv:
+        raise InvalidAuthenticationResponse(
+            'User verification is required but user was not verified during authentication')
+
+    # The sign count must have gone up since the credential was last used, otherwise this
+    # might be a replayed response
+    if (auth_data.sign_count > 0 or credential_current_sign_count > 0) \
+            and auth_data.sign_count <= credential_current_sign_count:
+        raise InvalidAuthenticationResponse(
+            f'Response sign count of {auth_data.sign_count} was not greater than current count of '
+            f'{credential_current_sign_count}')
+
+    parsed = public_key_cache.get(credential_id, credential_public_key)
+    try:
+        verify_signature(
+            public_key=parsed.crypto_key,
+            signature_alg=parsed.decoded.alg,
+            signature=response.signature,
+            data=response.authenticator_data + hashlib.sha256(response.client_data_json).digest(),
+        )
+    except InvalidSignature:
+        raise InvalidAuthenticationResponse('Could not verify authentication signature')
+
+    return VerifiedAuthentication(credential_id=credential.raw_id, new_sign_count=auth_data.sign_count)
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _invalidate_replaced_keys(session, flush_context, instances):
+    for obj in (*session.dirty, *session.deleted):
+        if not isinstance(obj, Credential):
+            continue
+        state = inspect(obj)
+        if obj in session.deleted or state.attrs.public_key.history.has_changes():
+            public_key_cache.invalidate(state.committed_state.get('credential_id', obj.credential_id))
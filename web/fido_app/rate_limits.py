@@ -0,0 +1,170 @@
+'''
+Token-bucket rate limits on the login and registration endpoints, per client IP address and
+per email address (see RATE_LIMITS in config.py).
+
+The limits are checked in a `before_request` hook, so a rejected attempt costs one SQLite
+statement instead of a password hash or signature check and a LoginAttempts commit. The
+buckets live in a small SQLite file (RATE_LIMIT_STORE) that every gunicorn worker on the host
+shares; each check is a single atomic UPSERT, so workers never need a lock of their own.
+'''
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import Response, jsonify, request, session, url_for
+from . import app
+from .metrics import metrics
+
+rate_limited_total = metrics.counter(
+    'fido_rate_limited_total', 'Requests rejected by a rate limit', ('endpoint', 'key'))
+
+# Where to send the browser back to when one of the JSON (WebAuthn) endpoints is rate limited
+JSON_ENDPOINT_PAGES = {
+    'webauthn_login_start': 'login',
+    'webauthn_verify_login': 'login',
+    'webauthn_registration_start': 'register',
+    'verify_registration_credentials': 'register',
+}
+
+# Remove buckets that have refilled completely once every this many checks per process
+PRUNE_EVERY = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bucket (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    full_at REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID
+'''
+
+# The bucket's tokens after refilling at `rate` per second since it was last updated
+_REFILLED = 'min(:capacity, tokens + (:now - updated) * :rate)'
+
+# Takes a token if one is available (a rejected request doesn't use one up). SQLite evaluates
+# every SET expression against the row as it was, and the statement is atomic across processes
+TAKE = f'''
+INSERT INTO bucket (key, tokens, updated, full_at, allowed)
+VALUES (:key, :capacity - 1, :now, :now + 1 / :rate, 1)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = {_REFILLED} - ({_REFILLED} >= 1),
+    updated = :now,
+    full_at = :now + (:capacity - {_REFILLED} + ({_REFILLED} >= 1)) / :rate,
+    allowed = {_REFILLED} >= 1
+RETURNING allowed, tokens
+'''
+
+
+class TokenBucketStore:
+    '''
+    Token buckets in a SQLite file shared by every process that opens the same `path`. Each
+    thread uses its own connection (reopened after a fork).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+
+    @property
+    def connection(self):
+        key = (os.getpid(), self.path)
+        if getattr(self._local, 'key', None) != key:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            # The buckets are disposable, so trade durability for speed: no fsync per check
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(SCHEMA)
+            self._local.connection, self._local.key = connection, key
+        return self._local.connection
+
+    def take(self, key, limit, now=None):
+        '''
+        Takes a token from the bucket `key`, which holds up to `limit[0]` tokens and refills
+        them over `limit[1]` seconds. Returns 0 if the request is allowed, otherwise the
+        number of seconds until a token is available.
+        '''
+        capacity, seconds = limit
+        rate = capacity / seconds
+        now = time.time() if now is None else now
+        connection = self.connection
+        allowed, tokens = connection.execute(
+            TAKE, {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}).fetchone()
+
+        self._checks += 1
+        if self._checks % PRUNE_EVERY == 0:
+            self.prune(now)
+        return 0 if allowed else (1 - tokens) / rate
+
+    def prune(self, now=None):
+        '''Deletes buckets that are full again (a missing bucket is a full one)'''
+        self.connection.execute('DELETE FROM bucket WHERE full_at <= ?', (time.time() if now is None else now,))
+
+    def clear(self):
+        self.connection.execute('DELETE FROM bucket')
+
+
+_stores = {}
+
+
+def get_store():
+    '''The bucket store at RATE_LIMIT_STORE'''
+    path = app.config['RATE_LIMIT_STORE']
+    store = _stores.get(path)
+    if store is None:
+        store = _stores.setdefault(path, TokenBucketStore(path))
+    return store
+
+
+def _email_for(endpoint):
+    '''The email address an attempt is for: the form field, or the ceremony in progress'''
+    if endpoint == 'webauthn_verify_login':
+        return session.get('login', {}).get('email')
+    if endpoint == 'verify_registration_credentials':
+        return session.get('registration', {}).get('email')
+    return request.form.get('email')
+
+
+def _too_many_requests(endpoint, retry_after):
+    '''
+    A 429 response. It doesn't flash a message, since that would save the session and make
+    rejected requests cost a database write again
+    '''
+    message = f'Too many attempts. Please try again in {retry_after} seconds.'
+    page = JSON_ENDPOINT_PAGES.get(endpoint)
+    if page:
+        response = jsonify({'error': message, 'redirect': url_for(page)})
+        response.status_code = 429
+    else:
+        response = Response(message, status=429, mimetype='text/plain')
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+@app.before_request
+def _check_rate_limits():
+    if request.method != 'POST' or not app.config['RATE_LIMIT_ENABLED']:
+        return None
+
+    limits = app.config['RATE_LIMITS'].get(request.endpoint)
+    if not limits:
+        return None
+
+    store = get_store()
+    checks = (('ip', request.remote_addr), ('email', limits.get('email') and _email_for(request.endpoint)))
+    for key, value in checks:
+        limit = limits.get(key)
+        if not (limit and value):
+            continue
+
+        # Limit on the normalized email so changing its case doesn't get a fresh bucket
+        if key == 'email':
+            value = str(value).strip().lower()
+        retry_after = store.take(f'{request.endpoint}:{key}:{value}', limit)
+        if retry_after:
+            rate_limited_total.inc(endpoint=request.endpoint, key=key)
+            app.logger.info(f'Rate limited {request.endpoint} for {key} {value}')
+            return _too_many_requests(request.endpoint, math.ceil(retry_after))
+    return None
@@ -1,20 +1,42 @@
 ''' API ROUTE IMPLEMENTATION '''
 
-from datetime import date, datetime, timezone
+from datetime import date
 from uuid import uuid4
-from flask import request, session, render_template, url_for, redirect, flash, jsonify
+from flask import request, session, render_template, url_for, redirect, flash, jsonify, abort, Response
 from flask_login import current_user, login_user, logout_user, login_required
 import sqlalchemy
 from . import app, login_manager, db
-from .utils import get_or_create, validate_email, get_display_name, get_elapsed_days, append_to_login_bitfield
-from .models import Session, User, Interaction, LoginAttempts
+from .utils import get_or_create, validate_email, get_display_name, get_elapsed_days, append_to_login_bitmap
+from .models import Session, User, LoginAttempts
+from .passwords import PasswordHashingBusy
+from .user_cache import load_cached_user
+from .database_pool import pool_metrics
+from .metrics import metrics
+from .routing_session import read_replica, reads_from_replica
+from .webauthn_routes import discoverable_login_options
+from .interactions import (
+    InvalidInteractionBatch,
+    InteractionQueueFull,
+    interaction_queue,
+    parse_interaction_batch,
+    insert_interaction_rows,
+)
 
 MIN_PASSWORD_LENGTH = 8
 
 @login_manager.user_loader
 def load_user(user_id):
     """Loads a user based on their id, returning None if they don't exist"""
-    return User.query.get(int(user_id))
+    with read_replica():
+        return load_cached_user(int(user_id))
+
+
+@app.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(e):
+    '''Too many password hashes are queued, so ask the user to retry instead of waiting'''
+    db.session.rollback()
+    flash('The server is busy right now. Please try again in a moment.', 'error')
+    return redirect(request.path)
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -27,9 +49,11 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for('profile'))
 
-    # Return the login template if the user is just GETTING the page
+    # Return the login template if the user is just GETTING the page, with the options for a
+    # usernameless biometric login already in it
     if request.method == 'GET':
-        return render_template('login.html')
+        webauthn_options, challenge_handle = discoverable_login_options()
+        return render_template('login.html', webauthn_options=webauthn_options, challenge_handle=challenge_handle)
 
     # Otherwise, it's a post request
     email = request.form.get('email')
@@ -40,53 +64,40 @@ def login():
         flash('Must enter an email and a password', 'error')
         return redirect(url_for('login'))
 
-    # Get existing login attempt db entry or create new one
-    attempts = LoginAttempts.query.filter_by(email=email, date=date.today()).first()
-
-    if not attempts:
-        attempts = LoginAttempts(
-            email=email,
-            date=date.today(),
-            password_successes=0,
-            password_failures=0,
-            fido_successes=0,
-            fido_failures=0
-        )
-
     # Get user by email
     user = User.query.filter_by(email=email).first()
 
     # If user doesn't exist, doesn't have a password, or the email/password is incorrect,
     # do not log in; also update failed login count
     if not user or not user.has_password() or not user.check_password(password):
-        attempts.password_failures += 1
-        db.session.add(attempts)
+        LoginAttempts.increment(email, 'password_failures')
         db.session.commit()
         
         flash('Email or passsword is incorrect', 'error')
         return redirect(url_for('login'))
 
     # Update successful login count
-    attempts.password_successes += 1
-    db.session.add(attempts)
-    db.session.commit()
+    LoginAttempts.increment(email, 'password_successes')
+
+    # Upgrade the stored hash if the configured hash method or cost has changed
+    if user.password_needs_rehash():
+        user.set_password(password)
     
     # Update login trackers
     if user.last_complete_login != date.today():
         if 'logged_in_today' in session and session['logged_in_today'] == 'fido2':
             del session['logged_in_today']
-            user.login_bitfield = append_to_login_bitfield(
-                user.login_bitfield,
+            user.login_bitmap = append_to_login_bitmap(
+                user.login_bitmap,
                 get_elapsed_days(user.last_complete_login)
             )
             user.last_complete_login = date.today()
-            db.session.add(user)
-            db.session.commit()
         else:
             session['logged_in_today'] = 'password'
 
-    # Log the user into the profile page
-    user.add_session(session, commit=True)
+    # Log the user into the profile page, saving all of the above in one transaction
+    user.add_session(session)
+    db.session.commit()
     login_user(user, remember=False)
     return redirect(url_for('profile'))
 
@@ -141,14 +152,14 @@ def register():
         email=email,
         display_name=get_display_name(email),
         last_complete_login=date.today(),
-        login_bitfield=0,
+        login_bitmap=b'',
     )
 
     new_user.set_password(password)
     db.session.add(new_user)
+    new_user.add_session(session)
     db.session.commit()
 
-    new_user.add_session(session, commit=True)
     login_user(new_user, remember=False)
 
     # Redirect user to profile page
@@ -159,6 +170,7 @@ def register():
 # Page to edit user information
 @app.route('/profile')
 @login_required
+@reads_from_replica
 def profile():
     return render_template('profile.html')
 
@@ -225,29 +237,55 @@ def submit_interactions():
     # Used to tag every interaction submitted in one request
     request_id = str(uuid4())
 
-    # If this is the first session with this token, we need this line to ensure the foreign key
-    # between interactions and sessions is properly setup
-    session_model = get_or_create(db.session, Session, token=session['token'])
+    try:
+        rows = parse_interaction_batch(data, session['token'], request_id)
+    except InvalidInteractionBatch as e:
+        return jsonify(error=str(e)), 400
 
-    for log in data:
+    # Hand the batch off to the background writer instead of waiting on the database
+    if app.config['INTERACTION_WRITE_BEHIND']:
         try:
-            new_interaction = Interaction(
-                session_token=session_model.token,
-                element=log['element'],
-                event=log['event'],
-                login_method=log['login_method'],
-                page=log['page'],
-                timestamp=datetime.fromtimestamp(log['timestampMs'] / 1000, timezone.utc),
-                group_id=request_id,
-            )
-            db.session.add(new_interaction)
-        except KeyError as e:
-            return jsonify(error=f'An interaction is missing a required key: {e.args[0]}'), 400
-        except (OSError, OverflowError):
-            return jsonify(error=f'An interaction had an invalid UTC timestamp: {log["timestampMs"]}'), 400
-        except sqlalchemy.exc.DBAPIError as e:
-            return jsonify(error=f'Database error: {e}'), 400
+            interaction_queue.submit(rows)
+        except InteractionQueueFull:
+            return jsonify(error='Too many interactions are waiting to be saved; try again later'), 503
+        return jsonify(success=True), 202
 
-    db.session.commit()
+    # If this is the first session with this token, we need this line to ensure the foreign key
+    # between interactions and sessions is properly setup
+    get_or_create(db.session, Session, token=session['token'])
+
+    try:
+        insert_interaction_rows(db.session, rows)
+        db.session.commit()
+    except sqlalchemy.exc.DBAPIError as e:
+        db.session.rollback()
+        return jsonify(error=f'Database error: {e}'), 400
     
     return jsonify(success=True)
+
+
+# Write-behind queue statistics (only reachable from the server itself)
+@app.route('/interactions/metrics')
+def interaction_metrics():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+
+    return jsonify(interaction_queue.metrics())
+
+
+# Connection pool statistics (only reachable from the server itself)
+@app.route('/database/metrics')
+def database_metrics():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+
+    return jsonify(pool_metrics(db.engine))
+
+
+# Prometheus metrics for every worker (only reachable from the server itself)
+@app.route('/metrics')
+def prometheus_metrics():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,101 @@
+''' Sends read-only work to a database replica (when one is configured) and everything else to the primary '''
+from contextlib import contextmanager
+from functools import wraps
+import time
+from flask import current_app, has_request_context, session as flask_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = 'replica'
+
+# Flask session key holding the time until which this browser's reads stay on the primary
+READ_PRIMARY_UNTIL = '_read_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Session that reads from the replica inside `read_replica()` blocks, unless it already wrote
+    something (so a request always sees its own writes). Flushes and INSERT/UPDATE/DELETE
+    statements always go to the primary.
+    '''
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.info.get('replica_depth')
+            and not self.info.get('wrote')
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+            and REPLICA_BIND in self.app.config['SQLALCHEMY_BINDS']
+        ):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''`SQLAlchemy` whose scoped session is a `RoutingSession`'''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_configured(app):
+    return REPLICA_BIND in app.config['SQLALCHEMY_BINDS']
+
+
+def _pinned_to_primary():
+    return has_request_context() and flask_session.get(READ_PRIMARY_UNTIL, 0) > time.time()
+
+
+@contextmanager
+def read_replica():
+    '''
+    Routes the queries made inside the `with` block to the replica, unless this browser wrote
+    to the primary within the last REPLICA_READ_YOUR_WRITES_SECONDS
+    '''
+    session = get_state(current_app).db.session
+    if not replica_configured(current_app) or _pinned_to_primary():
+        yield
+        return
+
+    info = session().info
+    info['replica_depth'] = info.get('replica_depth', 0) + 1
+    try:
+        yield
+    finally:
+        info['replica_depth'] -= 1
+
+
+def reads_from_replica(view):
+    '''Decorator running a whole view inside `read_replica()`'''
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _mark_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        session.info['wrote'] = session.info['flushed_entities'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_to_primary(session):
+    '''
+    Keep this browser's reads on the primary until the replica has (very likely) caught up
+    with the rows it just wrote, e.g. the user and session rows a login creates. Bulk
+    statements (interaction logs, login attempt counters) are never read back, so they
+    don't pin.
+    '''
+    app = session.app
+    if session.info.pop('flushed_entities', False) and replica_configured(app) and has_request_context():
+        flask_session[READ_PRIMARY_UNTIL] = time.time() + app.config['REPLICA_READ_YOUR_WRITES_SECONDS']
@@ -0,0 +1,231 @@
+''' Flask session interfaces: server-side storage keyed by the session token, or the signed cookie '''
+from collections import OrderedDict
+import hashlib
+import hmac
+import threading
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface, session_json_serializer
+from itsdangerous import BadSignature, Signer, want_bytes
+import sqlalchemy
+from . import db
+from .utils import get_random_session_token
+
+# What every session holds, logged in or not: its token and the keys Flask-Login writes on
+# each request (plus a CSRF secret derived from the token). A session with nothing else in it
+# has nothing worth storing
+ANONYMOUS_SESSION_KEYS = {'token', '_fresh', '_id', '_remember', '_remember_seconds'}
+
+
+class SecureCookieSessionInterfaceWithToken(SecureCookieSessionInterface):
+    '''Keeps the whole session in the signed cookie, making sure it always has a token'''
+
+    def open_session(self, app, request):
+        session = super().open_session(app, request)
+        if 'token' not in session:
+            session['token'] = get_random_session_token()
+        return session
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+
+
+class ServerSideSession(SecureCookieSession):
+    '''
+    Session whose data lives in a session store; `sid` is the token the cookie was opened with
+    and `payload` the serialized data as it was loaded
+    '''
+
+    def __init__(self, initial=None, sid=None, payload=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.payload = payload
+
+
+class DatabaseSessionStore:
+    '''
+    Stores serialized session data in the `data` column of the `session` table, next to the
+    token that interactions are already recorded against. Uses its own connection so saving
+    the session never commits (or rolls back) the request's ORM transaction.
+    '''
+
+    @property
+    def table(self):
+        return db.metadata.tables['session']
+
+    def load(self, sid):
+        with db.engine.connect() as connection:
+            return connection.execute(
+                sqlalchemy.select(self.table.c.data).where(self.table.c.token == sid)
+            ).scalar()
+
+    def save(self, sid, payload):
+        update = self.table.update().where(self.table.c.token == sid).values(data=payload)
+
+        with db.engine.begin() as connection:
+            if connection.execute(update).rowcount:
+                return
+
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(self.table.insert().values(token=sid, data=payload))
+        except sqlalchemy.exc.IntegrityError:
+            # The row was created concurrently (e.g. by an interaction submission)
+            with db.engine.begin() as connection:
+                connection.execute(update)
+
+    def discard(self, sid):
+        # The row itself is kept since interactions and users still refer to the token
+        with db.engine.begin() as connection:
+            connection.execute(self.table.update().where(self.table.c.token == sid).values(data=None))
+
+
+class MemorySessionStore:
+    '''Per-process LRU of session data, for tests and single-worker development servers'''
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def load(self, sid):
+        with self._lock:
+            if sid not in self._sessions:
+                return None
+            self._sessions.move_to_end(sid)
+            return self._sessions[sid]
+
+    def save(self, sid, payload):
+        with self._lock:
+            self._sessions[sid] = payload
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def discard(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    '''
+    Keeps session data in `store` and only a signed, opaque session id in the cookie. The id is
+    the session's `token`, so giving a session a new token moves its data to a new id (and
+    clears the old one). Sessions whose data didn't change during a request aren't written
+    back, anonymous sessions (see ANONYMOUS_SESSION_KEYS) are never written, and the cookie is
+    only sent when the id changes.
+    '''
+    session_class = ServerSideSession
+    salt = 'server-side-session'
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+
+        # Static files never need the session, so don't pay for a store lookup
+        if request.endpoint == 'static':
+            return self.make_null_session(app)
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+
+            if sid:
+                payload = self.store.load(sid)
+                if payload:
+                    return self.session_class(session_json_serializer.loads(payload), sid=sid, payload=payload)
+                # An anonymous session (nothing stored), which keeps its token
+                return self.anonymous_session(app, sid, sid=sid)
+
+        return self.anonymous_session(app, get_random_session_token())
+
+    def csrf_secret(self, app, token):
+        '''
+        The CSRF secret Flask-WTF would otherwise generate and keep in the session, derived from
+        the session's token so that rendering a form doesn't make a session worth storing
+        '''
+        return hmac.new(want_bytes(app.secret_key), want_bytes(token), hashlib.sha1).hexdigest()
+
+    def anonymous_session(self, app, token, sid=None):
+        csrf_field = app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+        return self.session_class({'token': token, csrf_field: self.csrf_secret(app, token)}, sid=sid)
+
+    def is_anonymous(self, app, session):
+        '''True if the session holds nothing that can't be rebuilt from its token'''
+        csrf_field = app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+        csrf_secret = session.get(csrf_field)
+        return (
+            set(session) - {csrf_field} <= ANONYMOUS_SESSION_KEYS
+            and (csrf_secret is None or csrf_secret == self.csrf_secret(app, session.get('token')))
+        )
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session.modified:
+            return
+
+        # Flask-Login marks anonymous sessions as modified on every request without
+        # actually changing them, so compare against what was loaded
+        sid = session.get('token') or get_random_session_token()
+        if self.is_anonymous(app, session):
+            # e.g. a crawler's first request, or a logout (which clears what was stored)
+            payload = None
+        else:
+            payload = session_json_serializer.dumps(dict(session))
+        if sid == session.sid and payload == session.payload:
+            return
+
+        if payload is not None:
+            self.store.save(sid, payload)
+
+        if sid == session.sid:
+            if payload is None:
+                self.store.discard(sid)
+            return
+
+        # Don't leave the old session's data (e.g. a logged-in user id) reachable
+        if session.payload is not None:
+            self.store.discard(session.sid)
+
+        response.set_cookie(
+            self.get_cookie_name(app),
+            self.get_signer(app).sign(sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def create_session_interface(app):
+    '''Builds the session interface selected by the SESSION_BACKEND config value'''
+    backend = app.config['SESSION_BACKEND']
+
+    if backend == 'cookie':
+        return SecureCookieSessionInterfaceWithToken()
+    if backend == 'database':
+        return ServerSideSessionInterface(DatabaseSessionStore())
+    if backend == 'memory':
+        return ServerSideSessionInterface(MemorySessionStore(app.config['SESSION_MEMORY_MAX_ENTRIES']))
+
+    raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
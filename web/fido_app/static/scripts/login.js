@@ -5,14 +5,30 @@
 // Find form elements in the DOM
 const loginForm = document.getElementById("login-form");
 const authMethodToggler = document.getElementById("auth-method-toggler");
+const emailInput = document.getElementById("email");
+
+// Options for a usernameless login (an empty allow list), generated with the page
+const embeddedRequestOptions = JSON.parse(loginForm.dataset.webauthnOptions);
+const embeddedChallengeHandle = loginForm.dataset.challengeHandle;
+
+function isUsingBiometrics() {
+  return authMethodToggler.getAttribute("aria-expanded") === "false";
+}
+
+/**
+ * Biometric logins may leave the email blank to use a discoverable credential, so only
+ * password logins require it
+ */
+function setEmailRequired() {
+  // This handler fires BEFORE the `aria-expanded` attribute changes (see auth-method-toggler.js)
+  emailInput.required = isUsingBiometrics();
+}
 
 /**
  * Based on the user's choice to use biometrics, send the request to log them in
  */
 function sendLoginForm(formSubmissionEvent) {
-  const isUsingBiometrics = authMethodToggler.getAttribute("aria-expanded") === "false";
-
-  if (isUsingBiometrics) {
+  if (isUsingBiometrics()) {
     formSubmissionEvent.preventDefault();
 
     startBiometricLogin(new FormData(loginForm));
@@ -34,12 +50,17 @@ function sendLoginForm(formSubmissionEvent) {
  */
 const startBiometricLogin = async (formData) => {
 
-  // post the login data to the server to retrieve the PublicKeyCredentialRequestOptions
-  let credentialRequestOptionsFromServer;
-  try {
-    credentialRequestOptionsFromServer = await getCredentialRequestOptionsFromServer(formData);
-  } catch (err) {
-    return console.error("Error when getting request options from server:", err);
+  // Without an email, use the options embedded in the page and let the authenticator pick
+  // the user's discoverable credential (saving a round trip). With one, post it to the
+  // server to retrieve the PublicKeyCredentialRequestOptions for that user's credentials
+  const isUsernameless = !formData.get("email");
+  let credentialRequestOptionsFromServer = embeddedRequestOptions;
+  if (!isUsernameless) {
+    try {
+      credentialRequestOptionsFromServer = await getCredentialRequestOptionsFromServer(formData);
+    } catch (err) {
+      return console.error("Error when getting request options from server:", err);
+    }
   }
 
   // convert certain members of the PublicKeyCredentialRequestOptions into
@@ -64,7 +85,8 @@ const startBiometricLogin = async (formData) => {
 
   // post the assertion to the server for verification.
   try {
-    await postAssertionToServer(transformedAssertionForServer, formData.get('csrf_token'));
+    await postAssertionToServer(
+      transformedAssertionForServer, formData.get('csrf_token'), isUsernameless ? embeddedChallengeHandle : null);
   } catch (err) {
     return console.error("Error when validating assertion on server:", err);
   }
@@ -91,7 +113,7 @@ const getCredentialRequestOptionsFromServer = async (formData) => {
 const transformCredentialRequestOptions = (credentialRequestOptionsFromServer) => {
   let {
     challenge,
-    allowCredentials
+    allowCredentials = []
   } = credentialRequestOptionsFromServer;
 
   challenge = Uint8Array.from(
@@ -148,20 +170,29 @@ const transformAssertionForServer = (assertion) => {
  * Post the assertion to the server for validation and logging the user in. 
  * @param {Object} assertionDataForServer 
  * @param {string} csrfToken the CSRF token for the request
+ * @param {?string} challengeHandle the page's embedded (signed) challenge, for
+ *   usernameless logins
  */
-const postAssertionToServer = async (assertionDataForServer, csrfToken) => {
+const postAssertionToServer = async (assertionDataForServer, csrfToken, challengeHandle) => {
+  const headers = {
+    "X-CSRFToken": csrfToken,
+    "Content-Type": "text/plain"
+  };
+  if (challengeHandle)
+    headers["X-Challenge-Handle"] = challengeHandle;
+
   return await fetch_json("/webauthn/login/verify-assertion", {
     method: "POST",
-    headers: {
-      "X-CSRFToken": csrfToken,
-      "Content-Type": "text/plain"
-    },
+    headers,
     body: JSON.stringify(assertionDataForServer)
   });
 }
 
 // Bind event listeners
 loginForm.addEventListener("submit", sendLoginForm);
+authMethodToggler.addEventListener("click", setEmailRequired);
+// The saved authentication preference was already applied when auth-method-toggler.js loaded
+emailInput.required = !isUsingBiometrics();
 document.addEventListener("webauthn-register-error", err => {
   alert("Registration error: " + err.detail.message); // TODO: Use a modal
 });
\ No newline at end of file
@@ -0,0 +1,121 @@
+''' Per-worker cache of user rows so authenticated requests don't re-query them '''
+from collections import OrderedDict
+import threading
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from . import app, db
+from .models import Credential, User
+
+
+class TTLCache:
+    '''Thread-safe LRU cache whose entries also expire `ttl` seconds after being stored'''
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+user_cache = TTLCache(app.config['USER_CACHE_MAX_ENTRIES'], app.config['USER_CACHE_TTL'])
+
+
+def _detached_copy(obj):
+    model = type(obj)
+    copy = model(**{attr.key: getattr(obj, attr.key) for attr in inspect(model).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def snapshot(user):
+    '''
+    Returns a detached copy of `user`'s column values (and credentials) that any session can
+    adopt without a query
+    '''
+    copy = _detached_copy(user)
+    credentials = [_detached_copy(credential) for credential in user.credentials]
+
+    # Link them as already-loaded state; assigning them normally would mark the copies as
+    # modified, which `merge(load=False)` refuses
+    set_committed_value(copy, 'credentials', credentials)
+    for credential in credentials:
+        set_committed_value(credential, 'user', copy)
+    return copy
+
+
+def load_cached_user(user_id):
+    '''Returns the user with the given id, from the cache when possible'''
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        # Attach the snapshot to this request's session without touching the database
+        return db.session.merge(cached, load=False)
+
+    user = User.query.get(user_id)
+    if user is not None:
+        user_cache.set(user_id, snapshot(user))
+    return user
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _invalidate_changed_users(session, flush_context, instances):
+    changed = {obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, User) and obj.id is not None}
+    changed.update(
+        obj.user_id for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, Credential) and obj.user_id is not None
+    )
+    for user_id in changed:
+        user_cache.invalidate(user_id)
+
+    # Invalidate again once committed, in case another thread re-cached the old row meanwhile
+    session.info.setdefault('changed_user_ids', set()).update(changed)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _forget_rolled_back_users(session):
+    session.info.pop('changed_user_ids', None)
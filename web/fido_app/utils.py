@@ -1,13 +1,55 @@
 import re
 from datetime import date
+import hashlib
 import uuid
+from .database_pool import InstrumentedQueuePool
 
 ''' Contains useful utility functions for our Flask app '''
-def get_database_uri_from(env):
+
+# Dollars earned for each day with a complete (password and FIDO2) login
+CREDIT_PER_DAY = 1.0
+
+# The number of set bits in each byte value, for counting login days with bytes.translate
+BYTE_POPCOUNTS = bytes(bin(value).count('1') for value in range(256))
+
+# Lowercase letters and digits, optionally split by single dots or underscores, then an
+# @ and a domain with exactly one dot. Every character can only be matched one way, so
+# this runs in linear time (nested quantifiers like `([a-z0-9]+[._]?)*` backtrack
+# exponentially on long near-misses)
+EMAIL_PATTERN = re.compile(r'[a-z0-9]+(?:[._][a-z0-9]+)*@\w+\.\w+')
+
+# The length of the user.email column
+MAX_EMAIL_LENGTH = 80
+
+# Default "<requests>/<seconds>" limits on POSTs to each login and registration endpoint,
+# per client IP address and per email address (see `get_rate_limits_from`)
+DEFAULT_RATE_LIMITS = {
+    'login': {'ip': '60/60', 'email': '10/60'},
+    'webauthn_login_start': {'ip': '60/60', 'email': '20/60'},
+    'webauthn_verify_login': {'ip': '60/60', 'email': '10/60'},
+    'register': {'ip': '20/60', 'email': '5/60'},
+    'webauthn_registration_start': {'ip': '20/60', 'email': '10/60'},
+    'verify_registration_credentials': {'ip': '20/60', 'email': '5/60'},
+}
+
+
+def get_database_uri_from(env, replica=False):
     '''
     Use values from the environment to determine a Database URI per the SQLAlchemy schema.
     See https://docs.sqlalchemy.org/en/14/core/engines.html#database-urls for specifics.
+
+    With `replica=True`, returns the URI of the read replica instead: DB_REPLICA_HOST (or
+    DB_REPLICA_NAME for SQLite) and optionally DB_REPLICA_USERNAME / DB_REPLICA_PASSWORD
+    override the primary's settings. Returns None if no replica is configured.
     '''
+    if replica:
+        if not (env.get('DB_REPLICA_HOST') or env.get('DB_REPLICA_NAME')):
+            return None
+        env = {
+            **env,
+            **{f'DB_{key}': env[f'DB_REPLICA_{key}'] for key in ('HOST', 'NAME', 'USERNAME', 'PASSWORD')
+               if env.get(f'DB_REPLICA_{key}')},
+        }
 
     # SQLite URLs use a local file on disk with no login info
     if env["DB_PROTOCOL"] == 'sqlite':
@@ -15,6 +57,67 @@ def get_database_uri_from(env):
     
     return f'{env["DB_PROTOCOL"]}://{env["DB_USERNAME"]}:{env["DB_PASSWORD"]}@{env["DB_HOST"]}/{env["DB_NAME"]}'
 
+def get_engine_options_from(env):
+    '''
+    Use values from the environment to build the `create_engine` options (connection pool
+    sizing, recycling, pre-ping and timeouts). SQLite opens a new connection per checkout
+    unless DB_POOL_SIZE is set explicitly.
+    '''
+    options = {
+        # Test each connection before handing it out, so connections the server dropped (e.g.
+        # after MariaDB's `wait_timeout`) are replaced instead of failing the request
+        'pool_pre_ping': env.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        # Retire connections before the server's idle timeout would
+        'pool_recycle': int(env.get('DB_POOL_RECYCLE') or 3600),
+    }
+
+    sqlite = env["DB_PROTOCOL"] == 'sqlite'
+    if sqlite and not env.get('DB_POOL_SIZE'):
+        return options
+
+    connect_timeout = int(env.get('DB_CONNECT_TIMEOUT') or 5)
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=int(env.get('DB_POOL_SIZE') or 10),
+        max_overflow=int(env.get('DB_MAX_OVERFLOW') or 10),
+        pool_timeout=float(env.get('DB_POOL_TIMEOUT') or 10),
+        connect_args=(
+            {'timeout': connect_timeout, 'check_same_thread': False} if sqlite
+            else {'connect_timeout': connect_timeout}
+        ),
+    )
+    return options
+
+def parse_rate_limit(value):
+    '''
+    Parses "<requests>/<seconds>" (e.g. "10/60") into a (requests, seconds) tuple; an empty
+    value or "0" means no limit and returns None
+    '''
+    if not value or value.strip() == '0':
+        return None
+
+    count, _, seconds = value.partition('/')
+    count, seconds = int(count), float(seconds or 1)
+    if count < 1 or seconds <= 0:
+        raise ValueError(f'Invalid rate limit {value!r} (expected "<requests>/<seconds>")')
+    return count, seconds
+
+
+def get_rate_limits_from(env):
+    '''
+    Use values from the environment to build the {endpoint: {'ip': limit, 'email': limit}}
+    rate limits: RATE_LIMIT_<ENDPOINT>_IP and RATE_LIMIT_<ENDPOINT>_EMAIL (e.g.
+    RATE_LIMIT_LOGIN_EMAIL=5/60) override the DEFAULT_RATE_LIMITS of one endpoint
+    '''
+    return {
+        endpoint: {
+            key: parse_rate_limit(env.get(f'RATE_LIMIT_{endpoint.upper()}_{key.upper()}', default))
+            for key, default in limits.items()
+        }
+        for endpoint, limits in DEFAULT_RATE_LIMITS.items()
+    }
+
+
 def validate_email(email):
     '''
     Returns True if email is a properly formatted email address;
@@ -22,7 +125,8 @@ def validate_email(email):
     '''
     return (
         isinstance(email, str)
-        and re.search(r'^([a-z0-9]+[\._]?)*[a-z0-9]+@\w+\.\w+$', email) is not None
+        and len(email) <= MAX_EMAIL_LENGTH
+        and EMAIL_PATTERN.fullmatch(email) is not None
     )
 
 
@@ -39,25 +143,69 @@ def get_elapsed_days(startDate, endDate=date.today()):
     return (endDate - startDate).days
 
 
-def append_to_login_bitfield(bitfield, days_since_last_login):
+def get_login_days_tracked(login_bitmap):
+    '''
+    Returns the number of days a `login_bitmap` covers: from the day after registration
+    through the last complete login (the position of its highest set bit, plus one)
+    '''
+    for index in range(len(login_bitmap) - 1, -1, -1):
+        if login_bitmap[index]:
+            return index * 8 + login_bitmap[index].bit_length()
+    return 0
+
+
+def append_to_login_bitmap(login_bitmap, days_since_last_login):
     '''
-    Insert (`days_since_last_login` - 1) deactivated bits to the front (most significant) end
-    of the existing `bitfield` integer. Insert one activated bit to the very front.
-    Returns the updated `bitfield` integer.
+    Records a complete login `days_since_last_login` days after the last one: skips
+    (`days_since_last_login` - 1) days and sets the bit of the day after them.
+    Returns the updated bitmap bytes.
     '''
     if days_since_last_login <= 0:
-        return bitfield
-    
-    return bitfield + (1 << (bitfield.bit_length() + days_since_last_login - 1))
+        return login_bitmap
+
+    day = get_login_days_tracked(login_bitmap) + days_since_last_login - 1
+    index, bit = divmod(day, 8)
+    if index < len(login_bitmap):
+        return login_bitmap[:index] + bytes([login_bitmap[index] | 1 << bit])
+    return login_bitmap + bytes(index - len(login_bitmap)) + bytes([1 << bit])
 
 
-def get_credit(login_bitfield):
+def count_login_days(login_bitmap, start=0, stop=None):
+    '''
+    Returns the number of days with a complete login among days `start` (inclusive) to
+    `stop` (exclusive) of a `login_bitmap`, counting from 0 for the day after registration
+    (there are no days before it, so a negative `start` counts from day 0). Only the bytes
+    covering the range are read.
+    '''
+    start = max(start, 0)
+    if not start and stop is None:
+        return sum(login_bitmap.translate(BYTE_POPCOUNTS))
+
+    stop = len(login_bitmap) * 8 if stop is None else min(stop, len(login_bitmap) * 8)
+    if start >= stop:
+        return 0
+
+    # Mask off the days outside the range in the first and last bytes
+    first, last = start // 8, (stop - 1) // 8
+    head = login_bitmap[first] >> (start % 8)
+    if first == last:
+        return BYTE_POPCOUNTS[head & ((1 << (stop - start)) - 1)]
+    tail = login_bitmap[last] & ((1 << (stop - last * 8)) - 1)
+    return BYTE_POPCOUNTS[head] + sum(login_bitmap[first + 1:last].translate(BYTE_POPCOUNTS)) + BYTE_POPCOUNTS[tail]
+
+
+def is_login_day(login_bitmap, day):
+    '''Returns True if the user completed a login on `day` (0 is the day after registration)'''
+    return 0 <= day and day // 8 < len(login_bitmap) and bool(login_bitmap[day // 8] >> (day % 8) & 1)
+
+
+def get_credit(login_bitmap):
     '''
     Returns a string representing the amount of monetary credit earned from the given
-    series of user logins. Effectively just counts the number of 1s in the integer
+    series of user logins. Effectively just counts the number of 1s in the bitmap
     and multiplies it by the amount we credit per day.
     '''
-    return 1.0 * bin(login_bitfield).count('1')
+    return CREDIT_PER_DAY * count_login_days(login_bitmap or b'')
 
 def get_or_create(db_session, model, **kwargs):
     '''
@@ -75,3 +223,7 @@ def get_or_create(db_session, model, **kwargs):
 def get_random_session_token():
     '''Create a random session token string'''
     return str(uuid.uuid4())
+
+def hash_credential_id(credential_id):
+    '''Returns the 32-byte SHA-256 digest used to index a raw WebAuthn credential id'''
+    return hashlib.sha256(credential_id).digest()
@@ -5,10 +5,15 @@ from datetime import date
 from webauthn import (
     generate_registration_options, 
     verify_registration_response,
-    generate_authentication_options, 
-    verify_authentication_response,)
+    generate_authentication_options,)
 from webauthn.helpers import base64url_to_bytes, bytes_to_base64url, options_to_json
-from webauthn.helpers.structs import AuthenticationCredential, PublicKeyCredentialDescriptor, RegistrationCredential
+from webauthn.helpers.structs import (
+    AuthenticationCredential,
+    AuthenticatorSelectionCriteria,
+    PublicKeyCredentialDescriptor,
+    RegistrationCredential,
+    ResidentKeyRequirement,
+)
 from webauthn.helpers.exceptions import InvalidAuthenticationResponse, InvalidRegistrationResponse
 from flask import (
     request,
@@ -19,16 +24,39 @@ from flask import (
     make_response,
     flash,
 )
-from .models import User, LoginAttempts
+from .models import Credential, User, LoginAttempts
+from .challenges import challenge_store, consume_signed, issue_signed
+from .public_keys import verify_assertion
+from .metrics import timed
 from flask_login import current_user, login_user
 from . import app, db
-from .utils import get_display_name, validate_email, get_elapsed_days, append_to_login_bitfield
+from .utils import get_display_name, validate_email, get_elapsed_days, append_to_login_bitmap
 
 
 RP_ID = os.getenv('RP_ID')
 RP_NAME = os.getenv('RP_NAME')
 ORIGIN = os.getenv('ORIGIN')
 
+# Header the login page sends its embedded (signed) challenge back in
+CHALLENGE_HANDLE_HEADER = 'X-Challenge-Handle'
+
+
+def discoverable_login_options():
+    '''
+    Authentication options with an empty allow list, for the login page to embed: the
+    authenticator offers whichever of its discoverable credentials are for this site, so a
+    login needs no email and no round trip to look up the user's credentials first. Returns
+    the options JSON and the signed challenge (signed rather than stored, so rendering the
+    login page writes nothing).
+    '''
+    authentication_options = generate_authentication_options(rp_id=RP_ID)
+    handle = issue_signed({
+        'challenge': bytes_to_base64url(authentication_options.challenge),
+        'email': None,
+    })
+    return options_to_json(authentication_options), handle
+
+
 @app.route('/webauthn/registration/start', methods=['POST'])
 def webauthn_registration_start():
     """Starts the webauthn registration process by sending the user a random challenge"""
@@ -53,7 +81,16 @@ def webauthn_registration_start():
             flash('Email address is already in use', 'error')
             return make_response(jsonify({'redirect': url_for('register')}), 401)
 
-    ukey = secrets.token_urlsafe(20)
+    # Users adding another authenticator keep their existing user handle
+    if current_user.is_authenticated and current_user.ukey:
+        ukey = current_user.ukey
+        exclude_credentials = [
+            PublicKeyCredentialDescriptor(id=credential.credential_id)
+            for credential in current_user.credentials
+        ]
+    else:
+        ukey = secrets.token_urlsafe(20)
+        exclude_credentials = []
     display_name = get_display_name(email)
     
     registration_options = generate_registration_options(
@@ -61,14 +98,21 @@ def webauthn_registration_start():
         rp_id=RP_ID,
         user_id=ukey,
         user_name=email,
-        user_display_name=display_name
+        user_display_name=display_name,
+        exclude_credentials=exclude_credentials,
+        # Ask for a discoverable credential so the user can log in without typing their email
+        authenticator_selection=AuthenticatorSelectionCriteria(resident_key=ResidentKeyRequirement.PREFERRED),
     )
 
+    # Only the challenge's handle goes in the session (the email is there for the rate limits)
     session['registration'] = {
+        'handle': challenge_store.issue({
+            'email': email,
+            'challenge': bytes_to_base64url(registration_options.challenge),
+            'ukey': ukey,
+            'display_name': display_name,
+        }),
         'email': email,
-        'challenge': bytes_to_base64url(registration_options.challenge),
-        'ukey': ukey,
-        'display_name': display_name,
     }
 
     return options_to_json(registration_options)
@@ -77,7 +121,13 @@ def webauthn_registration_start():
 @app.route('/webauthn/registration/verify-credentials', methods=['POST'])
 def verify_registration_credentials():
     '''Verify the credential attestation generated during the registration process'''
-    register_info = session['registration']
+    # Consume the challenge before doing anything (prevents replays)
+    registration = session.pop('registration', None)
+    register_info = registration and challenge_store.consume(registration.get('handle'))
+    if not register_info:
+        flash('Registration timed out. Please try again.', 'error')
+        return make_response(jsonify({'redirect': url_for('register')}), 401)
+
     challenge = register_info['challenge']
     ukey = register_info['ukey']
     email = register_info['email']
@@ -88,17 +138,15 @@ def verify_registration_credentials():
     # using `text-plain` allows us to call the built-in `RegistrationCredential.parse_raw` method.
     credential = RegistrationCredential.parse_raw(request.data)
 
-    # Clear registration session info before doing anything (prevents replays)
-    session.pop('registration', None)
-
     try:
-       verified_registration = verify_registration_response(
-            credential=credential,
-            expected_challenge=base64url_to_bytes(challenge),
-            expected_rp_id=RP_ID,
-            expected_origin=ORIGIN,
-            require_user_verification=True
-        )
+        with timed('verify_registration_response'):
+            verified_registration = verify_registration_response(
+                credential=credential,
+                expected_challenge=base64url_to_bytes(challenge),
+                expected_rp_id=RP_ID,
+                expected_origin=ORIGIN,
+                require_user_verification=True
+            )
     except InvalidRegistrationResponse as e:
         flash(f'Registration failed. Error: {e}', 'error')
         return make_response(jsonify({'redirect': url_for('register')}), 401)
@@ -110,20 +158,23 @@ def verify_registration_credentials():
     # to a different user, the Relying Party SHOULD fail this registration
     # ceremony, or it MAY decide to accept the registration, e.g. while deleting
     # the older registration.
-    credential_id = bytes_to_base64url(verified_registration.credential_id)
-    if User.query.filter_by(credential_id=credential_id).first():
+    if Credential.find(verified_registration.credential_id):
         flash('Credential ID already exists.', 'error')
         return make_response(jsonify({'redirect': url_for('register')}), 401)
 
-    # If this is an existing user, update the db entry for that user
+    new_credential = Credential(
+        credential_id=verified_registration.credential_id,
+        public_key=verified_registration.credential_public_key,
+        sign_count=verified_registration.sign_count,
+        authenticator_id=verified_registration.aaguid,
+        attestation_format=verified_registration.fmt,
+        user_verified=verified_registration.user_verified,
+    )
+
+    # If this is an existing user, add the authenticator to their account
     if current_user.is_authenticated:
         current_user.ukey = ukey
-        current_user.public_key = bytes_to_base64url(verified_registration.credential_public_key)
-        current_user.credential_id = credential_id
-        current_user.sign_count = verified_registration.sign_count
-        current_user.authenticator_id = verified_registration.aaguid
-        current_user.attestation_format = verified_registration.fmt
-        current_user.user_verified = verified_registration.user_verified
+        current_user.credentials.append(new_credential)
 
         db.session.commit()
 
@@ -141,20 +192,13 @@ def verify_registration_credentials():
             ukey=ukey,
             display_name=display_name,
             last_complete_login=date.today(),
-            login_bitfield=0,
-            public_key=bytes_to_base64url(verified_registration.credential_public_key),
-            credential_id=credential_id,
-            sign_count=verified_registration.sign_count,
-            authenticator_id=verified_registration.aaguid,
-            attestation_format=verified_registration.fmt,
-            user_verified=verified_registration.user_verified
+            login_bitmap=b'',
+            credentials=[new_credential],
         )
         db.session.add(user)
+        user.add_session(session)
         db.session.commit()
 
-        # TODO: look into a single commit (not sure if possible)
-        user.add_session(session, commit=True)
-
     if current_user.is_authenticated:
         flash(f'Successfully registered biometric')
     else:
@@ -175,11 +219,13 @@ def webauthn_login_start():
 
     # Attempt to find user in database
     user = User.query.filter_by(email=email).first()
-    if user and user.credential_id:
-        credential_id_bytes = base64url_to_bytes(user.credential_id)
+    if user and user.has_credential():
         authentication_options = generate_authentication_options(
             rp_id=RP_ID,
-            allow_credentials=[PublicKeyCredentialDescriptor(id=credential_id_bytes)],
+            allow_credentials=[
+                PublicKeyCredentialDescriptor(id=credential.credential_id)
+                for credential in user.credentials
+            ],
         )
     else:
         # Prepare nonsense options so we can still proceed to verification step
@@ -190,8 +236,11 @@ def webauthn_login_start():
         )
 
     session['login'] = {
-        'challenge': bytes_to_base64url(authentication_options.challenge),
-        'email': email
+        'handle': challenge_store.issue({
+            'challenge': bytes_to_base64url(authentication_options.challenge),
+            'email': email,
+        }),
+        'email': email,
     }
 
     return options_to_json(authentication_options)
@@ -200,82 +249,94 @@ def webauthn_login_start():
 @app.route('/webauthn/login/verify-assertion', methods=['POST'])
 def webauthn_verify_login():
     '''Verify the user's credential attesttion during the login process'''
-    challenge = session['login']['challenge']
-    email = session['login']['email']
+    # Consume the challenge whatever the outcome, so each one can only be answered once. It's
+    # the one embedded in the login page (usernameless logins) or the one `webauthn_login_start`
+    # issued for the email the user entered
+    login = session.pop('login', None)
+    signed_challenge = request.headers.get(CHALLENGE_HANDLE_HEADER)
+    if signed_challenge:
+        login_info = consume_signed(signed_challenge)
+    else:
+        login_info = login and challenge_store.consume(login['handle'])
+    if not login_info:
+        flash('Login timed out. Please try again.', 'error')
+        return make_response(jsonify({'redirect': url_for('login')}), 401)
+
+    challenge = login_info['challenge']
 
     # The form data is sent back as JSON-encoded text with a MIME type of 'text/plain' (stored
     # in `request.data`). Even though `application/json` would be a more accurate MIME type,
     # using `text-plain` allows us to call the built-in `RegistrationCredential.parse_raw` method.
     credential = AuthenticationCredential.parse_raw(request.data)
 
-    # Attempt to find a matching user and obtain fields necessary for authentication
-    user = User.query.filter_by(credential_id=credential.id).first()
-    if user:
-        pub_key = user.public_key
-        sign_count = user.sign_count
+    # Attempt to find a matching credential and obtain fields necessary for authentication. The
+    # credential id alone identifies the user; a user handle, if the authenticator returned
+    # one (discoverable credentials always do), must belong to the same user
+    stored_credential = Credential.find(credential.raw_id)
+    user_handle = credential.response.user_handle
+    if stored_credential and (
+        not user_handle or user_handle == (stored_credential.user.ukey or '').encode()
+    ):
+        user = stored_credential.user
+        pub_key = stored_credential.public_key
+        sign_count = stored_credential.sign_count
     else:
         # Prepare invalid values for authentication to obfuscate point of failure
-        pub_key = ''
+        user = None
+        pub_key = b''
         sign_count = 0
 
-    # Get existing login attempt db entry or create new one
-    attempts = LoginAttempts.query.filter_by(email=email, date=date.today()).first()
-    if not attempts:
-        attempts = LoginAttempts(
-            email=email,
-            date=date.today(),
-            password_successes=0,
-            password_failures=0,
-            fido_successes=0,
-            fido_failures=0
-        )
+    # Usernameless logins count their attempts against the email of the credential's owner
+    email = login_info['email'] or (stored_credential.user.email if stored_credential else None)
 
     try:
-        authenitication_verification = verify_authentication_response(
-            credential=credential,
-            expected_challenge=base64url_to_bytes(challenge),
-            expected_rp_id=RP_ID,
-            expected_origin=ORIGIN,
-            credential_public_key=base64url_to_bytes(pub_key),
-            credential_current_sign_count=sign_count,
-            require_user_verification=True
-        )
+        # There's no key to check the signature with (verifying against the empty one would crash)
+        if not user:
+            raise InvalidAuthenticationResponse('Unknown credential')
+
+        with timed('verify_authentication_response'):
+            authenitication_verification = verify_assertion(
+                credential=credential,
+                credential_id=credential.raw_id,
+                expected_challenge=base64url_to_bytes(challenge),
+                expected_rp_id=RP_ID,
+                expected_origin=ORIGIN,
+                credential_public_key=pub_key,
+                credential_current_sign_count=sign_count,
+                require_user_verification=True
+            )
     except InvalidAuthenticationResponse as e:
-        # Update failed login count
-        attempts.fido_failures += 1
-        db.session.add(attempts)
-        db.session.commit()
+        # Update failed login count (unless nobody could be identified)
+        if email:
+            LoginAttempts.increment(email, 'fido_failures')
+            db.session.commit()
         
         flash(f'Authentication failed. Error: {e}', 'error')
         return make_response(jsonify({'redirect': url_for('login')}), 401)
 
     if user:
         # Update counter.
-        user.sign_count = authenitication_verification.new_sign_count
+        stored_credential.sign_count = authenitication_verification.new_sign_count
     
         # Update login trackers
         if user.last_complete_login != date.today():
             if 'logged_in_today' in session and session['logged_in_today'] == 'password':
                 del session['logged_in_today']
-                user.login_bitfield = append_to_login_bitfield(
-                    user.login_bitfield,
+                user.login_bitmap = append_to_login_bitmap(
+                    user.login_bitmap,
                     get_elapsed_days(user.last_complete_login)
                 )
                 user.last_complete_login = date.today()
             else:
                 session['logged_in_today'] = 'fido2'
     
-        db.session.add(user)
-        db.session.commit()
-        user.add_session(session, commit=True)
+        user.add_session(session)
 
         # Update successful login count
-        attempts.fido_successes += 1
-        db.session.add(attempts)
-        db.session.commit()
+        LoginAttempts.increment(email, 'fido_successes')
 
-        # Clear login session info
-        session.pop('login', None)
+        # Save the user, session, and login count in one transaction
+        db.session.commit()
 
         login_user(user)
         return jsonify({'redirect': url_for('profile')})
@@ -1,2 +1,72 @@
+'''
+Gunicorn production settings. Every setting can be overridden with the environment variable
+named in its `os.getenv` call (see docker-compose.yml).
+'''
+import glob
+import multiprocessing
+import os
+import tempfile
+
+
+def env(name, default, cast=str):
+    '''Reads a setting from the environment, treating empty values as unset'''
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
 wsgi_app = 'wsgi:app'
-bind = '0.0.0.0:8080'
\ No newline at end of file
+bind = env('GUNICORN_BIND', '0.0.0.0:8080')
+
+# Worker model: 'sync' (one request per process), 'gthread' (a thread pool per process) or
+# 'gevent' (green threads; note that mysqlclient blocks the event loop, so gevent only helps
+# with a pure-Python driver such as PyMySQL). Every worker also runs PASSWORD_HASH_WORKERS
+# password hashing processes (see fido_app/config.py), so the total is workers times that
+worker_class = env('GUNICORN_WORKER_CLASS', 'gthread')
+workers = env('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1, int)
+threads = env('GUNICORN_THREADS', 4, int)
+worker_connections = env('GUNICORN_WORKER_CONNECTIONS', 100, int)
+
+# Recycle workers periodically (staggered by the jitter) to contain any slow leaks
+max_requests = env('GUNICORN_MAX_REQUESTS', 2000, int)
+max_requests_jitter = env('GUNICORN_MAX_REQUESTS_JITTER', 200, int)
+
+timeout = env('GUNICORN_TIMEOUT', 30, int)
+graceful_timeout = env('GUNICORN_GRACEFUL_TIMEOUT', 30, int)
+
+# Caddy reuses upstream connections and closes idle ones after 60s (see Caddyfile), so keep
+# them open a little longer here so Caddy, not gunicorn, is always the side that closes them
+keepalive = env('GUNICORN_KEEPALIVE', 75, int)
+
+# Workers share their Prometheus metrics through files in this directory (see fido_app/metrics.py)
+os.environ['METRICS_DIR'] = env('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'fido-metrics'))
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = env('GUNICORN_PRELOAD_APP', True, lambda value: value.lower() == 'true')
+
+
+def on_starting(server):
+    '''Start the metrics from zero rather than adding to the previous server's counts'''
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], 'metrics-*.json')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    '''Database connections must not be shared with the master, so start each worker with a fresh pool'''
+    from fido_app import app, db
+    from fido_app.database_pool import pool_stats
+    from fido_app.metrics import metrics
+    with app.app_context():
+        for bind in [None, *app.config['SQLALCHEMY_BINDS']]:
+            db.get_engine(app, bind).dispose()
+    pool_stats.reset()
+    metrics.reset()
+
+
+def worker_exit(server, worker):
+    '''Write out any buffered interactions and metrics and stop helper processes before the worker goes away'''
+    from fido_app.interactions import interaction_queue
+    from fido_app.metrics import metrics
+    from fido_app.passwords import password_hasher
+    interaction_queue.close()
+    password_hasher.shutdown()
+    metrics.flush()
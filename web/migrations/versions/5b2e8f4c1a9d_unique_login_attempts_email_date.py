@@ -0,0 +1,57 @@
+"""Unique (email, date) constraint on login attempts
+
+Revision ID: 5b2e8f4c1a9d
+Revises: 27c4f322ed1c
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8f4c1a9d'
+down_revision = '27c4f322ed1c'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ('password_successes', 'password_failures', 'fido_successes', 'fido_failures')
+
+
+def merge_duplicate_attempts():
+    '''
+    Concurrent logins could previously create several rows for the same (email, date);
+    fold their counts into the oldest row so the unique constraint can be added.
+    '''
+    connection = op.get_bind()
+    attempts = sa.table('login_attempts', sa.column('id'), sa.column('email'), sa.column('date'),
+                        *[sa.column(counter) for counter in COUNTERS])
+
+    duplicates = connection.execute(
+        sa.select(attempts.c.email, attempts.c.date)
+        .group_by(attempts.c.email, attempts.c.date)
+        .having(sa.func.count() > 1)
+    ).fetchall()
+
+    for email, day in duplicates:
+        rows = connection.execute(
+            sa.select(attempts)
+            .where(attempts.c.email == email, attempts.c.date == day)
+            .order_by(attempts.c.id)
+        ).fetchall()
+
+        totals = {counter: sum(row._mapping[counter] or 0 for row in rows) for counter in COUNTERS}
+        connection.execute(attempts.update().where(attempts.c.id == rows[0].id).values(**totals))
+        connection.execute(attempts.delete().where(attempts.c.id.in_([row.id for row in rows[1:]])))
+
+
+def upgrade():
+    merge_duplicate_attempts()
+
+    with op.batch_alter_table('login_attempts', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_login_attempts_email_date', ['email', 'date'])
+
+
+def downgrade():
+    with op.batch_alter_table('login_attempts', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_login_attempts_email_date', type_='unique')
@@ -0,0 +1,70 @@
+"""Store login days as a variable-length bitmap
+
+Revision ID: b6e2c9d4f815
+Revises: d3f8a1c6e947
+Create Date: 2026-10-18 18:12:37.204519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2c9d4f815'
+down_revision = 'd3f8a1c6e947'
+branch_labels = None
+depends_on = None
+
+# Users are converted in batches so the whole table is never held in memory
+BATCH_SIZE = 500
+
+user = sa.table(
+    'user',
+    sa.column('id', sa.Integer),
+    sa.column('login_bitfield', sa.BigInteger),
+    sa.column('login_bitmap', sa.LargeBinary),
+)
+
+
+def int_to_bitmap(value):
+    # An integer that overflowed into the sign bit still holds the low 64 days
+    value = (value or 0) % 2**64
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+def bitmap_to_int(value):
+    # The integer column only has room for the first 31 days
+    return int.from_bytes(value or b'', 'little') % 2**31
+
+
+def convert(connection, source, target, function):
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(user.c.id, user.c[source]).where(user.c.id > last_id).order_by(user.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            connection.execute(user.update().where(user.c.id == row.id).values({target: function(row[1])}))
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('login_bitmap', sa.LargeBinary(), nullable=True))
+
+    convert(op.get_bind(), 'login_bitfield', 'login_bitmap', int_to_bitmap)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('login_bitfield')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('login_bitfield', sa.Integer(), nullable=True))
+
+    convert(op.get_bind(), 'login_bitmap', 'login_bitfield', bitmap_to_int)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('login_bitmap')
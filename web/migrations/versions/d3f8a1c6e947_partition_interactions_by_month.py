@@ -0,0 +1,73 @@
+"""Partition the interaction table by month
+
+Revision ID: d3f8a1c6e947
+Revises: a9c3e5f17b20
+Create Date: 2026-10-18 17:25:09.730412
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8a1c6e947'
+down_revision = 'a9c3e5f17b20'
+branch_labels = None
+depends_on = None
+
+# Later months are added by `flask interaction-partitions ensure`
+MONTHS_AHEAD = 3
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_months(connection):
+    '''First days of every month from the oldest interaction's through MONTHS_AHEAD from now'''
+    today = date.today()
+    oldest = connection.execute(sa.text('SELECT min(timestamp) FROM interaction')).scalar()
+    month = (min(oldest.date(), today) if oldest else today).replace(day=1)
+    months = []
+    while month <= add_months(today, MONTHS_AHEAD):
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def is_mariadb(connection):
+    # Only MariaDB (and MySQL) partition natively; other databases (e.g. SQLite development
+    # databases) keep a plain interaction table
+    return connection.dialect.name in ('mysql', 'mariadb')
+
+
+def upgrade():
+    # One partition per month (`p202203` holds rows before 2022-04-01) plus a catch-all `pmax`.
+    # This rebuilds the table (and drops its foreign key, which partitioned tables can't have),
+    # so expect it to take a while on a large table
+    connection = op.get_bind()
+    if not is_mariadb(connection):
+        return
+
+    for foreign_key in sa.inspect(connection).get_foreign_keys('interaction'):
+        op.execute(f'ALTER TABLE interaction DROP FOREIGN KEY {foreign_key["name"]}')
+
+    # Every unique key of a partitioned table must include the partitioning column
+    op.execute('ALTER TABLE interaction DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)')
+    definitions = [
+        f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{add_months(month, 1)}')"
+        for month in partition_months(connection)
+    ]
+    definitions.append('PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+    op.execute(f'ALTER TABLE interaction PARTITION BY RANGE COLUMNS(timestamp) ({", ".join(definitions)})')
+
+
+def downgrade():
+    if not is_mariadb(op.get_bind()):
+        return
+
+    op.execute('ALTER TABLE interaction REMOVE PARTITIONING')
+    op.execute('ALTER TABLE interaction DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
+    op.execute('ALTER TABLE interaction ADD FOREIGN KEY (session_token) REFERENCES session (token)')
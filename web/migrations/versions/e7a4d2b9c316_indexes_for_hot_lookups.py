@@ -0,0 +1,38 @@
+"""Indexes for hot lookup columns
+
+Revision ID: e7a4d2b9c316
+Revises: 5b2e8f4c1a9d
+Create Date: 2026-10-18 11:02:17.844120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4d2b9c316'
+down_revision = '5b2e8f4c1a9d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # login_attempts (email, date) is covered by uq_login_attempts_email_date, and
+    # session.token / user.credential_id / user.email by their primary key and unique indexes
+    with op.batch_alter_table('interaction', schema=None) as batch_op:
+        batch_op.create_index('ix_interaction_session_token_group_id', ['session_token', 'group_id'], unique=False)
+
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_session_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('session', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_session_user_id'))
+
+    with op.batch_alter_table('interaction', schema=None) as batch_op:
+        # MariaDB silently dropped the implicit foreign key index on session_token when the
+        # composite index took over, so the foreign key needs a replacement before it goes
+        if op.get_bind().dialect.name in ('mysql', 'mariadb'):
+            batch_op.create_index('ix_interaction_session_token', ['session_token'], unique=False)
+        batch_op.drop_index('ix_interaction_session_token_group_id')
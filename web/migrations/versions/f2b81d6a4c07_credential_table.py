@@ -0,0 +1,145 @@
+"""Move WebAuthn credentials into their own table
+
+Revision ID: f2b81d6a4c07
+Revises: c41f9a7e2d58
+Create Date: 2026-10-18 13:41:06.392551
+
+"""
+import base64
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b81d6a4c07'
+down_revision = 'c41f9a7e2d58'
+branch_labels = None
+depends_on = None
+
+# Users are copied over in batches so the whole table is never held in memory
+BATCH_SIZE = 500
+
+ATTESTATION_FORMAT = sa.Enum('packed', 'tpm', 'android-key', 'android-safetynet', 'fido-u2f', 'apple', 'none', name='attestationformat')
+
+user = sa.table(
+    'user',
+    sa.column('id', sa.Integer),
+    sa.column('credential_id', sa.String),
+    sa.column('public_key', sa.String),
+    sa.column('sign_count', sa.Integer),
+    sa.column('authenticator_id', sa.String),
+    sa.column('user_verified', sa.Boolean),
+    sa.column('attestation_format', sa.String),
+)
+
+credential = sa.table(
+    'credential',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('credential_id', sa.LargeBinary),
+    sa.column('public_key', sa.LargeBinary),
+    sa.column('credential_id_hash', sa.LargeBinary),
+    sa.column('sign_count', sa.Integer),
+    sa.column('authenticator_id', sa.String),
+    sa.column('user_verified', sa.Boolean),
+    sa.column('attestation_format', sa.String),
+)
+
+METADATA_COLUMNS = ('sign_count', 'authenticator_id', 'user_verified', 'attestation_format')
+
+
+def base64url_to_bytes(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def bytes_to_base64url(value):
+    return base64.urlsafe_b64encode(value).decode().rstrip('=')
+
+
+def batches(connection, table, *where):
+    '''Yields lists of rows from `table`, ordered by id, BATCH_SIZE at a time'''
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(table).where(table.c.id > last_id, *where).order_by(table.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def upgrade():
+    op.create_table('credential',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('credential_id', sa.LargeBinary(), nullable=False),
+    sa.Column('public_key', sa.LargeBinary(), nullable=False),
+    sa.Column('credential_id_hash', sa.BINARY(length=32), nullable=False),
+    sa.Column('sign_count', sa.Integer(), nullable=True),
+    sa.Column('authenticator_id', sa.String(length=40), nullable=True),
+    sa.Column('user_verified', sa.Boolean(), nullable=True),
+    sa.Column('attestation_format', ATTESTATION_FORMAT, nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('credential_id_hash')
+    )
+    with op.batch_alter_table('credential', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_credential_user_id'), ['user_id'], unique=False)
+
+    # Copy each user's inline credential over as raw bytes
+    connection = op.get_bind()
+    for rows in batches(connection, user, user.c.credential_id.isnot(None)):
+        credentials = []
+        for row in rows:
+            credential_id = base64url_to_bytes(row.credential_id)
+            credentials.append({
+                'user_id': row.id,
+                'credential_id': credential_id,
+                'public_key': base64url_to_bytes(row.public_key),
+                'credential_id_hash': hashlib.sha256(credential_id).digest(),
+                **{column: row._mapping[column] for column in METADATA_COLUMNS},
+            })
+        connection.execute(credential.insert(), credentials)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('attestation_format')
+        batch_op.drop_column('user_verified')
+        batch_op.drop_column('authenticator_id')
+        batch_op.drop_column('sign_count')
+        batch_op.drop_column('public_key')
+        batch_op.drop_column('credential_id')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('credential_id', sa.String(length=400), nullable=True))
+        batch_op.add_column(sa.Column('public_key', sa.String(length=400), nullable=True))
+        batch_op.add_column(sa.Column('sign_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('authenticator_id', sa.String(length=40), nullable=True))
+        batch_op.add_column(sa.Column('user_verified', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('attestation_format', ATTESTATION_FORMAT, nullable=True))
+        batch_op.create_unique_constraint('uq_user_credential_id', ['credential_id'])
+        batch_op.create_unique_constraint('uq_user_public_key', ['public_key'])
+
+    # Users only had room for one authenticator, so keep the first one each registered
+    connection = op.get_bind()
+    copied = set()
+    for rows in batches(connection, credential):
+        for row in rows:
+            if row.user_id in copied:
+                continue
+            copied.add(row.user_id)
+            connection.execute(
+                user.update().where(user.c.id == row.user_id).values(
+                    credential_id=bytes_to_base64url(row.credential_id),
+                    public_key=bytes_to_base64url(row.public_key),
+                    **{column: row._mapping[column] for column in METADATA_COLUMNS},
+                )
+            )
+
+    with op.batch_alter_table('credential', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_credential_user_id'))
+
+    op.drop_table('credential')
@@ -0,0 +1,25 @@
+import pytest
+from fido_app import app, db
+from fido_app.user_cache import user_cache
+
+
+@pytest.fixture
+def client(tmp_path):
+    '''Test client backed by a fresh SQLite database with every table created'''
+    app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "test.db"}',
+        # Tests that exercise the rate limits turn them on (see test_rate_limits.py)
+        RATE_LIMIT_ENABLED=False,
+        RATE_LIMIT_STORE=str(tmp_path / 'rate-limits.db'),
+        # Hash inline; test_passwords.py covers the process pool
+        PASSWORD_HASH_WORKERS=0,
+    )
+
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+        user_cache.clear()
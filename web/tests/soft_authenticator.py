@@ -0,0 +1,129 @@
+'''
+A software WebAuthn authenticator that produces real attestations ("none" format) and
+ES256 / RS256 signed assertions, for driving the WebAuthn endpoints without a browser.
+'''
+import hashlib
+import json
+import os
+import struct
+import cbor2
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from webauthn.helpers import base64url_to_bytes, bytes_to_base64url
+
+# Authenticator data flags
+USER_PRESENT = 0x01
+USER_VERIFIED = 0x04
+ATTESTED_CREDENTIAL_DATA = 0x40
+
+ALGORITHMS = ('ES256', 'RS256')
+
+
+def _int_to_bytes(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, 'big')
+
+
+class SoftAuthenticator:
+    '''Holds one credential key pair and signs ceremonies for `rp_id` / `origin`'''
+
+    def __init__(self, rp_id, origin, algorithm='ES256'):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f'Unsupported algorithm: {algorithm}')
+
+        self.rp_id = rp_id
+        self.origin = origin
+        self.algorithm = algorithm
+        self.credential_id = os.urandom(32)
+        self.sign_count = 0
+        # The user handle the credential was registered with (kept like a discoverable credential)
+        self.user_handle = None
+
+        if algorithm == 'ES256':
+            self.private_key = ec.generate_private_key(ec.SECP256R1())
+        else:
+            self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    @property
+    def cose_public_key(self):
+        '''The credential public key, COSE-encoded as it is stored by the relying party'''
+        numbers = self.private_key.public_key().public_numbers()
+        if self.algorithm == 'ES256':
+            return cbor2.dumps({
+                1: 2, 3: -7, -1: 1,
+                -2: numbers.x.to_bytes(32, 'big'),
+                -3: numbers.y.to_bytes(32, 'big'),
+            })
+        return cbor2.dumps({1: 3, 3: -257, -1: _int_to_bytes(numbers.n), -2: _int_to_bytes(numbers.e)})
+
+    def _client_data(self, ceremony, challenge):
+        return json.dumps({
+            'type': ceremony,
+            'challenge': bytes_to_base64url(challenge),
+            'origin': self.origin,
+            'crossOrigin': False,
+        }).encode()
+
+    def _authenticator_data(self, flags, extra=b''):
+        rp_id_hash = hashlib.sha256(self.rp_id.encode()).digest()
+        return rp_id_hash + bytes([flags]) + struct.pack('>I', self.sign_count) + extra
+
+    def _sign(self, data):
+        if self.algorithm == 'ES256':
+            return self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+        return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    def create(self, options):
+        '''
+        Answers `navigator.credentials.create()` for the JSON registration `options`, returning
+        the JSON body the browser would POST back
+        '''
+        challenge = base64url_to_bytes(options['challenge'])
+        self.user_handle = base64url_to_bytes(options['user']['id'])
+        attested_credential = (
+            bytes(16)  # AAGUID
+            + struct.pack('>H', len(self.credential_id))
+            + self.credential_id
+            + self.cose_public_key
+        )
+        auth_data = self._authenticator_data(USER_PRESENT | USER_VERIFIED | ATTESTED_CREDENTIAL_DATA, attested_credential)
+        attestation_object = cbor2.dumps({'fmt': 'none', 'attStmt': {}, 'authData': auth_data})
+
+        return json.dumps({
+            'id': bytes_to_base64url(self.credential_id),
+            'rawId': bytes_to_base64url(self.credential_id),
+            'response': {
+                'clientDataJSON': bytes_to_base64url(self._client_data('webauthn.create', challenge)),
+                'attestationObject': bytes_to_base64url(attestation_object),
+            },
+            'type': 'public-key',
+        })
+
+    def get(self, options, user_handle=None):
+        '''
+        Answers `navigator.credentials.get()` for the JSON authentication `options`, returning
+        the JSON body the browser would POST back. With an empty allow list the credential is
+        discovered, so the response carries its user handle
+        '''
+        challenge = base64url_to_bytes(options['challenge'])
+        if user_handle is None and not options.get('allowCredentials'):
+            user_handle = self.user_handle
+        self.sign_count += 1
+
+        client_data = self._client_data('webauthn.get', challenge)
+        auth_data = self._authenticator_data(USER_PRESENT | USER_VERIFIED)
+        signature = self._sign(auth_data + hashlib.sha256(client_data).digest())
+
+        response = {
+            'clientDataJSON': bytes_to_base64url(client_data),
+            'authenticatorData': bytes_to_base64url(auth_data),
+            'signature': bytes_to_base64url(signature),
+        }
+        if user_handle is not None:
+            response['userHandle'] = bytes_to_base64url(user_handle)
+
+        return json.dumps({
+            'id': bytes_to_base64url(self.credential_id),
+            'rawId': bytes_to_base64url(self.credential_id),
+            'response': response,
+            'type': 'public-key',
+        })
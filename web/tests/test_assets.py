@@ -0,0 +1,69 @@
+import gzip
+import json
+import re
+import shutil
+import brotli
+import pytest
+from fido_app import app
+from fido_app.assets import BUNDLES, build_assets, manifest
+
+
+@pytest.fixture
+def built(client, tmp_path):
+    '''A build (without the third-party libraries) of a copy of the static files'''
+    static_folder = tmp_path / 'static'
+    shutil.copytree(app.static_folder, static_folder, ignore=shutil.ignore_patterns('dist'))
+    result = build_assets(str(static_folder), vendor=False)
+    manifest.load(str(static_folder / 'dist' / 'manifest.json'))
+    yield static_folder, result
+    manifest.load()
+
+
+def test_files_are_fingerprinted_and_precompressed(built):
+    static_folder, result = built
+    dist = static_folder / 'dist'
+
+    assert re.fullmatch(r'dist/images/favicon\.[0-9a-f]{12}\.png', result['files']['images/favicon.png'])
+    login_bundle = result['bundles']['login.js'][0]
+    content = (static_folder / login_bundle).read_bytes()
+    sources = sum((static_folder / path).stat().st_size for path in BUNDLES['login.js'])
+    assert len(content) < sources
+    assert gzip.decompress((static_folder / f'{login_bundle}.gz').read_bytes()) == content
+    assert brotli.decompress((static_folder / f'{login_bundle}.br').read_bytes()) == content
+    # Binary files aren't worth compressing
+    assert not list(dist.glob('images/*.png.gz'))
+    assert json.loads((dist / 'manifest.json').read_text()) == result
+
+
+def test_rebuilding_unchanged_files_keeps_their_names(built):
+    static_folder, result = built
+    assert build_assets(str(static_folder), vendor=False) == result
+
+    (static_folder / 'styles' / 'main.css').write_text('body { color: red; }')
+    rebuilt = build_assets(str(static_folder), vendor=False)
+    assert rebuilt['bundles']['base.css'] != result['bundles']['base.css']
+    assert rebuilt['bundles']['login.js'] == result['bundles']['login.js']
+
+
+def test_pages_load_the_built_files(built, client):
+    page = client.get('/login').get_data(as_text=True)
+    urls = re.findall(r'(?:src|href)="([^"]+\.(?:js|css|png|svg))"', page)
+
+    _, result = built
+    assert f'/static/{result["bundles"]["login.js"][0]}' in urls
+    assert f'/static/{result["files"]["images/team-logo.svg"]}' in urls
+    assert '/static/scripts/login.js' not in urls
+    # Libraries left out of the build still come from their CDN, with their integrity hash
+    assert 'https://code.jquery.com/jquery-3.4.1.slim.min.js' in urls
+    assert 'integrity="sha384-J6qa4849blE2+poT4WnyKhv5vZF5SrPo0iEjwBvKU7imGFAV0wwj1yYfoRSJoZ+n"' in page
+
+
+def test_pages_load_the_sources_without_a_build(client, tmp_path):
+    manifest.load(str(tmp_path / 'manifest.json'))
+    try:
+        page = client.get('/login').get_data(as_text=True)
+    finally:
+        manifest.load()
+
+    for path in BUNDLES['login.js']:
+        assert f'src="/static/{path}"' in page
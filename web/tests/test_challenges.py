@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import time
+from unittest import mock
+from itsdangerous import TimestampSigner
+from fido_app import app, db
+from fido_app.challenges import DatabaseChallengeStore, MemoryChallengeStore, consume_signed, issue_signed
+from fido_app.models import WebAuthnChallenge
+
+DATA = {'challenge': 'abc', 'email': 'participant@example.com'}
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_challenges_are_single_use():
+    store = MemoryChallengeStore(ttl=60)
+    handle = store.issue(DATA)
+
+    assert store.consume(handle) == DATA
+    assert store.consume(handle) is None
+    assert store.consume('unknown') is None
+
+
+def test_memory_challenges_expire_on_the_wheel():
+    clock = Clock()
+    store = MemoryChallengeStore(ttl=60, clock=clock)
+    old = [store.issue(DATA) for _ in range(3)]
+
+    clock.now += 30
+    new = store.issue(DATA)
+    clock.now += 59.5
+    assert store.consume(old[0]) is None
+    # Issuing drops the expired challenges without anyone consuming them
+    store.issue(DATA)
+    assert len(store) == 2
+    assert store.consume(new) == DATA
+
+    # The wheel also copes with a clock that jumped past every slot
+    clock.now += 3600
+    store.issue(DATA)
+    assert len(store) == 1
+
+
+def test_database_challenges_are_single_use(client):
+    store = DatabaseChallengeStore(ttl=60)
+    handle = store.issue(DATA)
+
+    assert store.consume(handle) == DATA
+    assert store.consume(handle) is None
+    assert WebAuthnChallenge.query.count() == 0
+
+
+def test_expired_database_challenges_are_rejected_and_pruned(client):
+    store = DatabaseChallengeStore(ttl=60)
+    expired = store.issue(DATA)
+    live = store.issue(DATA)
+    with db.engine.begin() as connection:
+        connection.execute(WebAuthnChallenge.__table__.update().where(WebAuthnChallenge.handle == expired)
+                           .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+
+    store.prune()
+    assert [challenge.handle for challenge in WebAuthnChallenge.query] == [live]
+    assert store.consume(expired) is None
+
+
+def test_concurrent_consumers_get_a_challenge_once(client):
+    store = DatabaseChallengeStore(ttl=60)
+    handle = store.issue(DATA)
+
+    def consume(_):
+        with app.app_context():
+            return store.consume(handle)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(consume, range(16)))
+
+    assert results.count(DATA) == 1
+    assert results.count(None) == 15
+
+
+def test_signed_challenges_are_single_use(client):
+    token = issue_signed(DATA)
+    assert WebAuthnChallenge.query.count() == 0
+
+    assert consume_signed(token) == DATA
+    assert consume_signed(token) is None
+    assert consume_signed(token[:-2] + 'xx') is None
+
+
+def test_signed_challenges_expire(client):
+    # Signed longer ago than CHALLENGE_TTL_SECONDS
+    with mock.patch.object(TimestampSigner, 'get_timestamp', return_value=int(time.time()) - 301):
+        token = issue_signed(DATA)
+
+    assert consume_signed(token) is None
+
+
+def test_memory_store_spends_handles_once():
+    store = MemoryChallengeStore(ttl=60)
+    assert store.spend('handle')
+    assert not store.spend('handle')
@@ -0,0 +1,48 @@
+import csv
+from datetime import date
+from fido_app import app, db
+from fido_app.compensation import bitmap_stats, unpack_bitmaps
+from fido_app.models import User
+from fido_app.utils import get_credit
+
+
+def bitmap(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+def test_bitmap_stats_match_the_per_user_definitions():
+    values = [0, 0b10110, 0b1110111, 2**62 + 2**61, 2**300 - 1, 2**400 + 2**399 + 1]
+    stats = bitmap_stats(unpack_bitmaps([bitmap(value) for value in values] + [None]))
+
+    assert stats.active_days.tolist() == [get_credit(bitmap(value)) for value in values] + [0]
+    assert stats.tracked_days.tolist() == [value.bit_length() for value in values] + [0]
+    assert stats.longest_streak.tolist() == [0, 2, 3, 2, 300, 2, 0]
+    assert stats.latest_streak.tolist() == [0, 1, 3, 2, 300, 2, 0]
+
+
+def test_compensation_report(client, tmp_path):
+    db.session.add_all([
+        User(email='steady@example.com', login_bitmap=bitmap(0b111), last_complete_login=date(2022, 3, 10)),
+        User(email='lapsed@example.com', login_bitmap=bitmap(0b1101), last_complete_login=date(2022, 3, 1)),
+        User(email='new@example.com', login_bitmap=b'', last_complete_login=date(2022, 3, 10)),
+        User(email=None, login_bitmap=b'', last_complete_login=None),
+    ])
+    db.session.commit()
+    output = tmp_path / 'compensation.csv'
+
+    result = app.test_cli_runner().invoke(args=[
+        'compensation-report', '-o', str(output), '--as-of', '2022-03-11', '--chunk-size', '2'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Wrote 3 participants ($6.00 total credit)' in result.output
+    assert '    3 days: 2' in result.output
+    with open(output, newline='') as f:
+        rows = {row['email']: row for row in csv.DictReader(f)}
+
+    assert set(rows) == {'steady@example.com', 'lapsed@example.com', 'new@example.com'}
+    assert rows['steady@example.com']['credit'] == '3.00'
+    assert rows['steady@example.com']['current_streak'] == '3'
+    # A streak that ended more than a day before the report date no longer counts as current
+    assert rows['lapsed@example.com']['longest_streak'] == '2'
+    assert rows['lapsed@example.com']['current_streak'] == '0'
+    assert rows['new@example.com']['active_days'] == '0'
@@ -0,0 +1,43 @@
+import json
+import os
+from webauthn.helpers import bytes_to_base64url
+from fido_app import db
+from fido_app.models import Credential, User
+
+EMAIL = 'participant@example.com'
+
+
+def make_user(credential_count):
+    user = User(email=EMAIL, credentials=[
+        Credential(credential_id=os.urandom(32), public_key=os.urandom(77))
+        for _ in range(credential_count)
+    ])
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_find_by_raw_id(client):
+    user = make_user(2)
+    wanted = user.credentials[1]
+
+    assert Credential.find(wanted.credential_id) is wanted
+    assert Credential.find(os.urandom(32)) is None
+
+
+def test_login_start_allows_every_credential(client):
+    user = make_user(3)
+
+    response = client.post('/webauthn/login/start', data={'email': EMAIL})
+
+    allowed = {c['id'] for c in json.loads(response.data)['allowCredentials']}
+    assert allowed == {bytes_to_base64url(c.credential_id) for c in user.credentials}
+
+
+def test_deleting_identifiable_info_removes_credentials(client):
+    user = make_user(2)
+
+    user.delete_identifiable_info()
+    db.session.commit()
+
+    assert Credential.query.count() == 0
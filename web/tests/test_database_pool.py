@@ -0,0 +1,101 @@
+'''
+Soak test for the connection pool: repeatedly closes the pool's idle connections underneath
+the app (as MariaDB does after `wait_timeout` or a restart) while requests keep coming, and
+checks pre-ping replaces them without any request failing. Uses a pooled SQLite database as
+a stand-in for MariaDB.
+'''
+import pytest
+from sqlalchemy import event
+from fido_app import app, db
+from fido_app.database_pool import InstrumentedQueuePool, pool_metrics, pool_stats
+from fido_app.utils import get_engine_options_from
+
+EMAIL = 'participant@example.com'
+PASSWORD = 'correct horse battery'
+INTERACTIONS = [
+    {'element': 'email', 'event': 'focus', 'login_method': 'did not attempt', 'page': '/login', 'timestampMs': 1647000000000}
+]
+
+
+@pytest.fixture
+def pool_env():
+    return {'DB_PROTOCOL': 'sqlite', 'DB_POOL_SIZE': '2', 'DB_MAX_OVERFLOW': '1'}
+
+
+@pytest.fixture
+def engine_options(pool_env):
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options_from(pool_env)
+    pool_stats.reset()
+    yield
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+@pytest.fixture
+def pooled_client(engine_options, client):
+    '''Test client whose engine pools connections, plus a function that kills the idle ones'''
+    idle = set()
+    event.listen(db.engine, 'checkin', lambda dbapi_connection, record: idle.add(dbapi_connection))
+    event.listen(db.engine, 'checkout', lambda dbapi_connection, record, proxy: idle.discard(dbapi_connection))
+
+    def kill_idle_connections():
+        for dbapi_connection in list(idle):
+            dbapi_connection.close()
+        idle.clear()
+
+    yield client, kill_idle_connections
+    db.engine.dispose()
+
+
+def test_engine_options_from_env():
+    options = get_engine_options_from({
+        'DB_PROTOCOL': 'mariadb', 'DB_POOL_SIZE': '20', 'DB_POOL_RECYCLE': '600', 'DB_POOL_PRE_PING': 'false',
+    })
+
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['pool_size'] == 20
+    assert options['max_overflow'] == 10
+    assert options['pool_recycle'] == 600
+    assert options['pool_pre_ping'] is False
+    assert options['connect_args'] == {'connect_timeout': 5}
+
+    # SQLite only pools connections when asked to
+    assert 'poolclass' not in get_engine_options_from({'DB_PROTOCOL': 'sqlite'})
+
+
+def test_requests_survive_killed_connections(pooled_client):
+    client, kill_idle_connections = pooled_client
+    client.post('/register', data={'email': EMAIL, 'password': PASSWORD, 'confirm-password': PASSWORD})
+    client.post('/logout')
+
+    for _ in range(20):
+        kill_idle_connections()
+        responses = [
+            client.get('/login'),
+            client.post('/interactions/submit', json=INTERACTIONS),
+            client.post('/login', data={'email': EMAIL, 'password': PASSWORD}),
+        ]
+        kill_idle_connections()
+        responses += [client.get('/profile'), client.post('/logout')]
+
+        assert [response.status_code for response in responses] == [200, 200, 302, 200, 302]
+
+    db.session.remove()
+    metrics = pool_metrics(db.engine)
+    assert metrics['pool'] == 'InstrumentedQueuePool'
+    assert metrics['invalidations'] >= 40
+    assert metrics['checkouts'] > metrics['invalidations']
+    assert metrics['checked_out'] == 0
+    assert metrics['checkout_timeouts'] == 0
+
+
+@pytest.mark.parametrize('pool_env', [{'DB_PROTOCOL': 'sqlite', 'DB_POOL_SIZE': '2', 'DB_POOL_PRE_PING': 'false'}])
+def test_killed_connections_fail_without_pre_ping(pooled_client):
+    client, kill_idle_connections = pooled_client
+    # The second request opens a pooled connection to look up the session the first one started
+    client.get('/login')
+    client.get('/login')
+    kill_idle_connections()
+
+    with pytest.raises(Exception, match='closed database'):
+        client.get('/login')
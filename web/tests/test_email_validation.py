@@ -0,0 +1,53 @@
+import random
+import re
+import time
+import pytest
+from fido_app.utils import EMAIL_PATTERN, MAX_EMAIL_LENGTH, validate_email
+
+# The pattern `validate_email` used before, which backtracks exponentially
+OLD_PATTERN = r'^([a-z0-9]+[\._]?)*[a-z0-9]+@\w+\.\w+$'
+
+ADVERSARIAL = [
+    'a' * 10000 + '!',
+    'a.' * 5000 + '!',
+    'a_' * 4999 + 'a@',
+    'a' * 5000 + '@' + 'b' * 5000,
+    'a@' + 'b' * 10000 + '.',
+    '0' * 9999 + '@b.c!',
+]
+
+
+@pytest.mark.parametrize('email', [
+    'participant@example.com', 'first.last@example.com', 'first_last1@example.co', 'a@b.c', '1@b_2.c_3', 'a@ü.de',
+])
+def test_accepts(email):
+    assert validate_email(email)
+
+
+@pytest.mark.parametrize('email', [
+    '', 'participant', '@example.com', 'first..last@example.com', '.first@example.com', 'first.@example.com',
+    'First@example.com', 'a@mail.example.com', 'a@example', 'a+b@example.com', 'a@example.com\n', None, 42,
+    'a' * (MAX_EMAIL_LENGTH - len('@example.com') + 1) + '@example.com',
+])
+def test_rejects(email):
+    assert not validate_email(email)
+
+
+def test_matches_the_old_pattern():
+    '''Fuzzes short strings (where the old pattern is still fast) built from the characters that matter'''
+    rng = random.Random(0)
+    alphabet = 'ab0._@.A-é_'
+    for _ in range(20000):
+        email = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 14)))
+        assert validate_email(email) == (re.search(OLD_PATTERN, email) is not None), email
+
+
+@pytest.mark.parametrize('email', ADVERSARIAL)
+def test_adversarial_inputs_take_linear_time(email):
+    # Past the length cap these are rejected without running the pattern at all...
+    assert not validate_email(email)
+
+    # ...and even uncapped, the pattern finishes in linear time
+    start = time.perf_counter()
+    assert EMAIL_PATTERN.fullmatch(email) is None
+    assert time.perf_counter() - start < 0.05
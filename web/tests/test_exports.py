@@ -0,0 +1,137 @@
+import csv
+from datetime import datetime, date
+import gzip
+import json
+import pytest
+from fido_app import app, db
+from fido_app.models import Interaction, LoginAttempts, Session
+
+
+def add_interactions(count, **overrides):
+    rows = [{
+        'session_token': 'token',
+        'element': 'email',
+        'event': 'focus',
+        'login_method': 'password',
+        'page': '/login',
+        'timestamp': datetime(2022, 3, 1 + i % 3, 12),
+        'group_id': 'group',
+        **overrides,
+    } for i in range(count)]
+    db.session.execute(Interaction.__table__.insert(), rows)
+    db.session.commit()
+
+
+@pytest.fixture
+def runner(client):
+    db.session.add(Session(token='token', data='{"secret": true}'))
+    db.session.commit()
+    return app.test_cli_runner()
+
+
+def read_csv(path):
+    with gzip.open(path, 'rt', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_export_interactions_csv_in_chunks(runner, tmp_path):
+    add_interactions(25)
+    output = tmp_path / 'interaction.csv.gz'
+
+    result = runner.invoke(args=['export', 'interaction', '-o', str(output), '--chunk-size', '10'])
+
+    assert result.exit_code == 0, result.output
+    rows = read_csv(output)
+    assert len(rows) == 25
+    assert [int(row['id']) for row in rows] == sorted(int(row['id']) for row in rows)
+    assert rows[0]['page'] == '/login'
+    assert 'Exported 25 rows' in result.output
+
+
+def test_export_filters(runner, tmp_path):
+    add_interactions(9)
+    add_interactions(4, page='/register', login_method='fido')
+    output = tmp_path / 'interaction.csv.gz'
+
+    runner.invoke(args=['export', 'interaction', '-o', str(output), '--page', '/register'])
+    assert len(read_csv(output)) == 4
+
+    runner.invoke(args=['export', 'interaction', '-o', str(output), '--login-method', 'password',
+                        '--since', '2022-03-02', '--until', '2022-03-02'])
+    rows = read_csv(output)
+    assert len(rows) == 3
+    assert {row['timestamp'][:10] for row in rows} == {'2022-03-02'}
+
+    result = runner.invoke(args=['export', 'session', '-o', str(output), '--page', '/login'])
+    assert result.exit_code != 0
+
+
+def test_incremental_export(runner, tmp_path):
+    state = tmp_path / 'state.json'
+    output = tmp_path / 'interaction.csv.gz'
+    args = ['export', 'interaction', '-o', str(output), '--state-file', str(state)]
+
+    add_interactions(5)
+    runner.invoke(args=args)
+    assert len(read_csv(output)) == 5
+
+    add_interactions(3)
+    runner.invoke(args=args)
+    assert len(read_csv(output)) == 3
+    assert json.loads(state.read_text()) == {'interaction_id': Interaction.query.count(), 'missing_ids': []}
+
+    runner.invoke(args=args)
+    assert read_csv(output) == []
+
+
+def test_incremental_export_picks_up_rows_committed_late(runner, tmp_path):
+    state = tmp_path / 'state.json'
+    output = tmp_path / 'interaction.csv.gz'
+    args = ['export', 'interaction', '-o', str(output), '--state-file', str(state)]
+
+    add_interactions(3)
+    runner.invoke(args=args)
+    # Id 5 commits before id 4 (e.g. from another worker's write-behind batch)
+    add_interactions(1, id=5)
+    runner.invoke(args=args)
+    assert [row['id'] for row in read_csv(output)] == ['5']
+    assert [id for id, _ in json.loads(state.read_text())['missing_ids']] == [4]
+
+    add_interactions(1, id=4)
+    add_interactions(1, id=6)
+    runner.invoke(args=args)
+    assert [row['id'] for row in read_csv(output)] == ['4', '6']
+    assert json.loads(state.read_text()) == {'interaction_id': 6, 'missing_ids': []}
+
+    # Ids that never show up (e.g. rolled back) are given up on after --late-row-seconds
+    add_interactions(1, id=8)
+    runner.invoke(args=args)
+    runner.invoke(args=args + ['--late-row-seconds', '0'])
+    assert read_csv(output) == []
+    assert json.loads(state.read_text()) == {'interaction_id': 8, 'missing_ids': []}
+
+
+def test_export_sessions_leaves_out_session_data(runner, tmp_path):
+    output = tmp_path / 'session.csv.gz'
+    runner.invoke(args=['export', 'session', '-o', str(output)])
+
+    assert read_csv(output) == [{'token': 'token', 'user_id': ''}]
+
+
+def test_export_parquet(runner, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    add_interactions(25)
+    LoginAttempts.increment('participant@example.com', 'password_failures', day=date(2022, 3, 1))
+    db.session.commit()
+
+    runner.invoke(args=['export', 'interaction', '--format', 'parquet', '-o', str(tmp_path / 'i.parquet'), '--chunk-size', '10'])
+    runner.invoke(args=['export', 'login_attempts', '--format', 'parquet', '-o', str(tmp_path / 'l.parquet')])
+
+    interactions = pq.read_table(tmp_path / 'i.parquet')
+    assert interactions.num_rows == 25
+    assert pq.ParquetFile(tmp_path / 'i.parquet').num_row_groups == 3
+    assert interactions.column('timestamp')[0].as_py() == datetime(2022, 3, 1, 12)
+
+    attempts = pq.read_table(tmp_path / 'l.parquet').to_pylist()
+    assert attempts[0]['date'] == date(2022, 3, 1)
+    assert attempts[0]['password_failures'] == 1
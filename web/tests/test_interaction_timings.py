@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+import json
+from fido_app import app, db
+from fido_app.interactions import interaction_queue
+from fido_app.interaction_timings import backfill_interaction_timings, median_load_to_submit_ms, summarize_interactions
+from fido_app.models import Interaction, InteractionTiming, Session
+
+START = datetime(2022, 3, 1, 12)
+
+
+def visit(group_id, submit_after_ms=5000, login_method='fido', session_token='token'):
+    '''Interaction rows for a login page visit: load, focus email, focus password, submit'''
+    events = [
+        (0, 'document', 'load', 'did not attempt'),
+        (1000, 'email', 'focus', 'did not attempt'),
+        (3000, 'password', 'focus', 'did not attempt'),
+        (submit_after_ms, 'login-form', 'submit', login_method),
+    ]
+    return [{
+        'session_token': session_token,
+        'group_id': group_id,
+        'element': element,
+        'event': event,
+        'login_method': method,
+        'page': '/login',
+        'timestamp': START + timedelta(milliseconds=offset),
+    } for offset, element, event, method in events]
+
+
+def test_summarize_interactions():
+    rows = visit('a')
+    [timing] = summarize_interactions(list(reversed(rows)))
+
+    assert timing['group_id'] == 'a'
+    assert timing['login_method'] == 'fido'
+    assert timing['load_to_submit_ms'] == 5000
+    assert timing['event_count'] == 4
+    assert timing['started_at'] == START
+    assert json.loads(timing['element_dwell_ms']) == {'email': 2000, 'password': 2000}
+
+
+def test_unsubmitted_visit_has_no_duration():
+    [timing] = summarize_interactions(visit('a')[:3])
+
+    assert timing['login_method'] == 'did not attempt'
+    assert timing['load_to_submit_ms'] is None
+
+
+def test_submit_writes_rollup(client):
+    logs = [
+        {'element': 'document', 'event': 'load', 'login_method': 'did not attempt', 'page': '/login', 'timestampMs': 1647000000000},
+        {'element': 'email', 'event': 'focus', 'login_method': 'did not attempt', 'page': '/login', 'timestampMs': 1647000000500},
+        {'element': 'login-form', 'event': 'submit', 'login_method': 'password', 'page': '/login', 'timestampMs': 1647000004000},
+    ]
+    client.post('/interactions/submit', json=logs)
+
+    timing = InteractionTiming.query.one()
+    assert timing.group_id == Interaction.query.first().group_id
+    assert timing.login_method == 'password'
+    assert timing.load_to_submit_ms == 4000
+    assert json.loads(timing.element_dwell_ms) == {'email': 3500}
+
+
+def test_write_behind_writes_rollup(client):
+    app.config['INTERACTION_WRITE_BEHIND'] = True
+    try:
+        client.post('/interactions/submit', json=[
+            {'element': 'document', 'event': 'load', 'login_method': 'did not attempt', 'page': '/login', 'timestampMs': 1647000000000},
+        ])
+        interaction_queue.flush()
+    finally:
+        app.config['INTERACTION_WRITE_BEHIND'] = False
+
+    assert InteractionTiming.query.count() == 1
+
+
+def test_backfill(client):
+    db.session.add_all([Session(token='token'), Session(token='other')])
+    rows = visit('a') + visit('b', session_token='other') + visit('c')
+    # Interactions logged before group ids existed can't be split into visits
+    rows += [{**row, 'group_id': ''} for row in visit('')]
+    db.session.execute(Interaction.__table__.insert(), rows)
+    db.session.commit()
+
+    assert backfill_interaction_timings(batch_size=2) == 3
+    assert {timing.group_id for timing in InteractionTiming.query} == {'a', 'b', 'c'}
+    assert backfill_interaction_timings() == 0
+
+
+def test_median_load_to_submit(client):
+    db.session.add(Session(token='token'))
+    rows = []
+    for i, (duration, method) in enumerate([(1000, 'fido'), (3000, 'fido'), (2000, 'fido'), (1000, 'password'), (4000, 'password')]):
+        rows += visit(str(i), submit_after_ms=duration, login_method=method)
+    db.session.execute(Interaction.__table__.insert(), rows)
+    db.session.commit()
+    backfill_interaction_timings()
+
+    assert median_load_to_submit_ms('/login', 'fido') == 2000
+    assert median_load_to_submit_ms('/login', 'password') == 2500
+    assert median_load_to_submit_ms('/register', 'fido') is None
@@ -0,0 +1,99 @@
+import time
+import pytest
+from fido_app import app, db
+from fido_app.models import Interaction, Session
+from fido_app.interactions import interaction_queue
+
+
+def make_log(**overrides):
+    log = {
+        'element': 'email',
+        'event': 'focus',
+        'login_method': 'did not attempt',
+        'page': '/login',
+        'timestampMs': 1647000000000,
+    }
+    log.update(overrides)
+    return log
+
+
+def test_submit_interactions_inserts_batch(client):
+    response = client.post('/interactions/submit', json=[make_log() for _ in range(25)])
+
+    assert response.status_code == 200
+    assert Interaction.query.count() == 25
+    assert Session.query.count() == 1
+    assert len({i.group_id for i in Interaction.query}) == 1
+
+
+def test_submit_interactions_rejects_whole_batch(client):
+    logs = [make_log(), make_log(), make_log(event='hover')]
+    response = client.post('/interactions/submit', json=logs)
+
+    assert response.status_code == 400
+    assert 'invalid event' in response.json['error']
+    assert Interaction.query.count() == 0
+
+
+def test_submit_interactions_rejects_missing_key(client):
+    log = make_log()
+    del log['page']
+    response = client.post('/interactions/submit', json=[log])
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'An interaction is missing a required key: page'
+
+
+def test_submit_interactions_rejects_bad_timestamp(client):
+    response = client.post('/interactions/submit', json=[make_log(timestampMs='soon')])
+
+    assert response.status_code == 400
+    assert Interaction.query.count() == 0
+
+
+@pytest.fixture
+def write_behind(client):
+    app.config.update(
+        INTERACTION_WRITE_BEHIND=True,
+        INTERACTION_QUEUE_MAX_ROWS=50,
+        INTERACTION_QUEUE_FLUSH_ROWS=20,
+        INTERACTION_QUEUE_FLUSH_SECONDS=60,
+    )
+    yield client
+    interaction_queue.close()
+    app.config['INTERACTION_WRITE_BEHIND'] = False
+
+
+def test_write_behind_accepts_and_flushes(write_behind):
+    response = write_behind.post('/interactions/submit', json=[make_log() for _ in range(5)])
+
+    assert response.status_code == 202
+    assert len(interaction_queue) == 5
+
+    interaction_queue.flush()
+
+    assert len(interaction_queue) == 0
+    assert Interaction.query.count() == 5
+    assert Session.query.count() == 1
+
+
+def test_write_behind_flushes_on_size_threshold(write_behind):
+    write_behind.post('/interactions/submit', json=[make_log() for _ in range(25)])
+
+    deadline = time.time() + 5
+    while Interaction.query.count() < 25 and time.time() < deadline:
+        db.session.remove()
+        time.sleep(0.05)
+
+    assert Interaction.query.count() == 25
+
+
+def test_write_behind_backpressure(write_behind):
+    app.config['INTERACTION_QUEUE_FLUSH_ROWS'] = 100
+    assert write_behind.post('/interactions/submit', json=[make_log() for _ in range(45)]).status_code == 202
+
+    response = write_behind.post('/interactions/submit', json=[make_log() for _ in range(10)])
+
+    assert response.status_code == 503
+    assert interaction_queue.metrics()['rejected_batches'] == 1
+    assert len(interaction_queue) == 45
@@ -0,0 +1,62 @@
+import pytest
+from fido_app import app
+from fido_app.instrumentation import track_database_calls
+from fido_app.models import LoginAttempts, Session, User
+from fido_app.sessions import SecureCookieSessionInterfaceWithToken
+
+EMAIL = 'participant@example.com'
+PASSWORD = 'correct horse battery'
+
+
+def register(client):
+    return client.post('/register', data={
+        'email': EMAIL,
+        'password': PASSWORD,
+        'confirm-password': PASSWORD,
+    })
+
+
+def test_register_commits_once(client):
+    with track_database_calls() as stats:
+        response = register(client)
+
+    assert response.status_code == 302
+    assert stats.commits == 1
+
+    user = User.query.filter_by(email=EMAIL).one()
+    assert Session.query.filter_by(user_id=user.id).count() == 1
+
+
+@pytest.fixture
+def cookie_sessions(client):
+    '''Keeps sessions in the cookie, so only the route's own queries are counted (see test_sessions.py)'''
+    interface = app.session_interface
+    app.session_interface = SecureCookieSessionInterfaceWithToken()
+    yield client
+    app.session_interface = interface
+
+
+def test_password_login_commits_once(cookie_sessions):
+    client = cookie_sessions
+    register(client)
+    client.post('/logout')
+
+    with track_database_calls() as stats:
+        response = client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+
+    assert response.headers['Location'].endswith('/profile')
+    assert stats.commits == 1
+    assert stats.queries <= 4
+    assert LoginAttempts.query.filter_by(email=EMAIL).one().password_successes == 1
+
+
+def test_failed_password_login_commits_once(cookie_sessions):
+    client = cookie_sessions
+    register(client)
+    client.post('/logout')
+
+    with track_database_calls() as stats:
+        client.post('/login', data={'email': EMAIL, 'password': 'not my password'})
+
+    assert stats.commits == 1
+    assert stats.queries <= 2
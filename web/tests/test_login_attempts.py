@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from fido_app import app, db
+from fido_app.models import LoginAttempts
+
+PARALLEL_FAILURES = 20
+
+
+def test_increment_creates_then_updates(client):
+    LoginAttempts.increment('user@example.com', 'password_failures')
+    LoginAttempts.increment('user@example.com', 'password_failures')
+    LoginAttempts.increment('user@example.com', 'fido_successes')
+    db.session.commit()
+
+    attempts = LoginAttempts.query.filter_by(email='user@example.com', date=date.today()).one()
+    assert attempts.password_failures == 2
+    assert attempts.fido_successes == 1
+    assert attempts.password_successes == 0
+
+
+def test_failed_password_login_is_counted(client):
+    client.post('/login', data={'email': 'nobody@example.com', 'password': 'wrong password'})
+    client.post('/login', data={'email': 'nobody@example.com', 'password': 'wrong password'})
+
+    assert LoginAttempts.query.filter_by(email='nobody@example.com').one().password_failures == 2
+
+
+def test_parallel_failures_are_not_lost(client):
+    def fail_once(_):
+        with app.app_context():
+            LoginAttempts.increment('busy@example.com', 'fido_failures')
+            db.session.commit()
+            db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(fail_once, range(PARALLEL_FAILURES)))
+
+    db.session.remove()
+    attempts = LoginAttempts.query.filter_by(email='busy@example.com').all()
+    assert len(attempts) == 1
+    assert attempts[0].fido_failures == PARALLEL_FAILURES
@@ -0,0 +1,77 @@
+from pathlib import Path
+import pytest
+import sqlalchemy
+from flask_migrate import downgrade, upgrade
+from fido_app import app, db
+from fido_app.utils import (
+    append_to_login_bitmap, count_login_days, get_credit, get_login_days_tracked, is_login_day,
+)
+
+MIGRATIONS = str(Path(__file__).resolve().parent.parent / 'migrations')
+
+
+def test_append_matches_the_integer_bitfield():
+    # Registering on the 1st and logging in on the 3rd, 4th and 6th
+    first_week = b''
+    for days_since_last_login in (2, 1, 2):
+        first_week = append_to_login_bitmap(first_week, days_since_last_login)
+    assert first_week == b'\x16'
+
+    bitmap, bitfield = b'', 0
+    for days_since_last_login in (2, 1, 2, 0, 30, 1, 400):
+        bitmap = append_to_login_bitmap(bitmap, days_since_last_login)
+        if days_since_last_login > 0:
+            bitfield += 1 << (bitfield.bit_length() + days_since_last_login - 1)
+        assert bitmap == bitfield.to_bytes((bitfield.bit_length() + 7) // 8, 'little')
+
+    assert get_login_days_tracked(bitmap) == bitfield.bit_length() == 436
+    assert get_credit(bitmap) == 6.0
+
+
+def test_range_queries():
+    bitmap = b''
+    for days_since_last_login in (1, 1, 1, 5, 10, 1):
+        bitmap = append_to_login_bitmap(bitmap, days_since_last_login)
+    # Active on days 0, 1, 2, 7, 17 and 18
+
+    assert count_login_days(bitmap) == 6
+    assert count_login_days(bitmap, 1, 8) == 3
+    assert count_login_days(bitmap, 1, 19) == 5
+    assert count_login_days(bitmap, 3, 7) == 0
+    assert count_login_days(bitmap, 17) == 2
+    assert count_login_days(bitmap, 18, 1000) == 1
+    assert count_login_days(bitmap, 50) == 0
+    assert count_login_days(bitmap, -3) == 6
+    assert count_login_days(bitmap, -3, 2) == 2
+    assert count_login_days(bitmap, -10, -2) == 0
+    assert not is_login_day(bitmap, -1)
+    assert not is_login_day(bitmap, -8)
+    assert [day for day in range(25) if is_login_day(bitmap, day)] == [0, 1, 2, 7, 17, 18]
+    assert count_login_days(b'') == get_login_days_tracked(b'') == 0
+
+
+@pytest.fixture
+def migrations_db(tmp_path):
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "bitmap.db"}'
+    with app.app_context():
+        yield
+        db.session.remove()
+        db.drop_all()
+
+
+def test_migration_converts_integer_bitfields(migrations_db):
+    upgrade(directory=MIGRATIONS, revision='d3f8a1c6e947')
+    with db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text(
+            "INSERT INTO user (id, email, login_bitfield) VALUES (1, 'a', 22), (2, 'b', 0), (3, 'c', NULL), (4, 'd', -1)"))
+
+    upgrade(directory=MIGRATIONS, revision='b6e2c9d4f815')
+    with db.engine.connect() as connection:
+        bitmaps = dict(connection.execute(sqlalchemy.text('SELECT id, login_bitmap FROM user')).all())
+    assert bitmaps == {1: b'\x16', 2: b'', 3: b'', 4: b'\xff' * 8}
+
+    downgrade(directory=MIGRATIONS, revision='d3f8a1c6e947')
+    with db.engine.connect() as connection:
+        bitfields = dict(connection.execute(sqlalchemy.text('SELECT id, login_bitfield FROM user')).all())
+    assert bitfields == {1: 22, 2: 0, 3: 0, 4: 2**31 - 1}
+    upgrade(directory=MIGRATIONS)
@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from fido_app import app
+from fido_app.metrics import metrics, operation_duration
+
+
+@pytest.fixture
+def metrics_client(client):
+    metrics.reset()
+    yield client
+    app.config['METRICS_DIR'] = ''
+    metrics.reset()
+
+
+def sample(text, line_start):
+    '''The value of the first exposition line starting with `line_start`'''
+    return next(float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_start))
+
+
+def test_requests_are_timed_and_counted(metrics_client):
+    for _ in range(3):
+        metrics_client.get('/login')
+    metrics_client.post('/register', data={
+        'email': 'user@example.com', 'password': 'password123', 'confirm-password': 'password123'})
+
+    text = metrics_client.get('/metrics').get_data(as_text=True)
+
+    assert '# TYPE fido_request_duration_seconds histogram' in text
+    assert sample(text, 'fido_requests_total{endpoint="login",method="GET",status="200"}') == 3
+    assert sample(text, 'fido_request_duration_seconds_count{endpoint="login",method="GET"}') == 3
+    assert sample(text, 'fido_request_duration_seconds_bucket{endpoint="login",method="GET",le="+Inf"}') == 3
+    assert sample(text, 'fido_db_queries_total{endpoint="register"}') > 0
+    assert sample(text, 'fido_operation_duration_seconds_count{operation="password_hash"}') == 1
+
+
+def test_metrics_are_internal_only(metrics_client):
+    response = metrics_client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'})
+    assert response.status_code == 404
+
+
+def test_histogram_buckets_are_cumulative(metrics_client):
+    for seconds in (0.0005, 0.001, 0.003, 20):
+        operation_duration.observe(seconds, operation='test')
+
+    text = metrics.render()
+
+    assert sample(text, 'fido_operation_duration_seconds_bucket{operation="test",le="0.001"}') == 2
+    assert sample(text, 'fido_operation_duration_seconds_bucket{operation="test",le="0.005"}') == 3
+    assert sample(text, 'fido_operation_duration_seconds_bucket{operation="test",le="10.0"}') == 3
+    assert sample(text, 'fido_operation_duration_seconds_bucket{operation="test",le="+Inf"}') == 4
+    assert sample(text, 'fido_operation_duration_seconds_sum{operation="test"}') == pytest.approx(20.0045)
+
+
+def test_counts_are_shared_across_processes(metrics_client, tmp_path):
+    app.config['METRICS_DIR'] = str(tmp_path)
+    operation_duration.observe(0.002, operation='test')
+
+    # A live worker and one that has exited, each with one observation of their own
+    worker = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    other = {'fido_operation_duration_seconds': {'["test"]': [0] * 3 + [1] + [0] * 10 + [0.003, 1]}}
+    try:
+        for pid in (worker.pid, exited.pid):
+            (tmp_path / f'metrics-{pid}.json').write_text(json.dumps(other))
+
+        text = metrics.render()
+        assert sample(text, 'fido_operation_duration_seconds_count{operation="test"}') == 3
+
+        # The exited worker's file is folded into the shared one and still counted
+        assert sorted(path.name for path in tmp_path.glob('metrics-*.json')) == [
+            f'metrics-{os.getpid()}.json', f'metrics-{worker.pid}.json', 'metrics-exited.json']
+        assert sample(metrics.render(), 'fido_operation_duration_seconds_count{operation="test"}') == 3
+    finally:
+        worker.kill()
+        worker.wait()
@@ -0,0 +1,156 @@
+'''
+Monthly interaction partitions, on SQLite's opt-in table-per-month stand-in (MariaDB's native
+partitions are only checked at the DDL level here)
+'''
+import csv
+from datetime import date, datetime
+import gzip
+from pathlib import Path
+from types import SimpleNamespace
+import click
+import pytest
+from flask_migrate import upgrade
+from fido_app import app, db
+from fido_app.interactions import insert_interaction_rows
+from fido_app.models import Interaction
+from fido_app.partitions import (
+    MariaDBInteractionPartitions, Partition, SQLiteInteractionPartitions, add_months, interaction_partitions,
+)
+
+MIGRATIONS = str(Path(__file__).resolve().parent.parent / 'migrations')
+OLD_MONTHS = [datetime(2022, 1, 15), datetime(2022, 2, 15), datetime(2022, 3, 15)]
+
+
+def interaction(timestamp, **overrides):
+    return {
+        'session_token': 'token', 'element': 'email', 'event': 'focus', 'login_method': 'password',
+        'page': '/login', 'timestamp': timestamp, 'group_id': 'group', **overrides,
+    }
+
+
+@pytest.fixture
+def migrated(tmp_path):
+    '''A migrated SQLite database with 2 interactions in each of three old months'''
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "partitions.db"}'
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        db.session.execute(Interaction.__table__.insert(), [interaction(month) for month in OLD_MONTHS * 2])
+        db.session.commit()
+
+        yield
+        db.session.remove()
+        with db.engine.begin() as connection:
+            partitions = interaction_partitions(connection)
+            if partitions.is_partitioned():
+                partitions.unpartition()
+        db.drop_all()
+
+
+@pytest.fixture
+def partitioned(migrated):
+    '''The migrated database, partitioned with `flask interaction-partitions create`'''
+    result = app.test_cli_runner().invoke(args=['interaction-partitions', 'create'])
+    assert result.exit_code == 0, result.output
+
+
+def partition_names():
+    with db.engine.connect() as connection:
+        return [partition.name for partition in interaction_partitions(connection).list()]
+
+
+def test_migration_leaves_sqlite_unpartitioned(migrated):
+    assert partition_names() == []
+
+    # So development databases can still add interactions through the model
+    db.session.add(Interaction(**interaction(datetime(2022, 2, 1))))
+    db.session.commit()
+    assert Interaction.query.count() == 7
+
+    result = app.test_cli_runner().invoke(args=['interaction-partitions', 'list'])
+    assert result.exit_code != 0
+    assert 'interaction-partitions create' in result.output
+
+
+def test_create_partitions_existing_rows(partitioned):
+    names = partition_names()
+
+    # One partition per month from the oldest interaction through three months from now
+    assert names[:3] == ['p202201', 'p202202', 'p202203']
+    assert names[-2:] == [f'p{add_months(date.today(), 3):%Y%m}', 'pmax']
+    assert len(names) == (date.today().year - 2022) * 12 + date.today().month + 3 + 1
+
+    # The model reads straight through the view
+    assert Interaction.query.count() == 6
+    assert Interaction.query.filter_by(session_token='token').count() == 6
+    assert sorted(i.id for i in Interaction.query) == [1, 2, 3, 4, 5, 6]
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT count(*) FROM interaction_p202202').scalar() == 2
+
+
+def test_inserts_are_routed_by_month(partitioned):
+    insert_interaction_rows(db.session, [interaction(datetime(2022, 2, 1)), interaction(datetime(2099, 1, 1))])
+    db.session.commit()
+
+    ids = sorted(i.id for i in Interaction.query)
+    assert ids == list(range(1, 9))
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT count(*) FROM interaction_p202202').scalar() == 3
+        assert connection.exec_driver_sql('SELECT count(*) FROM interaction_pmax').scalar() == 1
+
+
+def test_adding_partitions_moves_rows_out_of_pmax(partitioned):
+    db.session.execute(Interaction.__table__.insert(), [interaction(datetime(2099, 1, 5))])
+    db.session.commit()
+
+    with db.engine.begin() as connection:
+        partitions = SQLiteInteractionPartitions(connection)
+        assert partitions.add([date(2099, 1, 1), date(2022, 2, 1)]) == ['p209901']
+        with pytest.raises(click.ClickException):
+            partitions.add([date(2021, 1, 1)])
+
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT count(*) FROM interaction_p209901').scalar() == 1
+        assert connection.exec_driver_sql('SELECT count(*) FROM interaction_pmax').scalar() == 0
+    assert Interaction.query.count() == 7
+
+
+def test_archive_drops_old_partitions(partitioned, tmp_path):
+    # Keep March 2022 through the current month
+    keep_months = (date.today().year - 2022) * 12 + date.today().month - 2
+    archive_dir = tmp_path / 'archive'
+
+    result = app.test_cli_runner().invoke(args=[
+        'interaction-partitions', 'archive', '--keep-months', str(keep_months), '--archive-dir', str(archive_dir)])
+
+    assert result.exit_code == 0, result.output
+    assert sorted(path.name for path in archive_dir.iterdir()) == [
+        'interaction-p202201.csv.gz', 'interaction-p202202.csv.gz']
+    with gzip.open(archive_dir / 'interaction-p202202.csv.gz', 'rt') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['timestamp'][:10] for row in rows] == ['2022-02-15', '2022-02-15']
+
+    assert partition_names()[0] == 'p202203'
+    assert Interaction.query.count() == 2
+
+
+def test_archive_needs_a_retention_period(partitioned):
+    result = app.test_cli_runner().invoke(args=['interaction-partitions', 'archive'])
+    assert result.exit_code != 0
+    assert 'INTERACTION_RETENTION_MONTHS' in result.output
+
+
+def test_create_refuses_a_partitioned_table(partitioned):
+    result = app.test_cli_runner().invoke(args=['interaction-partitions', 'create'])
+    assert result.exit_code != 0
+    assert 'already partitioned' in result.output
+
+
+def test_other_databases_are_not_supported():
+    with pytest.raises(click.ClickException, match='not supported on postgresql'):
+        interaction_partitions(SimpleNamespace(dialect=SimpleNamespace(name='postgresql')))
+
+
+def test_mariadb_partition_definitions():
+    partitions = [Partition('p202203', None, date(2022, 4, 1)), Partition('pmax', date(2022, 4, 1), None)]
+    assert MariaDBInteractionPartitions._definitions(partitions) == (
+        "PARTITION p202203 VALUES LESS THAN ('2022-04-01'), PARTITION pmax VALUES LESS THAN (MAXVALUE)")
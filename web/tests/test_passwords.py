@@ -0,0 +1,81 @@
+import pytest
+from werkzeug.security import generate_password_hash
+from fido_app import app, db
+from fido_app.models import LoginAttempts, User
+from fido_app.passwords import PasswordHashingBusy, hash_parameters, password_hasher
+
+EMAIL = 'participant@example.com'
+PASSWORD = 'correct horse battery'
+
+
+@pytest.fixture
+def cheap_hashes():
+    method = app.config['PASSWORD_HASH_METHOD']
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    yield
+    app.config['PASSWORD_HASH_METHOD'] = method
+
+
+def test_hashes_with_configured_method(cheap_hashes):
+    password_hash = password_hasher.hash(PASSWORD)
+
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert password_hasher.verify(password_hash, PASSWORD)
+    assert not password_hasher.verify(password_hash, 'wrong password')
+    assert not password_hasher.needs_rehash(password_hash)
+
+
+def test_default_iterations_match_explicit_ones():
+    assert hash_parameters('pbkdf2:sha256') == hash_parameters('pbkdf2:sha256:260000')
+    assert hash_parameters('pbkdf2:sha256') != hash_parameters('pbkdf2:sha256:1000')
+    assert hash_parameters('pbkdf2:sha256') != hash_parameters('pbkdf2:sha512')
+
+    app.config['PASSWORD_HASH_METHOD'], method = 'pbkdf2:sha256', app.config['PASSWORD_HASH_METHOD']
+    try:
+        assert not password_hasher.needs_rehash('pbkdf2:sha256:260000$salt$hash')
+        assert password_hasher.needs_rehash('pbkdf2:sha256:150000$salt$hash')
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = method
+
+
+def test_login_rehashes_outdated_hash(client, cheap_hashes):
+    user = User(email=EMAIL, password_hash=generate_password_hash(PASSWORD, 'pbkdf2:sha256:2000'))
+    db.session.add(user)
+    db.session.commit()
+
+    response = client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+
+    assert response.headers['Location'].endswith('/profile')
+    assert User.query.filter_by(email=EMAIL).one().password_hash.startswith('pbkdf2:sha256:1000$')
+
+
+def test_process_pool(cheap_hashes):
+    app.config['PASSWORD_HASH_WORKERS'] = 2
+    try:
+        password_hash = password_hasher.hash(PASSWORD)
+        assert password_hasher.verify(password_hash, PASSWORD)
+    finally:
+        app.config['PASSWORD_HASH_WORKERS'] = 0
+        password_hasher.shutdown()
+
+
+def test_busy_pool_fails_fast(client, cheap_hashes):
+    db.session.add(User(email=EMAIL, password_hash=password_hasher.hash(PASSWORD)))
+    db.session.commit()
+
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_TIMEOUT=0.01)
+    _, slots = password_hasher._get_executor(1)
+    held = [slots.acquire(blocking=False) for _ in range(app.config['PASSWORD_HASH_CONCURRENCY'])]
+    try:
+        response = client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+        assert response.headers['Location'].endswith('/login')
+        assert LoginAttempts.query.count() == 0
+
+        with pytest.raises(PasswordHashingBusy):
+            password_hasher.hash(PASSWORD)
+    finally:
+        for acquired in held:
+            if acquired:
+                slots.release()
+        app.config.update(PASSWORD_HASH_WORKERS=0, PASSWORD_HASH_QUEUE_TIMEOUT=2.0)
+        password_hasher.shutdown()
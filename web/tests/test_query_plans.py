@@ -0,0 +1,70 @@
+'''
+Runs EXPLAIN on every hot query against a freshly migrated database and fails if any of
+them falls back to a full table scan. Runs against SQLite by default; set
+`EXPLAIN_DATABASE_URI` to a scratch MariaDB database (e.g. a local container) to check
+MariaDB's plans as well. That database's tables are dropped afterwards.
+'''
+import os
+from datetime import date
+from pathlib import Path
+import pytest
+from flask_migrate import upgrade
+from fido_app import app, db
+from fido_app.models import Credential, Interaction, InteractionTiming, LoginAttempts, Session, User
+from fido_app.utils import hash_credential_id
+
+MIGRATIONS = Path(__file__).resolve().parent.parent / 'migrations'
+
+HOT_QUERIES = {
+    'login attempts by email and date': lambda: LoginAttempts.query.filter_by(
+        email='participant@example.com', date=date.today().isoformat()),
+    'session by token': lambda: Session.query.filter_by(token='token'),
+    'sessions by user': lambda: Session.query.filter_by(user_id=1),
+    'interactions by session token': lambda: Interaction.query.filter_by(session_token='token'),
+    'credential by id': lambda: Credential.query.filter_by(credential_id_hash=hash_credential_id(b'credential')),
+    'credentials by user': lambda: Credential.query.filter_by(user_id=1),
+    'user by email': lambda: User.query.filter_by(email='participant@example.com'),
+    'user by id': lambda: User.query.filter_by(id=1),
+    'visit durations by page and login method': lambda: InteractionTiming.query.with_entities(
+        InteractionTiming.load_to_submit_ms).filter_by(page='/login', login_method='fido').filter(
+        InteractionTiming.load_to_submit_ms.isnot(None)).order_by(InteractionTiming.load_to_submit_ms),
+}
+
+DATABASES = ['sqlite']
+if os.getenv('EXPLAIN_DATABASE_URI'):
+    DATABASES.append(os.environ['EXPLAIN_DATABASE_URI'])
+
+
+def full_scans(query):
+    '''Returns the plan steps of `query` that read an entire table'''
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    connection = db.session.connection()
+
+    if db.engine.dialect.name == 'sqlite':
+        plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).fetchall()
+        return [row.detail for row in plan if row.detail.startswith('SCAN')]
+
+    plan = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).mappings().fetchall()
+    return [f'{row["table"]}: {row["type"]}' for row in plan if row['type'] == 'ALL']
+
+
+@pytest.fixture(scope='module', params=DATABASES)
+def migrated_db(request, tmp_path_factory):
+    uri = request.param
+    if uri == 'sqlite':
+        uri = f'sqlite:///{tmp_path_factory.mktemp("plans") / "plans.db"}'
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    with app.app_context():
+        upgrade(directory=str(MIGRATIONS))
+        yield
+        db.session.remove()
+        db.drop_all()
+        db.session.execute('DROP TABLE IF EXISTS alembic_version')
+        db.session.commit()
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_index(migrated_db, name):
+    assert full_scans(HOT_QUERIES[name]()) == []
@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+import pytest
+from fido_app import app
+from fido_app.models import LoginAttempts
+from fido_app.rate_limits import TokenBucketStore
+from fido_app.utils import get_rate_limits_from, parse_rate_limit
+
+FIVE_PER_MINUTE = (5, 60.0)
+
+
+@pytest.fixture
+def limited_client(client):
+    limits = app.config['RATE_LIMITS']
+    app.config.update(RATE_LIMIT_ENABLED=True, RATE_LIMITS={
+        'login': {'ip': (8, 60.0), 'email': (3, 60.0)},
+        'webauthn_login_start': {'ip': None, 'email': (2, 60.0)},
+    })
+    yield client
+    app.config.update(RATE_LIMIT_ENABLED=False, RATE_LIMITS=limits)
+
+
+def test_bucket_rejects_when_empty_then_refills(tmp_path):
+    store = TokenBucketStore(str(tmp_path / 'buckets.db'))
+
+    assert [store.take('key', FIVE_PER_MINUTE, now=100) for _ in range(5)] == [0] * 5
+    assert store.take('key', FIVE_PER_MINUTE, now=100) == pytest.approx(12)
+    # Rejected requests don't use up tokens, so one is back 12 seconds later
+    assert store.take('key', FIVE_PER_MINUTE, now=106) == pytest.approx(6)
+    assert store.take('key', FIVE_PER_MINUTE, now=112) == 0
+    assert store.take('key', FIVE_PER_MINUTE, now=112) > 0
+    assert store.take('other key', FIVE_PER_MINUTE, now=112) == 0
+
+
+def test_full_buckets_are_pruned(tmp_path):
+    store = TokenBucketStore(str(tmp_path / 'buckets.db'))
+    store.take('busy', FIVE_PER_MINUTE, now=100)
+    store.take('idle', FIVE_PER_MINUTE, now=40)
+
+    store.prune(now=100)
+
+    assert [key for key, in store.connection.execute('SELECT key FROM bucket')] == ['busy']
+
+
+def test_buckets_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'buckets.db')
+    store = TokenBucketStore(path)
+    store.take('key', FIVE_PER_MINUTE)
+
+    subprocess.run([sys.executable, '-c', (
+        'from fido_app.rate_limits import TokenBucketStore\n'
+        f'store = TokenBucketStore({path!r})\n'
+        f'assert [store.take("key", {FIVE_PER_MINUTE}) for _ in range(4)] == [0] * 4\n'
+    )], check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    assert store.take('key', FIVE_PER_MINUTE) > 0
+
+
+def test_login_attempts_are_limited_per_email(limited_client):
+    data = {'email': 'target@example.com', 'password': 'wrong password'}
+    assert [limited_client.post('/login', data=data).status_code for _ in range(4)] == [302, 302, 302, 429]
+
+    response = limited_client.post('/login', data={**data, 'email': 'TARGET@example.com'})
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 20
+    # The rejected attempts never reached the route
+    assert LoginAttempts.query.filter_by(email='target@example.com').one().password_failures == 3
+
+    assert limited_client.post('/login', data={**data, 'email': 'other@example.com'}).status_code == 302
+
+
+def test_login_attempts_are_limited_per_ip(limited_client):
+    statuses = [
+        limited_client.post('/login', data={'email': f'user{n}@example.com', 'password': 'wrong password'}).status_code
+        for n in range(9)
+    ]
+    assert statuses == [302] * 8 + [429]
+
+    other_ip = {'REMOTE_ADDR': '203.0.113.7'}
+    response = limited_client.post(
+        '/login', data={'email': 'user9@example.com', 'password': 'wrong password'}, environ_base=other_ip)
+    assert response.status_code == 302
+
+
+def test_json_endpoints_answer_with_a_redirect(limited_client):
+    for _ in range(2):
+        limited_client.post('/webauthn/login/start', data={'email': 'nobody@example.com'})
+
+    response = limited_client.post('/webauthn/login/start', data={'email': 'nobody@example.com'})
+
+    assert response.status_code == 429
+    assert response.json['redirect'] == '/login'
+    assert 'Retry-After' in response.headers
+
+
+def test_limits_can_be_disabled(limited_client):
+    app.config['RATE_LIMIT_ENABLED'] = False
+    data = {'email': 'target@example.com', 'password': 'wrong password'}
+    assert {limited_client.post('/login', data=data).status_code for _ in range(5)} == {302}
+
+
+def test_limits_are_configurable_per_endpoint():
+    limits = get_rate_limits_from({'RATE_LIMIT_LOGIN_EMAIL': '3/10', 'RATE_LIMIT_REGISTER_IP': ''})
+
+    assert limits['login'] == {'ip': (60, 60.0), 'email': (3, 10.0)}
+    assert limits['register']['ip'] is None
+    assert limits['webauthn_login_start']['email'] == (20, 60.0)
+    with pytest.raises(ValueError):
+        parse_rate_limit('0/60')
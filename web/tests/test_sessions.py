@@ -0,0 +1,136 @@
+import re
+import pytest
+from fido_app import app
+from fido_app.instrumentation import track_database_calls
+from fido_app.models import Session
+from fido_app.sessions import MemorySessionStore, ServerSideSessionInterface
+
+EMAIL = 'participant@example.com'
+PASSWORD = 'correct horse battery'
+
+
+def session_cookie(client):
+    cookie = next((c for c in client.cookie_jar if c.name == app.session_cookie_name), None)
+    return cookie and cookie.value
+
+
+def register(client):
+    client.post('/register', data={'email': EMAIL, 'password': PASSWORD, 'confirm-password': PASSWORD})
+
+
+def test_cookie_only_holds_session_id(client):
+    register(client)
+
+    cookie = session_cookie(client)
+    stored = Session.query.filter(Session.data.isnot(None)).one()
+    assert cookie.split('.')[0] == stored.token
+    assert len(cookie) < 80
+    assert '_user_id' in stored.data
+
+    assert client.get('/profile').status_code == 200
+
+
+def test_unchanged_session_is_not_saved(client):
+    client.get('/login')
+
+    with track_database_calls() as stats:
+        response = client.get('/login')
+
+    assert 'Set-Cookie' not in response.headers
+    # Only the session lookup; nothing is written back
+    assert stats.queries == 1
+
+
+def test_new_token_clears_old_session_data(client):
+    register(client)
+    old_cookie = session_cookie(client)
+
+    client.post('/delete-account')
+
+    assert session_cookie(client) != old_cookie
+    client.set_cookie('localhost', app.session_cookie_name, old_cookie)
+    assert client.get('/profile').status_code == 302
+
+
+def test_cookieless_requests_store_nothing(client):
+    response = client.get('/login')
+
+    assert session_cookie(client)
+    assert Session.query.count() == 0
+    # The anonymous session keeps its id, still without being stored
+    client.get('/login')
+    assert Session.query.count() == 0
+    assert 'Set-Cookie' not in client.get('/login').headers
+
+
+def test_forms_work_without_a_stored_session(client):
+    app.config.update(WTF_CSRF_ENABLED=True)
+    try:
+        page = client.get('/login').get_data(as_text=True)
+        csrf_token = re.search(r'name="csrf_token" value="([^"]+)"', page).group(1)
+        assert Session.query.count() == 0
+
+        # Fails on the password, not on the CSRF check
+        response = client.post('/login', data={'email': EMAIL, 'password': PASSWORD, 'csrf_token': csrf_token})
+        assert response.status_code == 302
+        assert client.post('/login', data={'email': EMAIL, 'password': PASSWORD}).status_code == 400
+    finally:
+        app.config.update(WTF_CSRF_ENABLED=False)
+
+
+def test_login_replaces_the_session_id(client):
+    register(client)
+    client.post('/logout')
+    client.get('/login')
+    planted_cookie = session_cookie(client)
+
+    with track_database_calls() as stats:
+        client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+
+    # Loading the session, saving it under its new id and clearing the old one, on top of the
+    # route's own queries (see test_login.py)
+    assert stats.queries <= 7
+    assert session_cookie(client) != planted_cookie
+    assert client.get('/profile').status_code == 200
+
+    # Whoever else holds the pre-login cookie is still anonymous
+    client.set_cookie('localhost', app.session_cookie_name, planted_cookie)
+    assert client.get('/profile').status_code == 302
+
+
+def test_logout_clears_stored_user(client):
+    register(client)
+    cookie = session_cookie(client)
+
+    client.post('/logout')
+
+    assert '_user_id' not in Session.query.filter(Session.data.isnot(None)).one().data
+    client.set_cookie('localhost', app.session_cookie_name, cookie)
+    assert client.get('/profile').status_code == 302
+
+
+@pytest.fixture
+def memory_sessions(client):
+    interface = app.session_interface
+    app.session_interface = ServerSideSessionInterface(MemorySessionStore(max_entries=2))
+    yield client
+    app.session_interface = interface
+
+
+def test_memory_store_round_trip(memory_sessions):
+    register(memory_sessions)
+
+    assert len(app.session_interface.store) == 1
+    assert memory_sessions.get('/profile').status_code == 200
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_entries=2)
+    store.save('a', 'session a')
+    store.save('b', 'session b')
+    store.load('a')
+    store.save('c', 'session c')
+
+    assert store.load('b') is None
+    assert store.load('a') == 'session a'
+    assert store.load('c') == 'session c'
@@ -0,0 +1,75 @@
+import pytest
+from fido_app import app, db
+from fido_app.instrumentation import track_database_calls
+from fido_app.models import Credential, User
+from fido_app.sessions import MemorySessionStore, ServerSideSessionInterface
+from fido_app.user_cache import load_cached_user, user_cache
+
+EMAIL = 'participant@example.com'
+PASSWORD = 'correct horse battery'
+
+
+@pytest.fixture
+def logged_in(client):
+    # Keep sessions in memory so the only database work left is loading the user
+    interface = app.session_interface
+    app.session_interface = ServerSideSessionInterface(MemorySessionStore())
+    client.post('/register', data={'email': EMAIL, 'password': PASSWORD, 'confirm-password': PASSWORD})
+    yield client
+    app.session_interface = interface
+
+
+def test_profile_loads_are_served_from_cache(logged_in):
+    logged_in.get('/profile')
+    hits = user_cache.hits
+
+    with track_database_calls() as stats:
+        response = logged_in.get('/profile')
+
+    assert response.status_code == 200
+    assert EMAIL.split('@')[0] in response.get_data(as_text=True)
+    assert stats.queries == 0
+    assert user_cache.hits == hits + 1
+
+
+def test_changing_the_user_invalidates_cache(client):
+    user = User(email=EMAIL, display_name='before')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+
+    assert load_cached_user(user_id).display_name == 'before'
+    assert len(user_cache) == 1
+
+    load_cached_user(user_id).set_password(PASSWORD)
+    db.session.commit()
+    db.session.remove()
+
+    assert len(user_cache) == 0
+    assert load_cached_user(user_id).password_hash is not None
+
+
+def test_deleting_account_invalidates_cache(logged_in):
+    logged_in.get('/profile')
+    user_id = User.query.filter_by(email=EMAIL).one().id
+
+    logged_in.post('/delete-account')
+
+    db.session.remove()
+    assert load_cached_user(user_id).email is None
+
+
+def test_cached_users_with_credentials_can_be_reattached(client):
+    user = User(email=EMAIL, credentials=[Credential(credential_id=b'id', public_key=b'key', sign_count=0)])
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+
+    load_cached_user(user_id)
+    for _ in range(2):
+        db.session.remove()
+        cached = load_cached_user(user_id)
+        assert [credential.credential_id for credential in cached.credentials] == [b'id']
+        assert cached.credentials[0].user is cached
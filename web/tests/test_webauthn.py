@@ -0,0 +1,148 @@
+import html
+import json
+import os
+import re
+import pytest
+from sqlalchemy import event
+from fido_app import db
+from .soft_authenticator import SoftAuthenticator
+from fido_app.models import Credential, LoginAttempts, WebAuthnChallenge
+from fido_app.public_keys import public_key_cache
+
+EMAIL = 'participant@example.com'
+
+
+def register(client, authenticator):
+    options = json.loads(client.post('/webauthn/registration/start', data={'email': EMAIL}).data)
+    return client.post('/webauthn/registration/verify-credentials', data=authenticator.create(options))
+
+
+def login(client, authenticator):
+    options = json.loads(client.post('/webauthn/login/start', data={'email': EMAIL}).data)
+    return client.post('/webauthn/login/verify-assertion', data=authenticator.get(options))
+
+
+@pytest.fixture
+def authenticator(request):
+    return SoftAuthenticator(os.environ['RP_ID'], os.environ['ORIGIN'], algorithm=request.param)
+
+
+@pytest.mark.parametrize('authenticator', ['ES256', 'RS256'], indirect=True)
+def test_register_and_login(client, authenticator):
+    assert register(client, authenticator).json == {'redirect': '/profile'}
+    assert Credential.query.one().public_key == authenticator.cose_public_key
+    client.post('/logout')
+
+    assert login(client, authenticator).json == {'redirect': '/profile'}
+    assert Credential.query.one().sign_count == 1
+    assert LoginAttempts.query.one().fido_successes == 1
+
+
+@pytest.mark.parametrize('authenticator', ['ES256'], indirect=True)
+def test_repeat_logins_reuse_parsed_public_key(client, authenticator):
+    public_key_cache.clear()
+    register(client, authenticator)
+    client.post('/logout')
+
+    login(client, authenticator)
+    client.post('/logout')
+    hits = public_key_cache.hits
+    assert login(client, authenticator).status_code == 200
+
+    assert public_key_cache.hits == hits + 1
+    assert len(public_key_cache) == 1
+
+
+@pytest.mark.parametrize('authenticator', ['ES256'], indirect=True)
+def test_bad_signature_is_rejected(client, authenticator):
+    register(client, authenticator)
+    client.post('/logout')
+
+    options = json.loads(client.post('/webauthn/login/start', data={'email': EMAIL}).data)
+    assertion = json.loads(authenticator.get(options))
+    assertion['response']['signature'] = assertion['response']['signature'][::-1]
+    response = client.post('/webauthn/login/verify-assertion', data=json.dumps(assertion))
+
+    assert response.status_code == 401
+    assert LoginAttempts.query.one().fido_failures == 1
+
+
+@pytest.mark.parametrize('authenticator', ['ES256'], indirect=True)
+def test_challenges_are_single_use(client, authenticator):
+    register(client, authenticator)
+    client.post('/logout')
+
+    options = json.loads(client.post('/webauthn/login/start', data={'email': EMAIL}).data)
+    assertion = authenticator.get(options)
+    with client.session_transaction() as session:
+        assert 'challenge' not in session['login']
+        handle = session['login']['handle']
+    assert client.post('/webauthn/login/verify-assertion', data=assertion).status_code == 200
+    client.post('/logout')
+
+    # Replaying the same assertion (even with the handle put back) finds no challenge
+    with client.session_transaction() as session:
+        session['login'] = {'handle': handle, 'email': EMAIL}
+    response = client.post('/webauthn/login/verify-assertion', data=assertion)
+    assert response.status_code == 401
+    assert response.json == {'redirect': '/login'}
+
+
+def login_page_options(client):
+    '''The usernameless login options and challenge handle embedded in the login page'''
+    page = client.get('/login').get_data(as_text=True)
+    options = re.search(r'data-webauthn-options="([^"]*)"', page).group(1)
+    handle = re.search(r'data-challenge-handle="([^"]*)"', page).group(1)
+    return json.loads(html.unescape(options)), handle
+
+
+@pytest.mark.parametrize('authenticator', ['ES256'], indirect=True)
+def test_usernameless_login(client, authenticator):
+    register(client, authenticator)
+    client.post('/logout')
+    options, handle = login_page_options(client)
+    assert options['allowCredentials'] == []
+
+    # One request, resolving the user from the credential alone (no lookup by email)
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.post('/webauthn/login/verify-assertion', data=authenticator.get(options),
+                               headers={'X-Challenge-Handle': handle})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert response.json == {'redirect': '/profile'}
+    assert not any('WHERE user.email =' in statement for statement in statements)
+    assert LoginAttempts.query.one().fido_successes == 1
+
+
+@pytest.mark.parametrize('authenticator', ['ES256'], indirect=True)
+def test_embedded_challenge_is_single_use(client, authenticator):
+    register(client, authenticator)
+    client.post('/logout')
+    options, handle = login_page_options(client)
+    # Rendering the login page stores nothing
+    assert WebAuthnChallenge.query.count() == 0
+
+    assertion = authenticator.get(options)
+    response = client.post('/webauthn/login/verify-assertion', data=assertion, headers={'X-Challenge-Handle': handle})
+    assert response.json == {'redirect': '/profile'}
+    client.post('/logout')
+
+    response = client.post('/webauthn/login/verify-assertion', data=authenticator.get(options),
+                           headers={'X-Challenge-Handle': handle})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('authenticator', ['ES256'], indirect=True)
+def test_usernameless_login_checks_the_user_handle(client, authenticator):
+    register(client, authenticator)
+    client.post('/logout')
+    options, handle = login_page_options(client)
+
+    response = client.post('/webauthn/login/verify-assertion', data=authenticator.get(options, user_handle=b'someone else'),
+                           headers={'X-Challenge-Handle': handle})
+
+    assert response.status_code == 401
+    assert LoginAttempts.query.one().fido_failures == 1